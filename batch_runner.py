@@ -0,0 +1,156 @@
+"""
+JSONLファイルのタスクを対話なしでまとめて実行するバッチランナー。
+N個のエージェントセッションを同時に走らせ、タスクごとの結果とスループットの集計を書き出す。
+
+    python batch_runner.py tasks.jsonl --concurrency 4 --output batch_results.jsonl
+
+各行は {"request_id": ..., "title": ..., "body": ...} か {"id": ..., "prompt": ...} の形式。
+"""
+import argparse
+import asyncio
+import json
+import math
+import os
+import re
+import time
+from typing import Iterator, Optional, Tuple
+
+import tracing
+from main_gpt import TRACE_FORMAT, TRACE_PATH, get_scheduler, new_process_supervisor, print_trace_summary, run_agent_task
+
+DEFAULT_CONCURRENCY = 4
+DEFAULT_WORKDIR_ROOT = "batch_sessions"
+
+
+def iter_tasks(path: str) -> Iterator[Tuple[str, str]]:
+    """
+    JSONLファイルを1行ずつ読み、(task_id, prompt)を順に返す
+    """
+    with open(path, "r") as f:
+        for line_number, line in enumerate(f, start=1):
+            line = line.strip()
+            if not line:
+                continue
+            task = json.loads(line)
+            task_id = str(task.get("request_id") or task.get("id") or task.get("task_id") or f"task_{line_number}")
+            if "prompt" in task:
+                prompt = task["prompt"]
+            else:
+                prompt = "\n\n".join(part for part in (task.get("title"), task.get("body")) if part)
+            yield task_id, prompt
+
+
+def percentile(values: list[float], p: float) -> Optional[float]:
+    if not values:
+        return None
+    ordered = sorted(values)
+    # Nearest-rank percentile
+    rank = max(1, math.ceil(p / 100 * len(ordered)))
+    return ordered[rank - 1]
+
+
+async def run_task(task_id: str, prompt: str, workdir_root: str, token_budget: Optional[int]) -> dict:
+    workdir = os.path.join(workdir_root, re.sub(r"[^A-Za-z0-9_.-]", "_", task_id))
+    os.makedirs(workdir, exist_ok=True)
+    token_sum_state = {"input": 0, "output": 0}
+    supervisor = new_process_supervisor()
+    started = time.perf_counter()
+    record = {"task_id": task_id, "workdir": workdir}
+    try:
+        result, token_sum_state = await run_agent_task(
+            prompt,
+            token_sum_state,
+            supervisor,
+            workdir=os.path.abspath(workdir),
+            token_budget=token_budget,
+            render=False
+        )
+        record.update(
+            status=result["status"],
+            iterations=result["iterations"],
+            final_message=result["final_message"],
+            context_tokens_saved=result["context_tokens_saved"],
+            tool_cache=result["tool_cache"]
+        )
+    except Exception as e:
+        record.update(status="error", error=str(e))
+    finally:
+        supervisor.close()
+    record["processes"] = supervisor.stats()
+    record["tokens"] = token_sum_state
+    record["wall_time"] = time.perf_counter() - started
+    return record
+
+
+async def run_batch(tasks_path: str, output_path: str, concurrency: int, workdir_root: str, token_budget: Optional[int]) -> dict:
+    """
+    タスクをキューに流し込み、concurrency個のセッションで並行に処理する
+    """
+    queue: asyncio.Queue = asyncio.Queue(maxsize=concurrency * 2)
+    records: list[dict] = []
+    started = time.perf_counter()
+
+    with open(output_path, "w") as output:
+        async def worker() -> None:
+            while True:
+                item = await queue.get()
+                if item is None:
+                    return
+                task_id, prompt = item
+                print(f"[batch] started {task_id}")
+                record = await run_task(task_id, prompt, workdir_root, token_budget)
+                records.append(record)
+                output.write(json.dumps(record, ensure_ascii=False) + "\n")
+                output.flush()
+                print(f"[batch] finished {task_id}: {record['status']} in {record['wall_time']:.1f}s")
+
+        workers = [asyncio.create_task(worker()) for _ in range(concurrency)]
+        for task in iter_tasks(tasks_path):
+            await queue.put(task)
+        for _ in workers:
+            await queue.put(None)
+        await asyncio.gather(*workers)
+
+    elapsed = time.perf_counter() - started
+    wall_times = [record["wall_time"] for record in records]
+    total_tokens = sum(record["tokens"]["input"] + record["tokens"]["output"] for record in records)
+    return {
+        "tasks": len(records),
+        "succeeded": sum(1 for record in records if record["status"] == "complete"),
+        "failed": sum(1 for record in records if record["status"] == "error"),
+        "concurrency": concurrency,
+        "elapsed": elapsed,
+        "tasks_per_min": len(records) / elapsed * 60 if elapsed > 0 else 0.0,
+        "tokens_per_task": total_tokens / len(records) if records else 0.0,
+        "wall_time_p50": percentile(wall_times, 50),
+        "wall_time_p95": percentile(wall_times, 95),
+        "scheduler": get_scheduler().stats(),
+        "trace_hotspots": tracing.tracer.summary()
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run agent tasks from a JSONL file without interaction.")
+    parser.add_argument("tasks", help="JSONL file with one task per line")
+    parser.add_argument("--concurrency", type=int, default=DEFAULT_CONCURRENCY, help="number of agent sessions run at once")
+    parser.add_argument("--output", default="batch_results.jsonl", help="where to write one result record per task")
+    parser.add_argument("--summary", default=None, help="where to write the throughput summary (defaults to <output>.summary.json)")
+    parser.add_argument("--workdir-root", default=DEFAULT_WORKDIR_ROOT, help="parent directory of the per-task working directories")
+    parser.add_argument("--token-budget", type=int, default=None, help="stop a task once it has used this many tokens")
+    parser.add_argument("--trace", default=TRACE_PATH, help="write spans to this file (defaults to $TRACE_PATH)")
+    parser.add_argument("--trace-format", default=TRACE_FORMAT, choices=tracing.TRACE_FORMATS, help="span export format")
+    args = parser.parse_args()
+
+    tracing.configure(args.trace, args.trace_format)
+
+    summary = asyncio.run(run_batch(args.tasks, args.output, args.concurrency, args.workdir_root, args.token_budget))
+    summary_path = args.summary or os.path.splitext(args.output)[0] + ".summary.json"
+    with open(summary_path, "w") as f:
+        f.write(json.dumps(summary, indent=4))
+    print(json.dumps(summary, indent=4))
+    print_trace_summary()
+    tracing.tracer.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,250 @@
+"""
+OpenAIを呼ばずにエージェントループ自体のオーバーヘッドを測るベンチマーク。
+main_gpt.get_litellm().acompletionをScriptedLLMに差し替えてReact TODOのタスク(test_prompt.md)を再生し、
+イテレーションあたりのループのオーバーヘッド、ツール実行のレイテンシ、execute_codeのcold/warm、
+履歴のシリアライズ時間(一括とセッションログへの追記)、ピークRSSをJSONに書き出す。
+結果はbaseline(既定はbenchmarks/baseline_agent_loop.json)と比べ、悪化していれば終了コード1を返す。
+数値はマシンに依存するのでbaselineはリポジトリに含めていない。まだ無ければその回の結果をbaselineとして保存し、
+次の実行からそれと比べる。作り直すときは--update-baselineを使う。
+
+    python benchmarks/bench_agent_loop.py                  # 初回はbaselineを作り、2回目からは比較する
+    python benchmarks/bench_agent_loop.py --repeat 5 --output bench_agent_loop.json --baseline other_baseline.json
+    python benchmarks/bench_agent_loop.py --update-baseline benchmarks/baseline_agent_loop.json
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import resource
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import main_gpt
+from batch_runner import percentile
+from fake_llm import REACT_TODO_SCRIPT, ScriptedLLM
+from session_log import SessionLog
+from tool_dispatcher import ToolDispatcher
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DEFAULT_BASELINE = os.path.join(ROOT, "benchmarks", "baseline_agent_loop.json")
+DEFAULT_TOLERANCE = 0.2
+# Differences smaller than this (ms or MB) are noise, whatever the ratio
+DEFAULT_MIN_DELTA = 1.0
+
+
+class TimedDispatcher(ToolDispatcher):
+    """
+    dispatchにかかった時間を記録するToolDispatcher
+    """
+    batches: list[tuple[float, int]] = []
+
+    async def dispatch(self, tool_calls: list[dict], on_result=None) -> list[dict]:
+        start = time.perf_counter()
+        messages = await super().dispatch(tool_calls, on_result)
+        TimedDispatcher.batches.append((time.perf_counter() - start, len(tool_calls)))
+        return messages
+
+
+def peak_rss_mb(who: int) -> float:
+    # ru_maxrss is in kilobytes on Linux and in bytes on macOS
+    peak = resource.getrusage(who).ru_maxrss
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+
+async def measure_agent_loop(llm: ScriptedLLM, prompt: str, repeat: int) -> tuple[dict, list]:
+    iteration_overheads = []
+    per_call = []
+    history = []
+    for _ in range(repeat):
+        llm.reset()
+        llm.model_time = 0.0
+        TimedDispatcher.batches.clear()
+        with tempfile.TemporaryDirectory() as workdir:
+            supervisor = main_gpt.new_process_supervisor()
+            start = time.perf_counter()
+            result, _ = await main_gpt.run_agent_task(prompt, {"input": 0, "output": 0}, supervisor, workdir, render=False)
+            elapsed = time.perf_counter() - start
+            supervisor.close()
+        if result["status"] != "complete":
+            sys.exit(f"scripted task did not complete: {result['status']}")
+        dispatch_time = sum(seconds for seconds, _ in TimedDispatcher.batches)
+        iteration_overheads.append((elapsed - llm.model_time - dispatch_time) / result["iterations"])
+        per_call.extend(seconds / count for seconds, count in TimedDispatcher.batches if count)
+        history = result["message_history"]
+
+    return {
+        "loop_overhead_per_iteration_ms": statistics.median(iteration_overheads) * 1000,
+        "tool_dispatch_per_call_p50_ms": percentile(per_call, 50) * 1000,
+        "tool_dispatch_per_call_p95_ms": percentile(per_call, 95) * 1000,
+    }, history
+
+
+async def async_noop(args: dict) -> str:
+    return ""
+
+
+async def measure_dispatch_overhead(rounds: int) -> dict:
+    """
+    何もしないハンドラを使い、ToolDispatcher自体のコスト(JSONのパース・スレッドへの受け渡し)だけを測る
+    """
+    dispatcher = ToolDispatcher({"noop": lambda args: "", "anoop": async_noop}, main_gpt.MAX_TOOL_CONCURRENCY)
+    tool_calls = [
+        {"id": f"call_{i}", "type": "function", "function": {"name": "noop" if i % 2 else "anoop", "arguments": "{}"}}
+        for i in range(4)
+    ]
+    latencies = []
+    try:
+        for _ in range(rounds):
+            start = time.perf_counter()
+            await dispatcher.dispatch(tool_calls)
+            latencies.append(time.perf_counter() - start)
+    finally:
+        dispatcher.shutdown()
+    return {"dispatch_overhead_per_batch_p50_ms": percentile(latencies, 50) * 1000}
+
+
+async def measure_execute_code(runs: int) -> dict:
+    main_gpt.setup_virtual_environment()
+    code = "print(sum(range(1000)))"
+    with tempfile.TemporaryDirectory() as workdir:
+        supervisor = main_gpt.new_process_supervisor()
+        # Cold: the first call of a session, which starts the interpreter pool
+        if main_gpt._interpreter_pool is not None:
+            await main_gpt._interpreter_pool.close()
+            main_gpt._interpreter_pool = None
+        start = time.perf_counter()
+        await main_gpt.execute_code(code, supervisor, cwd=workdir, use_pool=True)
+        cold = time.perf_counter() - start
+
+        warm = []
+        for _ in range(runs):
+            start = time.perf_counter()
+            await main_gpt.execute_code(code, supervisor, cwd=workdir, use_pool=True)
+            warm.append(time.perf_counter() - start)
+
+        shell = []
+        for _ in range(max(1, runs // 4)):
+            start = time.perf_counter()
+            await main_gpt.execute_code(code, supervisor, cwd=workdir, use_pool=False)
+            shell.append(time.perf_counter() - start)
+        supervisor.close()
+    return {
+        "execute_code_cold_ms": cold * 1000,
+        "execute_code_warm_p50_ms": percentile(warm, 50) * 1000,
+        "execute_code_shell_p50_ms": percentile(shell, 50) * 1000,
+    }
+
+
+def measure_serialization(history: list, rounds: int) -> dict:
+    """
+    履歴全体を1回でJSONにする場合と、SessionLogに1件ずつ追記する場合(実際の経路)のコストを測る
+    """
+    start = time.perf_counter()
+    for _ in range(rounds):
+        data = json.dumps(history, indent=4, default=lambda x: x.__dict__)
+    dump = (time.perf_counter() - start) / rounds
+    with tempfile.TemporaryDirectory() as directory:
+        session_log = SessionLog(os.path.join(directory, "bench.jsonl"), fsync="never")
+        start = time.perf_counter()
+        for _ in range(rounds):
+            for message in history:
+                session_log.append(message)
+        append = (time.perf_counter() - start) / (rounds * len(history))
+        session_log.close()
+    return {"history_dump_ms": dump * 1000, "session_log_append_per_message_ms": append * 1000, "history_bytes": len(data)}
+
+
+async def run(args: argparse.Namespace) -> dict:
+    with open(os.path.join(ROOT, "test_prompt.md"), "r") as f:
+        prompt = f.read()
+    llm = ScriptedLLM(REACT_TODO_SCRIPT, args.first_token_latency, args.chunk_latency)
+    main_gpt.get_litellm().acompletion = llm.acompletion
+    main_gpt.ToolDispatcher = TimedDispatcher
+    main_gpt.COMPLETION_CACHE_MODE = "off"
+
+    metrics = {}
+    loop_metrics, history = await measure_agent_loop(llm, prompt, args.repeat)
+    metrics.update(loop_metrics)
+    metrics.update(await measure_dispatch_overhead(args.dispatch_rounds))
+    metrics.update(await measure_execute_code(args.execute_runs))
+    metrics.update(measure_serialization(history, args.serialization_rounds))
+    if main_gpt._interpreter_pool is not None:
+        await main_gpt._interpreter_pool.close()
+    metrics["peak_rss_mb"] = peak_rss_mb(resource.RUSAGE_SELF)
+    metrics["peak_rss_children_mb"] = peak_rss_mb(resource.RUSAGE_CHILDREN)
+    return {
+        "benchmark": "agent_loop",
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "config": {
+            "repeat": args.repeat,
+            "first_token_latency": args.first_token_latency,
+            "chunk_latency": args.chunk_latency,
+            "llm_calls": llm.calls,
+        },
+        "metrics": metrics
+    }
+
+
+def compare(metrics: dict, baseline: dict, tolerance: float, min_delta: float) -> list[str]:
+    """
+    baselineより(1 + tolerance)倍以上かつmin_delta以上悪化した指標を返す。指標はどれも小さいほど良い
+    """
+    regressions = []
+    for name, previous in baseline["metrics"].items():
+        current = metrics.get(name)
+        if current is None or name == "history_bytes":
+            continue
+        if current > previous * (1 + tolerance) and current - previous > min_delta:
+            regressions.append(f"{name}: {previous:.2f} -> {current:.2f} (+{(current / previous - 1) * 100 if previous else float('inf'):.0f}%)")
+    return regressions
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Benchmark the agent loop offline with a scripted stand-in LLM.")
+    parser.add_argument("--repeat", type=int, default=5, help="how many times to replay the scripted task")
+    parser.add_argument("--first-token-latency", type=float, default=0.0, help="simulated seconds before the first chunk")
+    parser.add_argument("--chunk-latency", type=float, default=0.0, help="simulated seconds between chunks")
+    parser.add_argument("--dispatch-rounds", type=int, default=500)
+    parser.add_argument("--execute-runs", type=int, default=20)
+    parser.add_argument("--serialization-rounds", type=int, default=200)
+    parser.add_argument("--output", default="bench_agent_loop.json", help="where to write the results")
+    parser.add_argument("--baseline", default=DEFAULT_BASELINE,
+                        help="compare against this stored result and fail on regressions; written from this run if missing")
+    parser.add_argument("--update-baseline", default=None, help="also store the results as the new baseline at this path")
+    parser.add_argument("--tolerance", type=float, default=DEFAULT_TOLERANCE, help="allowed relative slowdown")
+    parser.add_argument("--min-delta", type=float, default=DEFAULT_MIN_DELTA, help="ignore slowdowns smaller than this (ms or MB)")
+    args = parser.parse_args()
+
+    results = asyncio.run(run(args))
+    for path in filter(None, (args.output, args.update_baseline)):
+        with open(path, "w") as f:
+            f.write(json.dumps(results, indent=4))
+    for name, value in results["metrics"].items():
+        print(f"{name:>36}: {value:10.2f}")
+
+    if args.baseline and not args.update_baseline:
+        if not os.path.exists(args.baseline):
+            # First run on this machine: these results become what later runs are compared against
+            with open(args.baseline, "w") as f:
+                f.write(json.dumps(results, indent=4))
+            print(f"no baseline yet; stored these results as {args.baseline}")
+            return
+        with open(args.baseline, "r") as f:
+            baseline = json.load(f)
+        regressions = compare(results["metrics"], baseline, args.tolerance, args.min_delta)
+        if regressions:
+            print("regressions against baseline:")
+            for regression in regressions:
+                print(f"  {regression}")
+            sys.exit(1)
+        print("no regressions against baseline")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,65 @@
+"""
+execute_codeの1回あたりのレイテンシを、シェル経由で毎回pythonを起動する従来の経路と
+InterpreterPoolの経路で比較するベンチマーク。
+
+    python benchmarks/bench_execute_code.py --runs 20
+"""
+import argparse
+import asyncio
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import main_gpt
+
+SNIPPETS = [
+    "print(sum(range(1000)))",
+    "import json\nprint(json.dumps({'a': [1, 2, 3]}))",
+    "import re\nprint(re.findall(r'\\d+', 'a1b22c333'))",
+]
+
+
+async def measure(use_pool: bool, runs: int, workdir: str) -> list[float]:
+    supervisor = main_gpt.new_process_supervisor()
+    latencies = []
+    for i in range(runs):
+        code = SNIPPETS[i % len(SNIPPETS)]
+        start = time.perf_counter()
+        _, result, _ = await main_gpt.execute_code(code, supervisor, cwd=workdir, use_pool=use_pool)
+        latencies.append(time.perf_counter() - start)
+        if "Return Code: 0" not in result:
+            sys.exit(f"snippet failed:\n{result}")
+    supervisor.close()
+    return latencies
+
+
+def report(name: str, latencies: list[float]) -> None:
+    ordered = sorted(latencies)
+    p95 = ordered[max(0, int(len(ordered) * 0.95) - 1)]
+    print(f"{name:>6}: mean {statistics.mean(latencies) * 1000:7.1f} ms, "
+          f"median {statistics.median(latencies) * 1000:7.1f} ms, p95 {p95 * 1000:7.1f} ms")
+
+
+async def run(runs: int) -> None:
+    # Make sure the venv exists so neither path pays for creating it
+    main_gpt.setup_virtual_environment()
+    with tempfile.TemporaryDirectory() as workdir:
+        shell = await measure(False, runs, workdir)
+        # Warm the pool up front: the point is the steady-state per-call cost
+        await main_gpt.get_interpreter_pool()
+        pool = await measure(True, runs, workdir)
+        await (await main_gpt.get_interpreter_pool()).close()
+
+    report("shell", shell)
+    report("pool", pool)
+    print(f"speedup (median): {statistics.median(shell) / statistics.median(pool):.1f}x")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--runs", type=int, default=20)
+    asyncio.run(run(parser.parse_args().runs))
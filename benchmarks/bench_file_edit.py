@@ -0,0 +1,90 @@
+"""
+3,000行のファイルに対する典型的な小さな編集について、
+従来のread_file(全体)+update_file(全体)と、read_file(行範囲)+apply_patchの
+トークン数と所要時間を比べるベンチマーク。
+
+    python benchmarks/bench_file_edit.py
+"""
+import json
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import litellm
+
+import main_gpt
+
+LINES = 3000
+TARGET_LINE = 1500
+# The return line of the function around TARGET_LINE; both variants make the same edit to it
+TARGET_TEXT = f"    return value * {TARGET_LINE // 3}\n"
+
+
+def make_source() -> str:
+    return "".join(
+        f"def function_{i}(value):\n    return value * {i}\n\n" for i in range(LINES // 3)
+    )
+
+
+def tokens(text: str) -> int:
+    return litellm.token_counter(model=main_gpt.MODEL, text=text)
+
+
+def whole_file_edit(path: str) -> dict:
+    start = time.perf_counter()
+    read_result = main_gpt.read_file(path)
+    content = read_result.split("\n", 1)[1]
+    lines = content.splitlines(keepends=True)
+    target = lines.index(TARGET_TEXT)
+    lines[target] = lines[target].replace("value *", "value +")
+    arguments = json.dumps({"path": path, "content": "".join(lines)})
+    update_result = main_gpt.update_file(path, "".join(lines))
+    elapsed = time.perf_counter() - start
+    return {
+        "tokens_in": tokens(read_result) + tokens(update_result),
+        "tokens_out": tokens(arguments),
+        "wall_time_ms": elapsed * 1000
+    }
+
+
+def ranged_edit(path: str) -> dict:
+    start = time.perf_counter()
+    read_result = main_gpt.read_file(path, TARGET_LINE - 2, TARGET_LINE + 4)
+    digest = read_result.split("sha256 of whole file: ", 1)[1].split(")", 1)[0]
+    snippet = read_result.split("\n", 1)[1].splitlines(keepends=True)
+    target = next(line for line in snippet if line == TARGET_TEXT)
+    edits = [{"search": target, "replace": target.replace("value *", "value +")}]
+    arguments = json.dumps({"path": path, "edits": edits, "expected_sha256": digest})
+    patch_result = main_gpt.apply_patch(path, edits=edits, expected_sha256=digest)
+    elapsed = time.perf_counter() - start
+    if not patch_result.startswith("Applied"):
+        sys.exit(patch_result)
+    return {
+        "tokens_in": tokens(read_result) + tokens(patch_result),
+        "tokens_out": tokens(arguments),
+        "wall_time_ms": elapsed * 1000
+    }
+
+
+def main() -> None:
+    with tempfile.TemporaryDirectory() as workdir:
+        path = os.path.join(workdir, "module.py")
+        results = {}
+        for name, edit in (("whole_file", whole_file_edit), ("ranged_patch", ranged_edit)):
+            with open(path, "w") as f:
+                f.write(make_source())
+            results[name] = edit(path)
+
+    for name, result in results.items():
+        print(f"{name:>12}: tokens in {result['tokens_in']:6d}, tokens out {result['tokens_out']:6d}, "
+              f"wall time {result['wall_time_ms']:.2f} ms")
+    saved = 1 - (results["ranged_patch"]["tokens_in"] + results["ranged_patch"]["tokens_out"]) / \
+        (results["whole_file"]["tokens_in"] + results["whole_file"]["tokens_out"])
+    print(f"tokens saved per edit: {saved:.1%}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,77 @@
+"""
+RequestSchedulerをローカルの代役サーバ(fake_openai_server.py)に向けて試すベンチマーク。
+同時に多数のrequest_completionを投げ、429/503が混ざっても全部成功すること、
+再試行とフォールバックがスケジューラ自身で起きたことを確かめ、
+レート制限の待ち時間・再試行回数・フォールバックの回数を表示する。
+
+    python benchmarks/bench_scheduler.py --requests 40 --rpm 120 --rate-limit-every 4 --fallback-model gpt-3.5-turbo
+"""
+import argparse
+import asyncio
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from fake_openai_server import start_in_thread
+
+
+async def run(args: argparse.Namespace, main_gpt) -> list:
+    async def one(i: int):
+        messages = [{"role": "system", "content": "You are a stand-in."}, {"role": "user", "content": f"request {i}"}]
+        return await main_gpt.request_completion(messages, [], render=False, prompt_tokens=20, priority=i % 3)
+
+    return await asyncio.gather(*(one(i) for i in range(args.requests)), return_exceptions=True)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Exercise the request scheduler against a local stand-in server.")
+    parser.add_argument("--requests", type=int, default=40)
+    parser.add_argument("--rpm", type=float, default=120, help="requests/min limit given to the scheduler")
+    parser.add_argument("--tpm", type=float, default=None, help="tokens/min limit given to the scheduler")
+    parser.add_argument("--latency", type=float, default=0.05)
+    parser.add_argument("--rate-limit-every", type=int, default=4)
+    parser.add_argument("--retry-after", type=float, default=0.5)
+    parser.add_argument("--error-rate", type=float, default=0.05)
+    parser.add_argument("--fallback-model", default=None, help="model the stand-in never throttles, used as the fallback")
+    args = parser.parse_args()
+
+    server = start_in_thread(
+        latency=args.latency, rate_limit_every=args.rate_limit_every, retry_after=args.retry_after,
+        error_rate=args.error_rate, throttled_models=frozenset({"gpt-4o-mini"}) if args.fallback_model else frozenset()
+    )
+    os.environ["OPENAI_API_BASE"] = f"http://127.0.0.1:{server.server_port}/v1"
+    os.environ.setdefault("OPENAI_API_KEY", "stand-in")
+
+    import main_gpt
+    main_gpt.COMPLETION_CACHE_MODE = "off"
+    main_gpt.RATE_LIMITS = {main_gpt.MODEL: (args.rpm, args.tpm)}
+    main_gpt.FALLBACK_MODEL = args.fallback_model
+    main_gpt.RETRY_BASE_DELAY = 0.1
+    main_gpt.RETRY_MAX_DELAY = 2.0
+
+    start = time.perf_counter()
+    results = asyncio.run(run(args, main_gpt))
+    elapsed = time.perf_counter() - start
+    server.shutdown()
+
+    failures = [result for result in results if isinstance(result, BaseException)]
+    print(f"requests: {args.requests}, failed: {len(failures)}, wall time: {elapsed:.2f}s")
+    print("server:", json.dumps(server.counts))
+    print("scheduler:", json.dumps(main_gpt.get_scheduler().stats(), indent=4))
+    for failure in failures[:3]:
+        print(f"  {type(failure).__name__}: {failure}")
+    if failures:
+        sys.exit(1)
+    # Every request succeeding proves nothing if something below the scheduler quietly absorbed the errors
+    stats = main_gpt.get_scheduler().stats()
+    if args.rate_limit_every or args.error_rate:
+        assert stats["retries"] > 0, "the stand-in returned errors but the scheduler never retried"
+    if args.fallback_model:
+        assert stats["fallbacks"] > 0, "the primary model was throttled but the scheduler never fell back"
+
+
+if __name__ == "__main__":
+    main()
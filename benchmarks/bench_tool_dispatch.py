@@ -0,0 +1,57 @@
+"""
+ToolDispatcherの並行実行のベンチマーク。
+read_file相当(スレッドで実行されるブロッキング処理)とexecute_code相当(async処理)を1ターン分混ぜて実行し、
+全体の所要時間が各呼び出しの合計ではなく最も遅い呼び出しに近いことを確認する。
+
+    python benchmarks/bench_tool_dispatch.py
+"""
+import asyncio
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from tool_dispatcher import ToolDispatcher
+
+
+def make_tool_call(call_id: str, name: str, delay: float) -> dict:
+    return {
+        "id": call_id,
+        "type": "function",
+        "function": {"name": name, "arguments": json.dumps({"delay": delay})}
+    }
+
+
+def blocking_read(args: dict) -> str:
+    time.sleep(args["delay"])
+    return f"read {args['delay']}"
+
+
+async def async_execute(args: dict) -> str:
+    await asyncio.sleep(args["delay"])
+    return f"executed {args['delay']}"
+
+
+async def run() -> None:
+    dispatcher = ToolDispatcher({"read_file": blocking_read, "execute_code": async_execute}, max_concurrency=8)
+    delays = [("read_file", 0.2)] * 5 + [("execute_code", 0.5), ("execute_code", 0.3)]
+    tool_calls = [make_tool_call(f"call_{i}", name, delay) for i, (name, delay) in enumerate(delays)]
+
+    start = time.perf_counter()
+    messages = await dispatcher.dispatch(tool_calls)
+    elapsed = time.perf_counter() - start
+    dispatcher.shutdown()
+
+    assert [m["tool_call_id"] for m in messages] == [tc["id"] for tc in tool_calls]
+    slowest = max(delay for _, delay in delays)
+    total = sum(delay for _, delay in delays)
+    print(f"tool calls: {len(tool_calls)}")
+    print(f"sequential (sum): {total:.2f}s, slowest: {slowest:.2f}s, concurrent wall time: {elapsed:.2f}s")
+    if elapsed > slowest * 1.5:
+        sys.exit("concurrent dispatch is not close to the slowest call")
+
+
+if __name__ == "__main__":
+    asyncio.run(run())
@@ -0,0 +1,170 @@
+"""
+ベンチマーク用の決まった応答を返すLLMの代役。litellm.acompletion(stream=True)と同じ形のチャンクを返すので、
+main_gpt.get_litellm().acompletionを差し替えればOpenAIを呼ばずにエージェントループを最後まで回せる。
+"""
+import asyncio
+import json
+import time
+from types import SimpleNamespace
+from typing import Optional
+
+COMPLETE_PHRASE = "AUTOMODE_COMPLETE"
+
+APP_TSX = """import { useEffect, useState } from "react";
+
+type Todo = { id: number; text: string };
+
+const STORAGE_KEY = "todos";
+
+export default function App() {
+  const [todos, setTodos] = useState<Todo[]>(() => JSON.parse(localStorage.getItem(STORAGE_KEY) ?? "[]"));
+  const [text, setText] = useState("");
+
+  useEffect(() => {
+    localStorage.setItem(STORAGE_KEY, JSON.stringify(todos));
+  }, [todos]);
+
+  const addTodo = () => {
+    if (!text.trim()) return;
+    setTodos([...todos, { id: Date.now(), text: text.trim() }]);
+    setText("");
+  };
+
+  return (
+    <div className="mx-auto max-w-md p-4">
+      <h1 className="mb-4 text-2xl font-bold">TODO</h1>
+      <div className="flex gap-2">
+        <input className="flex-1 rounded border p-2" value={text} onChange={(e) => setText(e.target.value)} />
+        <button className="rounded bg-blue-500 px-4 text-white" onClick={addTodo}>Add</button>
+      </div>
+      <ul className="mt-4 space-y-2">
+        {todos.map((todo) => (
+          <li key={todo.id} className="flex justify-between rounded border p-2">
+            {todo.text}
+            <button onClick={() => setTodos(todos.filter((t) => t.id !== todo.id))}>Remove</button>
+          </li>
+        ))}
+      </ul>
+    </div>
+  );
+}
+"""
+
+PACKAGE_JSON = json.dumps({
+    "name": "todo-app-otter",
+    "private": True,
+    "type": "module",
+    "scripts": {"dev": "vite", "build": "tsc && vite build"},
+    "dependencies": {"react": "^18.3.1", "react-dom": "^18.3.1"},
+    "devDependencies": {
+        "@types/react": "^18.3.3", "@vitejs/plugin-react": "^4.3.1", "autoprefixer": "^10.4.19",
+        "postcss": "^8.4.39", "tailwindcss": "^3.4.4", "typescript": "^5.5.3", "vite": "^5.3.4"
+    }
+}, indent=2)
+
+CHECK_PROJECT = """import json, os
+root = "todo-app-otter"
+package = json.load(open(os.path.join(root, "package.json")))
+print(sorted(package["dependencies"]))
+print(sum(len(files) for _, _, files in os.walk(root)), "files")
+"""
+
+
+def _call(function_name: str, **arguments) -> dict:
+    return {"name": function_name, "arguments": json.dumps(arguments)}
+
+
+# The React TODO task from test_prompt.md as the tool calls a model would make, one list per turn
+REACT_TODO_SCRIPT = [
+    {"content": "I'll scaffold a Vite + React + TypeScript project with Tailwind.", "tool_calls": [
+        _call("create_folder", path="todo-app-otter/src"),
+    ]},
+    {"content": None, "tool_calls": [
+        _call("create_file", name="todo-app-otter/package.json", content=PACKAGE_JSON),
+        _call("create_file", name="todo-app-otter/index.html", content=(
+            '<!doctype html>\n<html lang="en">\n<body>\n<div id="root"></div>\n'
+            '<script type="module" src="/src/main.tsx"></script>\n</body>\n</html>\n')),
+        _call("create_file", name="todo-app-otter/tailwind.config.js", content=(
+            'export default { content: ["./index.html", "./src/**/*.{ts,tsx}"], theme: { extend: {} }, plugins: [] };\n')),
+        _call("create_file", name="todo-app-otter/src/index.css", content="@tailwind base;\n@tailwind components;\n@tailwind utilities;\n"),
+        _call("create_file", name="todo-app-otter/src/main.tsx", content=(
+            'import React from "react";\nimport ReactDOM from "react-dom/client";\nimport App from "./App";\nimport "./index.css";\n\n'
+            'ReactDOM.createRoot(document.getElementById("root")!).render(<React.StrictMode><App /></React.StrictMode>);\n')),
+        _call("create_file", name="todo-app-otter/src/App.tsx", content=APP_TSX),
+    ]},
+    {"content": "Let me check the project layout.", "tool_calls": [
+        _call("list_files", path="todo-app-otter", recursive=True),
+        _call("read_file", path="todo-app-otter/src/App.tsx"),
+    ]},
+    {"content": None, "tool_calls": [
+        _call("apply_patch", path="todo-app-otter/src/App.tsx", edits=[
+            {"search": "<h1 className=\"mb-4 text-2xl font-bold\">TODO</h1>", "replace": "<h1 className=\"mb-4 text-2xl font-bold\">My TODOs</h1>"}
+        ]),
+    ]},
+    {"content": "Verifying the generated files.", "tool_calls": [
+        _call("execute_code", code=CHECK_PROJECT),
+        _call("read_file", path="todo-app-otter/src/App.tsx", start_line=1, end_line=10, only_if_changed=True),
+    ]},
+    {"content": "The TODO app is ready: run `npm install && npm run dev` in todo-app-otter.\n\n" + COMPLETE_PHRASE, "tool_calls": []},
+]
+
+
+class ScriptedLLM:
+    """
+    scriptの応答を1ターンずつ順に返す。first_token_latencyは最初のチャンクまでの待ち時間、
+    chunk_latencyはチャンクごとの待ち時間。待った時間の合計はmodel_timeに貯める
+    """
+
+    def __init__(self, script: list[dict], first_token_latency: float = 0.0, chunk_latency: float = 0.0, chunk_size: int = 16):
+        self.script = script
+        self.first_token_latency = first_token_latency
+        self.chunk_latency = chunk_latency
+        self.chunk_size = chunk_size
+        self.turn = 0
+        self.calls = 0
+        self.model_time = 0.0
+
+    def reset(self) -> None:
+        self.turn = 0
+
+    async def _sleep(self, seconds: float) -> None:
+        if seconds > 0:
+            start = time.perf_counter()
+            await asyncio.sleep(seconds)
+            self.model_time += time.perf_counter() - start
+
+    def _pieces(self, text: str) -> list[str]:
+        return [text[i:i + self.chunk_size] for i in range(0, len(text), self.chunk_size)]
+
+    @staticmethod
+    def _chunk(delta: Optional[SimpleNamespace] = None, finish_reason: Optional[str] = None, usage: Optional[dict] = None):
+        choices = [] if delta is None else [SimpleNamespace(delta=delta, finish_reason=finish_reason)]
+        return SimpleNamespace(choices=choices, usage=usage)
+
+    async def acompletion(self, messages: list, **kwargs):
+        # Past the end of the script, keep finishing so a miscounted script can't loop forever
+        turn = self.script[self.turn] if self.turn < len(self.script) else {"content": COMPLETE_PHRASE, "tool_calls": []}
+        turn_index = self.turn
+        self.turn += 1
+        self.calls += 1
+        return self._stream(turn, turn_index, messages)
+
+    async def _stream(self, turn: dict, turn_index: int, messages: list):
+        await self._sleep(self.first_token_latency)
+        generated = 0
+        for piece in self._pieces(turn["content"] or ""):
+            generated += len(piece)
+            yield self._chunk(SimpleNamespace(content=piece, tool_calls=None))
+            await self._sleep(self.chunk_latency)
+        for index, call in enumerate(turn["tool_calls"]):
+            header = SimpleNamespace(index=index, id=f"call_{turn_index}_{index}", function=SimpleNamespace(name=call["name"], arguments=""))
+            yield self._chunk(SimpleNamespace(content=None, tool_calls=[header]))
+            for piece in self._pieces(call["arguments"]):
+                generated += len(piece)
+                fragment = SimpleNamespace(index=index, id=None, function=SimpleNamespace(name=None, arguments=piece))
+                yield self._chunk(SimpleNamespace(content=None, tool_calls=[fragment]))
+                await self._sleep(self.chunk_latency)
+        yield self._chunk(SimpleNamespace(content=None, tool_calls=None), "tool_calls" if turn["tool_calls"] else "stop")
+        # Rough token counts (4 characters per token) are enough here and keep the fake free of tokenizers
+        prompt_chars = sum(len(json.dumps(message, default=str)) for message in messages)
+        yield self._chunk(usage={"prompt_tokens": prompt_chars // 4, "completion_tokens": generated // 4})
@@ -0,0 +1,143 @@
+"""
+OpenAI互換の/v1/chat/completionsを真似るローカルのHTTPサーバ。レイテンシと429/503を好きなだけ起こせるので、
+RequestSchedulerの再試行・バックオフ・フォールバックを本物のAPIを使わずに試せる。
+
+    python benchmarks/fake_openai_server.py --port 8765 --latency 0.2 --rate-limit-every 3 --retry-after 1
+    OPENAI_API_BASE=http://127.0.0.1:8765/v1 OPENAI_API_KEY=dummy python main_gpt.py
+"""
+import argparse
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+REPLY = "This is a stand-in reply. AUTOMODE_COMPLETE"
+
+
+class FakeOpenAIServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address, latency: float = 0.0, rate_limit_every: int = 0, retry_after: float = 1.0,
+                 error_rate: float = 0.0, throttled_models: frozenset = frozenset(), chunk_size: int = 8):
+        super().__init__(address, _Handler)
+        self.latency = latency
+        self.rate_limit_every = rate_limit_every
+        self.retry_after = retry_after
+        self.error_rate = error_rate
+        self.throttled_models = throttled_models
+        self.chunk_size = chunk_size
+        self.lock = threading.Lock()
+        self.counts = {"requests": 0, "ok": 0, "rate_limited": 0, "unavailable": 0}
+
+    def count(self, key: str) -> int:
+        with self.lock:
+            self.counts[key] += 1
+            return self.counts[key]
+
+
+class _Handler(BaseHTTPRequestHandler):
+    server: FakeOpenAIServer
+
+    def log_message(self, format, *args) -> None:
+        pass
+
+    def _error(self, status: int, message: str, headers: dict) -> None:
+        body = json.dumps({"error": {"message": message, "type": "rate_limit_error" if status == 429 else "server_error"}}).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        for key, value in headers.items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_POST(self) -> None:
+        if not self.path.rstrip("/").endswith("/chat/completions"):
+            self._error(404, "not found", {})
+            return
+        request = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+        server = self.server
+        number = server.count("requests")
+        model = request.get("model", "")
+        throttled = not server.throttled_models or model in server.throttled_models
+        if throttled and server.rate_limit_every and number % server.rate_limit_every == 0:
+            server.count("rate_limited")
+            self._error(429, "Rate limit reached (stand-in)", {"Retry-After": f"{server.retry_after:g}"})
+            return
+        if throttled and random.random() < server.error_rate:
+            server.count("unavailable")
+            self._error(503, "Service unavailable (stand-in)", {})
+            return
+
+        time.sleep(server.latency)
+        created = int(time.time())
+        prompt_chars = sum(len(json.dumps(message)) for message in request.get("messages", []))
+
+        def chunk(delta: dict, finish_reason=None, usage=None) -> dict:
+            body = {"id": f"chatcmpl-{number}", "object": "chat.completion.chunk", "created": created, "model": model,
+                    "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}] if delta is not None else []}
+            if usage is not None:
+                body["usage"] = usage
+            return body
+
+        usage = {"prompt_tokens": prompt_chars // 4, "completion_tokens": len(REPLY) // 4, "total_tokens": prompt_chars // 4 + len(REPLY) // 4}
+        if not request.get("stream"):
+            body = json.dumps({"id": f"chatcmpl-{number}", "object": "chat.completion", "created": created, "model": model,
+                               "choices": [{"index": 0, "message": {"role": "assistant", "content": REPLY}, "finish_reason": "stop"}],
+                               "usage": usage}).encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+            server.count("ok")
+            return
+
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Cache-Control", "no-cache")
+        self.end_headers()
+        events = [chunk({"role": "assistant", "content": ""})]
+        events += [chunk({"content": REPLY[i:i + server.chunk_size]}) for i in range(0, len(REPLY), server.chunk_size)]
+        events.append(chunk({}, "stop"))
+        if (request.get("stream_options") or {}).get("include_usage"):
+            events.append(chunk(None, usage=usage))
+        for event in events:
+            self.wfile.write(f"data: {json.dumps(event)}\n\n".encode())
+        self.wfile.write(b"data: [DONE]\n\n")
+        self.wfile.flush()
+        server.count("ok")
+
+
+def start_in_thread(port: int = 0, **kwargs) -> FakeOpenAIServer:
+    """
+    サーバを別スレッドで起動して返す。port=0なら空いているポートを使う(server.server_port で分かる)
+    """
+    server = FakeOpenAIServer(("127.0.0.1", port), **kwargs)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Stand-in OpenAI chat completions server that simulates latency and rate limits.")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--latency", type=float, default=0.0, help="seconds before each successful response")
+    parser.add_argument("--rate-limit-every", type=int, default=0, help="answer every Nth request with 429")
+    parser.add_argument("--retry-after", type=float, default=1.0, help="Retry-After seconds sent with 429s")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="probability of answering with 503")
+    parser.add_argument("--throttle-model", action="append", default=[], help="only throttle these models (default: all)")
+    args = parser.parse_args()
+
+    server = FakeOpenAIServer(("127.0.0.1", args.port), args.latency, args.rate_limit_every, args.retry_after,
+                              args.error_rate, frozenset(args.throttle_model))
+    print(f"listening on http://127.0.0.1:{server.server_port}/v1")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    print(json.dumps(server.counts))
+
+
+if __name__ == "__main__":
+    main()
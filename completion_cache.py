@@ -0,0 +1,119 @@
+import hashlib
+import json
+import re
+import sqlite3
+import time
+from typing import Optional
+
+CACHE_MODES = ("off", "read_through", "record", "replay")
+# Parts of tool results that differ between otherwise identical runs: execute_code's measured resource usage
+# and the random name of the session scratch directory that shows up in tracebacks
+VOLATILE_TOOL_OUTPUT = (
+    (re.compile(r"^Resources: .*$", re.MULTILINE), "Resources: -"),
+    (re.compile(r"([\\/])session_[A-Za-z0-9_]+(?=[\\/])"), r"\1session_-"),
+)
+
+
+class CompletionCacheMiss(Exception):
+    """
+    replayモードでキャッシュに無いリクエストが来たときに送出する
+    """
+
+
+class CompletionCache:
+    """
+    LLMの応答をSQLiteに保存するキャッシュ。キーはmodel・messages(システムプロンプトを含む)・toolsのハッシュ。
+    mode:
+      read_through ... あればキャッシュを返し、無ければ呼び出して保存する
+      record       ... 常に呼び出して保存する(既存のエントリは上書き)
+      replay       ... キャッシュだけを使い、無ければCompletionCacheMissを送出する
+    保存のたびに古いエントリ(max_age_seconds超)を消し、合計サイズがmax_bytesを超えたら最近使われていない順に消す。
+    """
+
+    def __init__(self, path: str, mode: str = "read_through", max_bytes: int = 256 * 1024 * 1024,
+                 max_age_seconds: float = 30 * 24 * 60 * 60):
+        if mode not in CACHE_MODES:
+            raise ValueError(f"unknown cache mode {mode!r}, expected one of {', '.join(CACHE_MODES)}")
+        self.mode = mode
+        self.max_bytes = max_bytes
+        self.max_age_seconds = max_age_seconds
+        self.hits = 0
+        self.misses = 0
+        self._db = sqlite3.connect(path)
+        # WAL lets several agent processes share one cache file
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS completions ("
+            "key TEXT PRIMARY KEY, value BLOB NOT NULL, size INTEGER NOT NULL, "
+            "created REAL NOT NULL, accessed REAL NOT NULL)"
+        )
+        self._db.execute("CREATE INDEX IF NOT EXISTS completions_accessed ON completions (accessed)")
+        self._db.commit()
+
+    @staticmethod
+    def _stable_message(message):
+        if not isinstance(message, dict) or message.get("role") != "tool" or not isinstance(message.get("content"), str):
+            return message
+        content = message["content"]
+        for pattern, replacement in VOLATILE_TOOL_OUTPUT:
+            content = pattern.sub(replacement, content)
+        return dict(message, content=content)
+
+    @staticmethod
+    def make_key(model: str, messages: list, tools: Optional[list]) -> str:
+        """
+        キーを作る。ツール結果のうち実行のたびに変わる部分(VOLATILE_TOOL_OUTPUT)は伏せてからハッシュする
+        """
+        messages = [CompletionCache._stable_message(message) for message in messages]
+        payload = json.dumps(
+            {"model": model, "messages": messages, "tools": tools},
+            sort_keys=True, separators=(",", ":"), ensure_ascii=False, default=lambda x: x.__dict__
+        )
+        return hashlib.sha256(payload.encode()).hexdigest()
+
+    def lookup(self, key: str) -> Optional[dict]:
+        """
+        modeに従ってキャッシュを引く。呼び出し元はNoneのときだけモデルを呼ぶ
+        """
+        if self.mode == "record":
+            return None
+        row = self._db.execute("SELECT value, created FROM completions WHERE key = ?", (key,)).fetchone()
+        now = time.time()
+        if row is not None and now - row[1] <= self.max_age_seconds:
+            self.hits += 1
+            self._db.execute("UPDATE completions SET accessed = ? WHERE key = ?", (now, key))
+            self._db.commit()
+            return json.loads(row[0])
+        self.misses += 1
+        if self.mode == "replay":
+            raise CompletionCacheMiss(f"no cached completion for key {key}")
+        return None
+
+    def store(self, key: str, value: dict) -> None:
+        if self.mode == "replay":
+            return
+        data = json.dumps(value, ensure_ascii=False).encode()
+        now = time.time()
+        self._db.execute(
+            "INSERT OR REPLACE INTO completions (key, value, size, created, accessed) VALUES (?, ?, ?, ?, ?)",
+            (key, data, len(data), now, now)
+        )
+        self._evict(now)
+        self._db.commit()
+
+    def _evict(self, now: float) -> None:
+        self._db.execute("DELETE FROM completions WHERE created < ?", (now - self.max_age_seconds,))
+        total = self._db.execute("SELECT COALESCE(SUM(size), 0) FROM completions").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        rows = self._db.execute("SELECT key, size FROM completions ORDER BY accessed").fetchall()
+        evicted = []
+        for key, size in rows:
+            if total <= self.max_bytes:
+                break
+            evicted.append((key,))
+            total -= size
+        self._db.executemany("DELETE FROM completions WHERE key = ?", evicted)
+
+    def close(self) -> None:
+        self._db.close()
@@ -0,0 +1,87 @@
+from typing import Callable, Optional, Tuple
+
+TokenCounter = Callable[..., int]
+
+
+class ContextManager:
+    """
+    message_history_stateから毎回送るmessagesを組み立てる。
+    メッセージごとのトークン数を数えてキャッシュし、合計がbudget_tokensを超えたら
+    古くて大きいtool結果から短いスタブに置き換えて、target_ratio * budget_tokensまで減らす。
+    一度スタブにしたメッセージは元に戻さないので、送る内容の先頭部分は次のスタブ化まで変わらず、
+    provider側のprompt cachingが効き続ける。
+    """
+
+    def __init__(self, token_counter: TokenCounter, budget_tokens: int, keep_recent_messages: int = 6,
+                 stub_min_tokens: int = 200, target_ratio: float = 0.75):
+        self.token_counter = token_counter
+        self.budget_tokens = budget_tokens
+        self.keep_recent_messages = keep_recent_messages
+        self.stub_min_tokens = stub_min_tokens
+        self.target_ratio = target_ratio
+        # message_history_state is append-only, so counts are cached by position
+        self._counts: list[int] = []
+        self._stubs: dict[int, Tuple[dict, int]] = {}
+        self._prefix_key: Optional[tuple] = None
+        self._prefix_tokens = 0
+        self.iteration = 0
+
+    def _prefix_count(self, system_prompt: str, tools: list) -> int:
+        key = (system_prompt, tuple(tool["function"]["name"] for tool in tools))
+        if key != self._prefix_key:
+            self._prefix_key = key
+            self._prefix_tokens = self.token_counter(messages=[{"role": "system", "content": system_prompt}], tools=tools)
+        return self._prefix_tokens
+
+    def _stub(self, message: dict, tokens: int) -> Tuple[dict, int]:
+        stub = dict(message)
+        stub["content"] = (
+            f"[Result of {message.get('name', 'tool')} (call {message.get('tool_call_id')}) removed to save context: "
+            f"{tokens} tokens. Call the tool again if you still need it.]"
+        )
+        return stub, self.token_counter(messages=[stub])
+
+    def _effective_count(self, index: int) -> int:
+        return self._stubs[index][1] if index in self._stubs else self._counts[index]
+
+    def build(self, system_prompt: str, tools: list, history: list) -> Tuple[list, dict]:
+        """
+        送信するmessagesと、今回のイテレーションの統計(元のトークン数、送るトークン数、削減量)を返す
+        """
+        self.iteration += 1
+        for message in history[len(self._counts):]:
+            self._counts.append(self.token_counter(messages=[message]))
+
+        prefix_tokens = self._prefix_count(system_prompt, tools)
+        full_tokens = prefix_tokens + sum(self._counts)
+        sent_tokens = prefix_tokens + sum(self._effective_count(i) for i in range(len(history)))
+        newly_stubbed = 0
+
+        if sent_tokens > self.budget_tokens:
+            target = self.budget_tokens * self.target_ratio
+            last_candidate = len(history) - self.keep_recent_messages
+            # Oldest first: those results are the least likely to still matter
+            for index in range(max(0, last_candidate)):
+                if sent_tokens <= target:
+                    break
+                message = history[index]
+                if index in self._stubs or not isinstance(message, dict) or message.get("role") != "tool" \
+                        or self._counts[index] < self.stub_min_tokens:
+                    continue
+                self._stubs[index] = self._stub(message, self._counts[index])
+                sent_tokens -= self._counts[index] - self._stubs[index][1]
+                newly_stubbed += 1
+
+        messages = [{"role": "system", "content": system_prompt}] + [
+            self._stubs[i][0] if i in self._stubs else message for i, message in enumerate(history)
+        ]
+        stats = {
+            "iteration": self.iteration,
+            "full_tokens": full_tokens,
+            "sent_tokens": sent_tokens,
+            "saved_tokens": full_tokens - sent_tokens,
+            "stubbed_messages": len(self._stubs),
+            "newly_stubbed": newly_stubbed,
+            "over_budget": sent_tokens > self.budget_tokens
+        }
+        return messages, stats
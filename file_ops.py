@@ -0,0 +1,202 @@
+import hashlib
+import mmap
+import os
+import re
+import shutil
+import tempfile
+from typing import Optional, Tuple
+
+# Files larger than this are mapped with mmap instead of being copied into memory
+MMAP_THRESHOLD_BYTES = 1024 * 1024
+
+_HUNK_HEADER = re.compile(r"^@@ -(\d+)(?:,(\d+))? \+(\d+)(?:,(\d+))? @@")
+
+
+def _sha256_of(data) -> str:
+    return hashlib.sha256(data).hexdigest()
+
+
+def _line_span(data, start_line: int, end_line: Optional[int]) -> Tuple[int, int]:
+    """
+    1始まりの行番号start_line〜end_line(両端含む)が占めるバイト範囲を返す
+    """
+    position = 0
+    for _ in range(start_line - 1):
+        newline = data.find(b"\n", position)
+        if newline == -1:
+            return len(data), len(data)
+        position = newline + 1
+    start = position
+    if end_line is None:
+        return start, len(data)
+    for _ in range(end_line - start_line + 1):
+        newline = data.find(b"\n", position)
+        if newline == -1:
+            return start, len(data)
+        position = newline + 1
+    return start, position
+
+
+def read_range(path: str, start_line: Optional[int] = None, end_line: Optional[int] = None,
+               offset: Optional[int] = None, length: Optional[int] = None) -> Tuple[str, str, str]:
+    """
+    ファイルの一部(行範囲またはバイト範囲)を読む。戻り値は(内容, 範囲の説明, ファイル全体のsha256)
+    """
+    if start_line is not None and start_line < 1:
+        raise ValueError("start_line must be 1 or more")
+    if end_line is not None and start_line is not None and end_line < start_line:
+        raise ValueError("end_line must not be before start_line")
+    if offset is not None and offset < 0:
+        raise ValueError("offset must not be negative")
+
+    with open(path, "rb") as f:
+        size = os.fstat(f.fileno()).st_size
+        if size == 0:
+            return "", "empty file", _sha256_of(b"")
+        use_mmap = size > MMAP_THRESHOLD_BYTES
+        data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) if use_mmap else f.read()
+        try:
+            digest = _sha256_of(data)
+            if offset is not None or length is not None:
+                start = offset or 0
+                end = size if length is None else min(size, start + length)
+                description = f"bytes {start}-{end} of {size}"
+            elif start_line is not None or end_line is not None:
+                first_line = start_line or 1
+                start, end = _line_span(data, first_line, end_line)
+                description = f"lines {first_line}-{end_line if end_line is not None else 'end'}"
+            else:
+                start, end = 0, size
+                description = "whole file"
+            content = bytes(data[start:end]).decode(errors="replace")
+        finally:
+            if use_mmap:
+                data.close()
+    return content, description, digest
+
+
+def atomic_write(path: str, content: str) -> None:
+    """
+    同じディレクトリの一時ファイルに書いてからrenameし、書きかけの状態が見えないようにする
+    """
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, temp_path = tempfile.mkstemp(dir=directory, prefix=".tmp_", suffix=os.path.basename(path))
+    try:
+        with os.fdopen(fd, "w", encoding="utf-8", newline="") as f:
+            f.write(content)
+            f.flush()
+            os.fsync(f.fileno())
+        if os.path.exists(path):
+            shutil.copymode(path, temp_path)
+        os.replace(temp_path, path)
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+
+
+def apply_search_replace(text: str, edits: list[dict]) -> Tuple[str, int]:
+    """
+    {"search": ..., "replace": ...}の編集を順に当てる。searchはちょうど1か所に一致しなければならない
+    """
+    for number, edit in enumerate(edits, start=1):
+        search, replace = edit["search"], edit["replace"]
+        if not search:
+            raise ValueError(f"edit {number}: search text is empty")
+        count = text.count(search)
+        if count == 0:
+            raise ValueError(f"edit {number}: search text not found")
+        if count > 1:
+            raise ValueError(f"edit {number}: search text matches {count} places, include more context")
+        text = text.replace(search, replace, 1)
+    return text, len(edits)
+
+
+def _parse_unified_diff(patch: str) -> list[Tuple[int, int, list[Tuple[str, str]]]]:
+    """
+    hunkごとに(旧ファイルの開始行, 旧ファイルの行数, [(記号, 内容), ...])を返す。
+    ---/+++などのファイルヘッダは最初の@@の前か、hunkの行数を使い切った後の行だけをヘッダとみなす
+    """
+    hunks = []
+    current = None
+    old_remaining = new_remaining = 0
+    for line in patch.splitlines():
+        in_hunk = current is not None and (old_remaining > 0 or new_remaining > 0)
+        header = _HUNK_HEADER.match(line)
+        if header and not in_hunk:
+            old_count = int(header.group(2)) if header.group(2) is not None else 1
+            old_remaining = old_count
+            new_remaining = int(header.group(4)) if header.group(4) is not None else 1
+            current = (int(header.group(1)), old_count, [])
+            hunks.append(current)
+        elif current is None or (not in_hunk and line.startswith(("--- ", "+++ ", "diff ", "index "))):
+            continue
+        elif line.startswith("\\"):
+            # "\ No newline at end of file"
+            continue
+        else:
+            if line == "":
+                # Models often drop the leading space of empty context lines
+                tag, content = " ", ""
+            elif line[0] in " -+":
+                tag, content = line[0], line[1:]
+            else:
+                raise ValueError(f"unexpected line in hunk: {line!r}")
+            current[2].append((tag, content))
+            # Miscounted hunks are still accepted; the counts only decide where headers may appear
+            if tag in " -":
+                old_remaining -= 1
+            if tag in " +":
+                new_remaining -= 1
+    if not hunks:
+        raise ValueError("no hunks found in patch")
+    return hunks
+
+
+def _find_block(lines: list[str], block: list[str], start: int, expected: int) -> int:
+    """
+    linesのstart以降でblockと一致する位置のうちexpectedに最も近いものを返す
+    """
+    stripped = [line.rstrip("\r\n") for line in lines]
+    matches = [
+        i for i in range(start, len(lines) - len(block) + 1)
+        if stripped[i:i + len(block)] == block
+    ]
+    if not matches:
+        # Tolerate trailing whitespace differences before giving up
+        loose_block = [line.rstrip() for line in block]
+        matches = [
+            i for i in range(start, len(lines) - len(block) + 1)
+            if [line.rstrip() for line in stripped[i:i + len(block)]] == loose_block
+        ]
+    if not matches:
+        return -1
+    return min(matches, key=lambda i: abs(i - expected))
+
+
+def apply_unified_diff(text: str, patch: str) -> Tuple[str, int]:
+    """
+    unified diffのhunkを順に当てる。行番号がずれていても前後の行が一致する場所を探して当てる
+    """
+    lines = text.splitlines(keepends=True)
+    newline = "\r\n" if lines and lines[0].endswith("\r\n") else "\n"
+    ends_with_newline = text.endswith(("\n", "\r"))
+    result: list[str] = []
+    cursor = 0
+    hunks = _parse_unified_diff(patch)
+    for old_start, old_count, hunk in hunks:
+        old_block = [content for tag, content in hunk if tag in " -"]
+        new_block = [content for tag, content in hunk if tag in " +"]
+        # An empty old range ("-5,0") names the line the insertion goes after, not the first line replaced
+        expected = old_start if old_count == 0 else old_start - 1
+        position = _find_block(lines, old_block, cursor, max(expected, cursor)) if old_block else max(expected, cursor)
+        if position == -1:
+            raise ValueError(f"hunk at line {old_start} does not match the file")
+        result.extend(lines[cursor:position])
+        result.extend(content + newline for content in new_block)
+        cursor = position + len(old_block)
+    result.extend(lines[cursor:])
+    new_text = "".join(result)
+    if cursor >= len(lines) and not ends_with_newline and new_text.endswith(newline):
+        new_text = new_text[:-len(newline)]
+    return new_text, len(hunks)
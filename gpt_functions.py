@@ -5,6 +5,10 @@ LIST_FILES_FUNC_NAME = "list_files"
 READ_FILE_FUNC_NAME = "read_file"
 EXECUTE_CODE_FUNC_NAME = "execute_code"
 STOP_PROCESS_FUNC_NAME = "stop_process"
+APPLY_PATCH_FUNC_NAME = "apply_patch"
+READ_PROCESS_OUTPUT_FUNC_NAME = "read_process_output"
+WAIT_FOR_PROCESS_FUNC_NAME = "wait_for_process"
+SEARCH_CODE_FUNC_NAME = "search_code"
 
 functions = [
     {
@@ -38,26 +42,56 @@ functions = [
     },
     {
         "name": LIST_FILES_FUNC_NAME,
-        "description": "List all files in the specified folder. This tool should be used when you need to see a list of all files in a directory. It will return a list of file names in the specified folder, or an error message if the folder doesn't exist or is inaccessible.",
+        "description": "List all files in the specified folder. This tool should be used when you need to see a list of all files in a directory. Set recursive to true to get the whole tree below the folder in one call instead of listing each subfolder separately; folders ignored by .gitignore and folders such as .git, node_modules and code_execution_env are shown but not expanded. It will return a list of file names in the specified folder, or an error message if the folder doesn't exist or is inaccessible.",
         "parameters": {
             "type": "object",
             "properties": {
                 "path": {
                   "type": "string",
-                  "description": "The absolute or relative path of the folder to list files from. Use forward slashes (/) for path separation, even on Windows systems."}
+                  "description": "The absolute or relative path of the folder to list files from. Use forward slashes (/) for path separation, even on Windows systems."},
+                "recursive": {
+                  "type": "boolean",
+                  "description": "Optional. List all files below the folder, one relative path per line. Defaults to false."},
+                "max_depth": {
+                  "type": "integer",
+                  "description": "Optional. With recursive, how many folder levels to descend (1 lists only the folder itself)."},
+                "pattern": {
+                  "type": "string",
+                  "description": "Optional. With recursive, only list files whose name or relative path matches this glob, e.g. '*.tsx' or 'src/*.py'."},
+                "max_entries": {
+                  "type": "integer",
+                  "description": "Optional. With recursive, the maximum number of entries to return (default 500)."},
+                "only_if_changed": {
+                  "type": "boolean",
+                  "description": "Optional. If the same listing was already returned earlier and nothing has changed, return a short note naming that earlier call instead of the full listing."}
             },
             "required": ["path"]
         }
     },
     {
         "name": READ_FILE_FUNC_NAME,
-        "description": "Read the content of the specified file. This tool should be used when you need to read the contents of a file. It will return the content of the file, or an error message if the file doesn't exist or is inaccessible.",
+        "description": "Read the content of the specified file, or only part of it. This tool should be used when you need to read the contents of a file. For large files, read only the lines you need with start_line/end_line (or a byte range with offset/length) instead of the whole file. It will return the requested content together with the sha256 of the whole file, which can be passed to apply_patch, or an error message if the file doesn't exist or is inaccessible.",
         "parameters": {
             "type": "object",
             "properties": {
                 "path": {
                   "type": "string",
-                  "description": "The absolute or relative path of the file to read. Use forward slashes (/) for path separation, even on Windows systems."}
+                  "description": "The absolute or relative path of the file to read. Use forward slashes (/) for path separation, even on Windows systems."},
+                "start_line": {
+                  "type": "integer",
+                  "description": "Optional. First line to read (1-based, inclusive)."},
+                "end_line": {
+                  "type": "integer",
+                  "description": "Optional. Last line to read (1-based, inclusive). Defaults to the end of the file."},
+                "offset": {
+                  "type": "integer",
+                  "description": "Optional. Byte offset to start reading from. Use instead of start_line/end_line for files without meaningful lines."},
+                "length": {
+                  "type": "integer",
+                  "description": "Optional. Number of bytes to read from offset."},
+                "only_if_changed": {
+                  "type": "boolean",
+                  "description": "Optional. If the same range of this file was already read earlier and the file hasn't changed, return a short note naming that earlier call instead of the content. Only use this while the earlier result is still visible to you."}
             },
             "required": ["path"]
         }
@@ -78,9 +112,39 @@ functions = [
             "required": ["path", "content"]
         }
     },
+    {
+        "name": APPLY_PATCH_FUNC_NAME,
+        "description": "Apply a small edit to an existing file without resending its whole content. This tool should be preferred over update_file for changes to part of a file. Provide either a unified diff in 'patch' or a list of search/replace 'edits' (each search text must match exactly one place in the file). The file is written atomically. If expected_sha256 is given and the file has changed since it was read, the edit is rejected and the file must be read again. The tool returns the sha256 of the new content.",
+        "parameters": {
+            "type": "object",
+            "properties": {
+                "path": {
+                  "type": "string",
+                  "description": "The absolute or relative path of the file to edit. Use forward slashes (/) for path separation, even on Windows systems."},
+                "patch": {
+                  "type": "string",
+                  "description": "A unified diff with one or more @@ hunks, including a few unchanged context lines around each change."},
+                "edits": {
+                  "type": "array",
+                  "description": "Search/replace edits applied in order.",
+                  "items": {
+                    "type": "object",
+                    "properties": {
+                      "search": {"type": "string", "description": "Exact text to find, including enough surrounding lines to be unique."},
+                      "replace": {"type": "string", "description": "Text to put in its place."}
+                    },
+                    "required": ["search", "replace"]
+                  }},
+                "expected_sha256": {
+                  "type": "string",
+                  "description": "Optional. The sha256 returned by read_file or apply_patch for the version of the file this edit was written against."}
+            },
+            "required": ["path"]
+        }
+    },
     {
         "name": EXECUTE_CODE_FUNC_NAME,
-        "description": "Execute Python code in the 'code_execution_env' virtual environment and return the output. This tool should be used when you need to run code and see its output or check for errors. All code execution happens exclusively in this isolated environment. The tool will return the standard output, standard error, and return code of the executed code. Long-running processes will return a process ID for later management.",
+        "description": "Execute Python code in the 'code_execution_env' virtual environment and return the output. This tool should be used when you need to run code and see its output or check for errors. All code execution happens exclusively in this isolated environment. The tool will return the standard output, standard error, and return code of the executed code. Long-running processes will return a process ID for later management. Each process runs with limits on CPU time, memory and open files, and only a few may run at once, so stop background processes you no longer need; finished runs also report the CPU time, peak memory and wall time they used.",
         "parameters": {
             "type": "object",
             "properties": {
@@ -98,11 +162,74 @@ functions = [
             "type": "object",
             "properties": {
                 "process_id": {
+                  "type": "string",
+                  "description": "The ID of the process to stop, as returned by the execute_code tool for long-running processes (e.g. process_3)."}
+            },
+            "required": ["process_id"]
+        }
+    },
+    {
+        "name": READ_PROCESS_OUTPUT_FUNC_NAME,
+        "description": "Read the output a background process started by execute_code has produced since the last read. This tool should be used to check on long-running processes such as servers or builds without waiting for them. Output is kept in a fixed-size buffer per process, so very old output may have been dropped; the result says how many bytes were lost. The result ends with the cursors to pass to continue reading from a specific point.",
+        "parameters": {
+            "type": "object",
+            "properties": {
+                "process_id": {
+                  "type": "string",
+                  "description": "The ID of the process, as returned by the execute_code tool (e.g. process_3)."},
+                "stdout_cursor": {
+                  "type": "integer",
+                  "description": "Optional. Byte offset in stdout to read from. Defaults to where the previous read stopped."},
+                "stderr_cursor": {
                   "type": "integer",
-                  "description": "The ID of the process to stop, as returned by the execute_code tool for long-running processes."}
+                  "description": "Optional. Byte offset in stderr to read from. Defaults to where the previous read stopped."}
+            },
+            "required": ["process_id"]
+        }
+    },
+    {
+        "name": WAIT_FOR_PROCESS_FUNC_NAME,
+        "description": "Wait for a background process started by execute_code to finish, up to the given timeout. This tool should be used when you need the final result of a long-running process. It returns the output produced since the last read and the return code, or 'Running' if the process is still running when the timeout expires.",
+        "parameters": {
+            "type": "object",
+            "properties": {
+                "process_id": {
+                  "type": "string",
+                  "description": "The ID of the process, as returned by the execute_code tool (e.g. process_3)."},
+                "timeout": {
+                  "type": "number",
+                  "description": "Optional. Maximum number of seconds to wait (default 30, at most 300)."}
             },
             "required": ["process_id"]
         }
+    },
+    {
+        "name": SEARCH_CODE_FUNC_NAME,
+        "description": "Search the files of the working directory for lines matching a regular expression, using an index. This tool should be used to find where something is defined or used instead of listing folders and reading whole files. It returns the matching lines as path:line: text, with a few lines of context (path-line- text) around each match, or a message if nothing matches. Files ignored by .gitignore, binary files and files over 1MB are not searched.",
+        "parameters": {
+            "type": "object",
+            "properties": {
+                "query": {
+                  "type": "string",
+                  "description": "A Python regular expression matched against each line (e.g. 'def\\s+parse_\\w+' or 'class TodoList'). Include a literal word of at least three characters when possible; it makes the search much faster."},
+                "path": {
+                  "type": "string",
+                  "description": "Optional. Only search under this folder (relative to the working directory)."},
+                "path_pattern": {
+                  "type": "string",
+                  "description": "Optional. Only search files whose path or name matches this glob (e.g. '*.py' or 'src/**/*.tsx')."},
+                "ignore_case": {
+                  "type": "boolean",
+                  "description": "Optional. Match case-insensitively (default false)."},
+                "context_lines": {
+                  "type": "integer",
+                  "description": "Optional. Lines of context to show before and after each match (default 2)."},
+                "max_results": {
+                  "type": "integer",
+                  "description": "Optional. Maximum number of matching lines to return (default 50)."}
+            },
+            "required": ["query"]
+        }
     }
 ]
 
@@ -129,7 +256,8 @@ You are an AI assistant, specialized in software development with access to a va
 
 Tool Usage Guidelines:
 - Always use the most appropriate tool for the task at hand.
-- Provide detailed and clear instructions when using tools, especially for edit_and_apply.
+- Use search_code to find where code is defined or used, then read only the relevant line ranges.
+- Provide detailed and clear instructions when using tools, especially for apply_patch.
 - After making changes, always review the output to ensure accuracy and alignment with intentions.
 - Use execute_code to run and test code within the 'code_execution_env' virtual environment, then analyze the results.
 - For long-running processes, use the process ID returned by execute_code to stop them later if needed.
@@ -176,7 +304,7 @@ You are currently in automode. Follow these guidelines:
 
 4. Tool Usage:
    - Leverage all available tools to accomplish your goals efficiently.
-   - Prefer edit_and_apply for file modifications, applying changes in chunks for large edits.
+   - Prefer apply_patch for file modifications, and read only the line ranges you need from large files.
    - Use tavily_search proactively for up-to-date information.
 
 5. Error Handling:
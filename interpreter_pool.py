@@ -0,0 +1,185 @@
+import asyncio
+import json
+import os
+import secrets
+from dataclasses import dataclass
+from typing import Optional, Tuple
+
+from process_output import DEFAULT_BUFFER_BYTES, OutputBuffer, drain, parse_job_marker
+
+WORKER_SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "interpreter_worker.py")
+
+
+@dataclass
+class PoolRun:
+    """
+    InterpreterPool.runの結果。タイムアウトした場合はreturn_codeがNoneで、
+    実行中のワーカープロセスはプールから外されてprocessに入り、drainsが出力を吸い出し続ける。
+    resourcesはワーカーが報告したこのジョブのCPU時間とピークメモリ。
+    """
+    stdout: OutputBuffer
+    stderr: OutputBuffer
+    return_code: Optional[int]
+    process: Optional[asyncio.subprocess.Process] = None
+    drains: Optional[Tuple[asyncio.Task, asyncio.Task]] = None
+    resources: Optional[dict] = None
+
+
+class _Worker:
+    def __init__(self, process: asyncio.subprocess.Process):
+        self.process = process
+        self.runs = 0
+
+
+class InterpreterPool:
+    """
+    code_execution_envのpythonを事前に起動しておき、コードをパイプで渡して実行するワーカープール。
+    ワーカーはmax_runs回使うか、異常終了するか、ジョブがインストール済みのパッケージを新たにimportすると作り直す。
+    preload_modulesは起動時にimportしておく。
+    ワーカーはそれぞれ新しいセッションで起動し、envは環境変数に足すもの(ProcessLimits.environmentの制限など)。
+    """
+
+    def __init__(self, python_executable: str, size: int = 2, max_runs: int = 20, preload_modules: Optional[list[str]] = None,
+                 output_capacity: int = DEFAULT_BUFFER_BYTES, env: Optional[dict[str, str]] = None):
+        if size < 1:
+            raise ValueError("size must be at least 1")
+        self.python_executable = python_executable
+        self.size = size
+        self.max_runs = max_runs
+        self.preload_modules = list(preload_modules or [])
+        self.output_capacity = output_capacity
+        self.env = dict(env or {})
+        self._idle: asyncio.Queue = asyncio.Queue()
+        self._live = 0
+        self._closed = False
+        self._background_tasks: set = set()
+
+    async def _spawn(self) -> _Worker:
+        process = await asyncio.create_subprocess_exec(
+            self.python_executable, WORKER_SCRIPT, *self.preload_modules,
+            stdin=asyncio.subprocess.PIPE,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.PIPE,
+            env={**os.environ, **self.env},
+            start_new_session=True
+        )
+        return _Worker(process)
+
+    async def _replenish(self) -> None:
+        try:
+            worker = await self._spawn()
+        except Exception:
+            self._live -= 1
+            raise
+        if self._closed:
+            self._retire(worker)
+            self._live -= 1
+            return
+        self._idle.put_nowait(worker)
+
+    async def start(self) -> None:
+        """
+        sizeまでワーカーを起動しておく
+        """
+        missing = self.size - self._live
+        self._live += missing
+        await asyncio.gather(*(self._replenish() for _ in range(missing)))
+
+    async def _acquire(self) -> _Worker:
+        while True:
+            if self._idle.empty() and self._live < self.size:
+                self._live += 1
+                try:
+                    return await self._spawn()
+                except Exception:
+                    self._live -= 1
+                    raise
+            worker = await self._idle.get()
+            if worker.process.returncode is None:
+                return worker
+            # Killed while idle
+            self._discard(worker)
+
+    def _retire(self, worker: _Worker) -> None:
+        if worker.process.returncode is None and worker.process.stdin is not None:
+            # The worker exits by itself once its request pipe is closed
+            worker.process.stdin.close()
+
+    def _discard(self, worker: _Worker) -> None:
+        """
+        ワーカーをプールから外し、代わりのワーカーを裏で起動する
+        """
+        if not self._closed:
+            task = asyncio.get_running_loop().create_task(self._replenish())
+            self._background_tasks.add(task)
+            task.add_done_callback(self._background_tasks.discard)
+        else:
+            self._live -= 1
+
+    async def run(self, code: str, filename: str, cwd: str, timeout: float, cpu_seconds: Optional[float] = None) -> PoolRun:
+        """
+        codeをワーカーで実行する。filenameはcwdからの相対か絶対パス、cpu_secondsはこのジョブに許すCPU時間。
+        待機中に死んでいたワーカーに当たったら、新しいワーカーで1回だけやり直す
+        """
+        token = secrets.token_hex(8)
+        stdout, stderr = OutputBuffer(self.output_capacity), OutputBuffer(self.output_capacity)
+
+        job = {"code": code, "filename": filename, "cwd": cwd, "token": token, "cpu_seconds": cpu_seconds}
+        # The worker echoes this before running the job, which tells a worker that died while idle
+        # (the job never ran, so it is safe to send it again) from a job that killed its worker
+        ack = f"\0{token}+\0".encode()
+        for attempt in range(2):
+            worker = await self._acquire()
+            process = worker.process
+            try:
+                process.stdin.write((json.dumps(job) + "\n").encode())
+                await process.stdin.drain()
+                if await process.stdout.readexactly(len(ack)) == ack:
+                    break
+            except (BrokenPipeError, ConnectionResetError, asyncio.IncompleteReadError):
+                pass
+            # Dead before it took the job: replace it and try once more on a fresh one
+            self._retire(worker)
+            return_code = await process.wait()
+            self._discard(worker)
+        else:
+            raise RuntimeError(f"interpreter workers exited before they could run the job (last exit status {return_code})")
+
+        drains = (
+            asyncio.create_task(drain(process.stdout, stdout, f"\0{token}:".encode())),
+            asyncio.create_task(drain(process.stderr, stderr, f"\0{token}\0".encode()))
+        )
+        _, pending = await asyncio.wait(drains, timeout=timeout)
+        if pending:
+            # Still running: hand the worker over to the caller as a background process.
+            # It exits on its own once the job is done because it gets no more requests.
+            self._retire(worker)
+            self._discard(worker)
+            return PoolRun(stdout, stderr, None, process, drains)
+
+        stdout_rest, stderr_rest = drains[0].result(), drains[1].result()
+        resources = None
+        if stdout_rest is None or stderr_rest is None:
+            # The worker died mid-run (os._exit, segfault, CPU limit, ...): report its exit status and replace it
+            return_code = await process.wait()
+            self._discard(worker)
+        else:
+            return_code, resources, recycle = parse_job_marker(stdout_rest)
+            worker.runs += 1
+            # recycle: the job imported installed packages, which can't be unloaded and may have changed since
+            if recycle or worker.runs >= self.max_runs or self._closed:
+                self._retire(worker)
+                self._discard(worker)
+            else:
+                self._idle.put_nowait(worker)
+        return PoolRun(stdout, stderr, return_code, resources=resources)
+
+    async def close(self) -> None:
+        self._closed = True
+        # Replacements still starting up retire themselves once they see the pool is closed
+        await asyncio.gather(*self._background_tasks, return_exceptions=True)
+        while not self._idle.empty():
+            worker = self._idle.get_nowait()
+            self._retire(worker)
+            await worker.process.wait()
+            self._live -= 1
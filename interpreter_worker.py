@@ -0,0 +1,230 @@
+"""
+InterpreterPoolのワーカーとしてcode_execution_envのpythonで起動されるスクリプト。
+標準入力から1行1件のJSONでコードを受け取り、毎回新しい__main__モジュールとして実行する。
+ジョブを受け取るとまず標準出力に受領の印(\\0{token}+\\0)を書き、
+コードの出力はそのまま標準出力/標準エラーに流し、実行の終わりにtoken付きの区切りを書き込む。
+区切りには終了コードと、ワーカーを作り直すべきかどうか、そのジョブで使ったCPU時間・ピークメモリ(JSON)を入れる。
+ジョブがimportした作業ディレクトリのモジュールは終わったら捨てるので、ファイルを書き換えた後の実行は新しいコードを読む。
+
+    python interpreter_worker.py [module_to_preload ...]
+"""
+import builtins
+import importlib
+import importlib.machinery
+import json
+import math
+import os
+import site
+import sys
+import sysconfig
+import traceback
+import types
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+# JSON limits from ProcessLimits.environment; applied by the child itself because a preexec_fn is not fork-safe
+LIMITS_ENV = "SWE_AGENT_PROCESS_LIMITS"
+
+
+def _exit_code(e: SystemExit) -> int:
+    if e.code is None:
+        return 0
+    if isinstance(e.code, int):
+        return e.code
+    print(e.code, file=sys.stderr)
+    return 1
+
+
+def _cpu_times() -> tuple[float, float]:
+    if resource is None:
+        times = os.times()
+        return times.user + times.children_user, times.system + times.children_system
+    own, children = resource.getrusage(resource.RUSAGE_SELF), resource.getrusage(resource.RUSAGE_CHILDREN)
+    return own.ru_utime + children.ru_utime, own.ru_stime + children.ru_stime
+
+
+def _reset_peak_rss() -> None:
+    try:
+        # Linux only: restart the VmHWM high-water mark so the peak is per job
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+    except OSError:
+        pass
+
+
+def _peak_rss() -> int:
+    try:
+        with open("/proc/self/status", "r") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    if resource is None:
+        return 0
+    # ru_maxrss is in KiB on Linux and in bytes on macOS
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * (1 if sys.platform == "darwin" else 1024)
+
+
+def _set_limit(limit: int, value, hard_slack: int = 0) -> None:
+    if value is None:
+        return
+    _, hard = resource.getrlimit(limit)
+    soft = value if hard == resource.RLIM_INFINITY else min(value, hard)
+    new_hard = soft + hard_slack if hard == resource.RLIM_INFINITY else min(soft + hard_slack, hard)
+    resource.setrlimit(limit, (soft, new_hard))
+
+
+def apply_limits() -> None:
+    """
+    LIMITS_ENVで渡された制限を起動直後の自分に掛け、cgroupが指定されていればそこへ移る。
+    ユーザーのコードには見せないので環境変数からは消す
+    """
+    raw = os.environ.pop(LIMITS_ENV, None)
+    if raw is None:
+        return
+    limits = json.loads(raw)
+    if limits.get("cgroup_procs"):
+        try:
+            # "0" moves the writing process itself, before it can start anything
+            with open(limits["cgroup_procs"], "w") as f:
+                f.write("0")
+        except OSError:
+            pass
+    if resource is None:
+        return
+    _set_limit(resource.RLIMIT_DATA, limits.get("memory_bytes"))
+    _set_limit(resource.RLIMIT_NOFILE, limits.get("open_files"))
+    # SIGXCPU at the soft limit, SIGKILL a little later if the code ignores it
+    _set_limit(resource.RLIMIT_CPU, limits.get("cpu_seconds"), hard_slack=5)
+
+
+def _set_cpu_limit(cpu_seconds) -> None:
+    """
+    RLIMIT_CPUはプロセスの累計なので、これまでに使った分にこのジョブの上限を足してソフトリミットにする
+    """
+    if resource is None:
+        return
+    _, hard = resource.getrlimit(resource.RLIMIT_CPU)
+    soft = hard
+    if cpu_seconds is not None:
+        own = resource.getrusage(resource.RUSAGE_SELF)
+        soft = math.ceil(own.ru_utime + own.ru_stime + cpu_seconds)
+        if hard != resource.RLIM_INFINITY:
+            soft = min(soft, hard)
+    resource.setrlimit(resource.RLIMIT_CPU, (soft, hard))
+
+
+# Modules from the standard library never change under a running worker, so jobs may share them.
+# site-packages usually sits inside the stdlib directory, so it is excluded explicitly
+STDLIB_PATHS = tuple({os.path.realpath(sysconfig.get_path(name)) + os.sep for name in ("stdlib", "platstdlib")})
+SITE_PATHS = tuple({os.path.realpath(path) + os.sep for path in
+                    [sysconfig.get_path("purelib"), sysconfig.get_path("platlib"), *site.getsitepackages(), site.getusersitepackages()]})
+EXTENSION_SUFFIXES = tuple(importlib.machinery.EXTENSION_SUFFIXES)
+
+
+def _module_path(module) -> str:
+    path = getattr(module, "__file__", None)
+    if path is None:
+        # Namespace packages have no __file__, only __path__
+        path = next(iter(getattr(module, "__path__", None) or []), None)
+    return os.path.realpath(path) if path else ""
+
+
+def forget_job_modules(baseline: set) -> bool:
+    """
+    ジョブが新しくimportしたモジュールを片付け、ワーカーを作り直すべきならTrueを返す。
+    標準ライブラリと組み込みのものは残し(baselineに加える)、それ以外はsys.modulesから消す。
+    site-packagesのものと拡張モジュールはpip installで変わりうるうえ読み直せないので、ワーカーごと捨ててもらう
+    """
+    recycle = False
+    for name in set(sys.modules) - baseline:
+        path = _module_path(sys.modules[name])
+        if not path or (path.startswith(STDLIB_PATHS) and not path.startswith(SITE_PATHS)):
+            baseline.add(name)
+            continue
+        if path.startswith(SITE_PATHS) or path.endswith(EXTENSION_SUFFIXES):
+            recycle = True
+        del sys.modules[name]
+    return recycle
+
+
+def run_job(job: dict) -> int:
+    """
+    jobのコードを、runpyと同じように新しい__main__モジュールとして実行して終了コードを返す。
+    実行中はsys.modules["__main__"]をそのモジュールに差し替えるので、スクリプトで定義したクラスのpickleや
+    multiprocessingのspawn、from __future__ import annotations付きのdataclassesも普通に動く
+    """
+    cwd = job["cwd"]
+    filename = os.path.join(cwd, job["filename"])
+    os.chdir(cwd)
+    sys.argv = [filename]
+    sys.path[0] = cwd
+    module = types.ModuleType("__main__")
+    module.__dict__.update({"__file__": filename, "__builtins__": builtins, "__spec__": None, "__loader__": None,
+                            "__package__": None, "__cached__": None})
+    original_main = sys.modules["__main__"]
+    sys.modules["__main__"] = module
+    try:
+        exec(compile(job["code"], filename, "exec"), module.__dict__)
+        return 0
+    except SystemExit as e:
+        return _exit_code(e)
+    except BaseException as e:
+        # Skip our own exec frame so the traceback starts at the user's file
+        traceback.print_exception(type(e), e, e.__traceback__.tb_next)
+        return 1
+    finally:
+        sys.modules["__main__"] = original_main
+
+
+def main() -> None:
+    apply_limits()
+    # Keep the request pipe for ourselves and give user code an empty stdin
+    control = os.fdopen(os.dup(0), "r")
+    devnull = os.open(os.devnull, os.O_RDONLY)
+    os.dup2(devnull, 0)
+    os.close(devnull)
+    sys.stdin = open(os.devnull, "r")
+    sys.stdout.reconfigure(line_buffering=True)
+
+    for module_name in sys.argv[1:]:
+        try:
+            importlib.import_module(module_name)
+        except Exception:
+            # Not installed in the venv: user code will see the ImportError itself
+            pass
+
+    stdout, stderr = sys.stdout, sys.stderr
+    baseline = set(sys.modules)
+    cwd, environ, path = os.getcwd(), dict(os.environ), list(sys.path)
+    for line in control:
+        job = json.loads(line)
+        # Tells the pool the job was taken; from here on a dead worker means the job itself killed it
+        os.write(1, f"\0{job['token']}+\0".encode())
+        _set_cpu_limit(job.get("cpu_seconds"))
+        _reset_peak_rss()
+        user, system = _cpu_times()
+        return_code = run_job(job)
+        end_user, end_system = _cpu_times()
+        usage = {"user": end_user - user, "system": end_system - system, "max_rss": _peak_rss()}
+        # User code may have swapped the streams; the markers must go to the real ones
+        sys.stdout, sys.stderr = stdout, stderr
+        sys.stdout.flush()
+        sys.stderr.flush()
+        # Leave nothing behind for the next job: edited modules must be imported again
+        recycle = forget_job_modules(baseline)
+        os.chdir(cwd)
+        os.environ.clear()
+        os.environ.update(environ)
+        sys.path[:] = path
+        token = job["token"]
+        os.write(1, f"\0{token}:{return_code}:{int(recycle)}:{json.dumps(usage)}\0".encode())
+        os.write(2, f"\0{token}\0".encode())
+
+
+if __name__ == "__main__":
+    main()
@@ -1,29 +1,145 @@
+import argparse
+import importlib
 import os
 import json
+import re
 import sys
-import venv
-import datetime
+import hashlib
+import tempfile
+import threading
+import time
 from dotenv import load_dotenv
 import asyncio
-import signal
+import subprocess
 
-import litellm
 from typing import Tuple, Optional
-from gpt_functions import functions, CREATE_FILE_FUNC_NAME, CREATE_FOLDER_FUNC_NAME, LIST_FILES_FUNC_NAME, READ_FILE_FUNC_NAME,  UPDATE_FILE_FUNC_NAME, EXECUTE_CODE_FUNC_NAME, STOP_PROCESS_FUNC_NAME, BASE_SYSTEM_PROMPT, AUTOMODE_SYSTEM_PROMPT, CHAIN_OF_THOUGHT_PROMPT
+from gpt_functions import functions, CREATE_FILE_FUNC_NAME, CREATE_FOLDER_FUNC_NAME, LIST_FILES_FUNC_NAME, READ_FILE_FUNC_NAME,  UPDATE_FILE_FUNC_NAME, EXECUTE_CODE_FUNC_NAME, STOP_PROCESS_FUNC_NAME, APPLY_PATCH_FUNC_NAME, READ_PROCESS_OUTPUT_FUNC_NAME, WAIT_FOR_PROCESS_FUNC_NAME, SEARCH_CODE_FUNC_NAME, BASE_SYSTEM_PROMPT, AUTOMODE_SYSTEM_PROMPT, CHAIN_OF_THOUGHT_PROMPT
+from tool_dispatcher import ToolDispatcher, current_tool_call_id
+from streaming import StreamAccumulator
+from interpreter_pool import InterpreterPool
+from process_output import ManagedProcess, format_output, read_buffers
+from process_supervisor import ProcessLimits, ProcessSupervisor
+from context_manager import ContextManager
+from file_ops import apply_search_replace, apply_unified_diff, atomic_write, read_range
+from workspace_index import WorkspaceIndex
+from search_index import SearchIndex
+from completion_cache import CompletionCache
+from tool_cache import ToolResultCache, stat_fingerprint
+from scheduler import RequestScheduler
+from session_log import SessionLog, load_messages, pending_tool_calls
+import tracing
 
+# Only the console is needed for the first prompt; litellm and the rest of rich are imported on first use
+# (async_main starts importing them in the background while the user types)
 from rich.console import Console
-from rich.panel import Panel
-from rich.syntax import Syntax
-from rich.markdown import Markdown
-from rich.progress import Progress, SpinnerColumn, TextColumn, BarColumn
 
 # Load environment variables
 load_dotenv()
 console = Console()
 
 # CONFIG PARAMETERS
+MODEL = "gpt-4o-mini"
 AUTO_ITERATION_NUM = 20
 AUTOMODE_COMPLETE_PHRASE = "AUTOMODE_COMPLETE"
+MAX_TOOL_CONCURRENCY = 8
+STREAM_RENDER_INTERVAL = 0.1
+USE_INTERPRETER_POOL = True
+INTERPRETER_POOL_SIZE = 2
+INTERPRETER_POOL_MAX_RUNS = 20
+INTERPRETER_POOL_PRELOAD = ["json", "re", "math", "datetime", "collections", "itertools"]
+OUTPUT_BUFFER_BYTES = 256 * 1024
+WAIT_FOR_PROCESS_MAX_TIMEOUT = 300
+CONTEXT_TOKEN_BUDGET = 60000
+CONTEXT_KEEP_RECENT_MESSAGES = 6
+CONTEXT_STUB_MIN_TOKENS = 200
+LIST_FILES_MAX_ENTRIES = 500
+# off / read_through / record / replay (replay treats a miss as an error, for offline re-runs)
+COMPLETION_CACHE_MODE = os.environ.get("COMPLETION_CACHE_MODE", "off")
+COMPLETION_CACHE_PATH = os.environ.get("COMPLETION_CACHE_PATH", ".completion_cache.sqlite3")
+COMPLETION_CACHE_MAX_BYTES = 256 * 1024 * 1024
+COMPLETION_CACHE_MAX_AGE = 30 * 24 * 60 * 60
+# Set TRACE_PATH to write spans (LLM calls, tools, subprocesses) as JSON lines; TRACE_FORMAT is "jsonl" or "otlp"
+TRACE_PATH = os.environ.get("TRACE_PATH") or None
+TRACE_FORMAT = os.environ.get("TRACE_FORMAT", "jsonl")
+# Every message is appended to <SESSION_LOG_DIR>/<session id>.jsonl as it happens; resume with --resume <session id>
+SESSION_LOG_DIR = "sessions"
+SESSION_LOG_FSYNC = "interval"
+SESSION_LOG_FSYNC_INTERVAL = 1.0
+SESSION_LOG_BLOB_THRESHOLD = 4096
+# Provider quotas as (requests/min, tokens/min); None leaves that side unlimited. Shared by every session in the process
+RATE_LIMITS = {"gpt-4o-mini": (500, 200000)}
+# Model to switch to after FALLBACK_AFTER_RETRIES failed attempts, e.g. FALLBACK_MODEL=gpt-3.5-turbo
+FALLBACK_MODEL = os.environ.get("FALLBACK_MODEL") or None
+FALLBACK_AFTER_RETRIES = 2
+MAX_RETRIES = 5
+RETRY_BASE_DELAY = 1.0
+RETRY_MAX_DELAY = 60.0
+# Completion tokens reserved per request until the real usage is known
+COMPLETION_TOKENS_ESTIMATE = 1024
+# execute_code runs at most MAX_CONCURRENT_PROCESSES processes per session; later calls queue for a free slot
+MAX_CONCURRENT_PROCESSES = 4
+# Finished background processes whose output was never read are kept (with their output) up to this many
+MAX_FINISHED_PROCESSES = 16
+# Per-process rlimits (None = unlimited); a cgroup v2 memory.max is added on top when the cgroup is delegated to us
+PROCESS_CPU_SECONDS = 60
+PROCESS_MEMORY_BYTES = 4 * 1024 * 1024 * 1024
+PROCESS_OPEN_FILES = 1024
+USE_CGROUP = True
+# Each session writes its scripts to its own directory under SCRATCH_ROOT, removed when the session ends
+SCRATCH_ROOT = os.path.join(tempfile.gettempdir(), "swe_agent_scratch")
+PROCESS_RUNNER_SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "process_runner.py")
+
+# Built once: every request sends the same tool list and system prompt
+TOOLS = [{"type": "function", "function": func} for func in functions]
+SYSTEM_PROMPT = BASE_SYSTEM_PROMPT + "\n\n" + AUTOMODE_SYSTEM_PROMPT + "\n\n" + CHAIN_OF_THOUGHT_PROMPT
+# Modules that take long to import and aren't needed until the first request
+BACKGROUND_IMPORTS = ["litellm", "rich.markdown", "rich.live", "rich.panel", "rich.table"]
+
+_background_import_thread: Optional[threading.Thread] = None
+_interpreter_pool: Optional[InterpreterPool] = None
+_completion_cache: Optional[CompletionCache] = None
+_scheduler: Optional[RequestScheduler] = None
+
+
+def get_litellm():
+    """
+    litellmはimportに数秒かかるので、起動時ではなく最初に使うときに読み込む
+    """
+    wait_for_background_imports()
+    import litellm
+    return litellm
+
+
+def import_background_modules() -> None:
+    """
+    BACKGROUND_IMPORTSを読み込んでおく。start_background_importsで別スレッドから呼ばれる
+    """
+    for module_name in BACKGROUND_IMPORTS:
+        try:
+            importlib.import_module(module_name)
+        except ImportError:
+            # Reported where the module is actually used
+            pass
+
+
+def start_background_imports() -> None:
+    """
+    async_mainが最初の入力を待つ間に、BACKGROUND_IMPORTSを別スレッドで読み込み始める
+    """
+    global _background_import_thread
+    if _background_import_thread is None:
+        _background_import_thread = threading.Thread(target=import_background_modules, name="background-imports", daemon=True)
+        _background_import_thread.start()
+
+
+def wait_for_background_imports() -> None:
+    """
+    裏での読み込みが終わるまで待つ。litellmは2つのスレッドから同時にimportすると
+    途中まで初期化されたモジュールを掴んだり_DeadlockErrorになったりするので、使う側は先にこれを呼ぶ
+    """
+    thread = _background_import_thread
+    if thread is not None and thread is not threading.current_thread():
+        thread.join()
 
 
 def setup_virtual_environment() -> Tuple[str, str]:
@@ -31,6 +147,8 @@ def setup_virtual_environment() -> Tuple[str, str]:
     venv_path = os.path.join(os.getcwd(), venv_name)
     try:
         if not os.path.exists(venv_path):
+            # Imported here so startup doesn't pay for it once the environment exists
+            import venv
             venv.create(venv_path, with_pip=True)
         
         # Activate the virtual environment
@@ -45,6 +163,35 @@ def setup_virtual_environment() -> Tuple[str, str]:
         raise
 
 
+async def get_interpreter_pool() -> InterpreterPool:
+    """
+    execute_code用のワーカープールを初回呼び出し時に作って起動する
+    """
+    global _interpreter_pool
+    if _interpreter_pool is None:
+        venv_path, _ = setup_virtual_environment()
+        if sys.platform == "win32":
+            python_executable = os.path.join(venv_path, "Scripts", "python.exe")
+        else:
+            python_executable = os.path.join(venv_path, "bin", "python")
+        # Workers get the memory and open-file limits; CPU time is limited per job by the worker itself
+        _interpreter_pool = InterpreterPool(python_executable, INTERPRETER_POOL_SIZE, INTERPRETER_POOL_MAX_RUNS, INTERPRETER_POOL_PRELOAD,
+                                            OUTPUT_BUFFER_BYTES, process_limits().environment(cpu=False))
+        await _interpreter_pool.start()
+    return _interpreter_pool
+
+
+def process_limits() -> ProcessLimits:
+    return ProcessLimits(PROCESS_CPU_SECONDS, PROCESS_MEMORY_BYTES, PROCESS_OPEN_FILES)
+
+
+def new_process_supervisor() -> ProcessSupervisor:
+    """
+    セッション1つ分のexecute_codeのプロセス管理を作る。使い終わったらclose()する
+    """
+    return ProcessSupervisor(SCRATCH_ROOT, MAX_CONCURRENT_PROCESSES, process_limits(), USE_CGROUP, MAX_FINISHED_PROCESSES)
+
+
 # Define custom tools
 def create_file(path: str, content: str)-> str:
     if os.path.exists(path):
@@ -67,184 +214,790 @@ def create_folder(path: str)-> str:
     except Exception as e:
         return f"Error creating folder: {str(e)}"
 
-def list_files(path: str)-> str:
+def agent_output_paths(workdir: Optional[str] = None) -> frozenset:
+    """
+    エージェント自身が書き出すファイル(セッションログ、トレース、completionキャッシュ)の場所。
+    list_filesやsearch_codeの索引からはこれらを外す
+    """
+    paths = {os.path.join(workdir or ".", SESSION_LOG_DIR), SESSION_LOG_DIR}
+    # The cache runs in WAL mode, which keeps two more files next to the database
+    paths.update(COMPLETION_CACHE_PATH + suffix for suffix in ("", "-wal", "-shm"))
+    if TRACE_PATH is not None:
+        paths.add(TRACE_PATH)
+    return frozenset(os.path.abspath(path) for path in paths)
+
+def list_files(path: str, recursive: bool = False, max_depth: Optional[int] = None, pattern: Optional[str] = None,
+               max_entries: Optional[int] = None, index: Optional[WorkspaceIndex] = None)-> str:
     try:
-        files = os.listdir(path)
-        print(f"Tool used: list_files - Listed files in folder: {path}")
-        return f"Files in folder '{path}': {', '.join(files)}"
+        if index is None:
+            index = WorkspaceIndex(path, ignored_paths=agent_output_paths())
+        if not recursive:
+            files = index.listdir(path)
+            print(f"Tool used: list_files - Listed files in folder: {path}")
+            return f"Files in folder '{path}': {', '.join(files)}"
+        entries, omitted = index.walk(path, max_depth, pattern, max_entries or LIST_FILES_MAX_ENTRIES)
+        print(f"Tool used: list_files - Listed files recursively in folder: {path}")
+        result = f"Files under folder '{path}' (ignored folders are not expanded):\n" + "\n".join(entries)
+        if omitted:
+            result += f"\n... {omitted} more entries not shown. Narrow the listing with max_depth or pattern."
+        return result
     except Exception as e:
         return f"Error listing files: {str(e)}"
 
-def read_file(path: str)-> str:
+def read_file(path: str, start_line: Optional[int] = None, end_line: Optional[int] = None,
+              offset: Optional[int] = None, length: Optional[int] = None)-> str:
     try:
-        with open(path, 'r') as f:
-            content = f.read()
-        print(f"Tool used: read_file - Read file: {path}")
-        return f"Content of file '{path}':\n{content}"
+        content, description, digest = read_range(path, start_line, end_line, offset, length)
+        print(f"Tool used: read_file - Read file: {path} ({description})")
+        if description == "whole file":
+            return f"Content of file '{path}' (sha256: {digest}):\n{content}"
+        return f"Content of file '{path}', {description} (sha256 of whole file: {digest}):\n{content}"
     except Exception as e:
         return f"Error reading file: {str(e)}"
 
 def update_file(name: str, content: str)-> str:
     try:
-        with open(name, 'w') as f:
-            f.write(content)
+        atomic_write(name, content)
         print(f"Tool used: update_file - Updated file: {name}")
         return f"File '{name}' updated successfully."
     except Exception as e:
         return f"Error updating file: {str(e)}"
 
-async def execute_code(code, running_processes = {}, timeout=10):
+def apply_patch(path: str, patch: Optional[str] = None, edits: Optional[list] = None, expected_sha256: Optional[str] = None)-> str:
+    if (patch is None) == (edits is None):
+        return "Error applying patch: provide exactly one of 'patch' or 'edits'."
+    try:
+        with open(path, 'rb') as f:
+            data = f.read()
+        # Reject edits made against an older version of the file
+        current_sha256 = hashlib.sha256(data).hexdigest()
+        if expected_sha256 and expected_sha256 != current_sha256:
+            return f"Error applying patch: '{path}' has changed since it was read (current sha256: {current_sha256}). Read it again before editing."
+        text = data.decode("utf-8")
+        if patch is not None:
+            new_text, count = apply_unified_diff(text, patch)
+        else:
+            new_text, count = apply_search_replace(text, edits)
+        atomic_write(path, new_text)
+        print(f"Tool used: apply_patch - Patched file: {path}")
+        new_sha256 = hashlib.sha256(new_text.encode("utf-8")).hexdigest()
+        return f"Applied {count} change(s) to '{path}' (new sha256: {new_sha256})."
+    except Exception as e:
+        return f"Error applying patch: {str(e)}"
+
+async def execute_code(code, supervisor: ProcessSupervisor, timeout=10, cwd=None, use_pool=None):
     venv_path, activate_script = setup_virtual_environment()
     
-    # Generate a unique identifier for this process
-    process_id = f"process_{len(running_processes)}"
+    # IDs come from a process-wide counter, so they stay unique after stop_process and across sessions
+    process_id = supervisor.new_process_id()
     
-    # Write the code to a temporary file
-    with open(f"{process_id}.py", "w") as f:
+    # Write the code to the session's scratch directory; it still runs with cwd as its working directory
+    script_path = supervisor.script_path(process_id)
+    with open(script_path, "w") as f:
         f.write(code)
-    
-    # Prepare the command to run the code
-    if sys.platform == "win32":
-        command = f'"{activate_script}" && python3 {process_id}.py'
-    else:
-        command = f'source "{activate_script}" && python3 {process_id}.py'
-    
-    # Create a process to run the command
-    process = await asyncio.create_subprocess_shell(
-        command,
-        stdout=asyncio.subprocess.PIPE,
-        stderr=asyncio.subprocess.PIPE,
-        shell=True,
-        preexec_fn=None if sys.platform == "win32" else os.setsid
-    )
-    
-    # Store the process in our global dictionary
-    running_processes[process_id] = process
-    
-    try:
-        # Wait for initial output or timeout
-        stdout, stderr = await asyncio.wait_for(process.communicate(), timeout=timeout)
-        stdout = stdout.decode()
-        stderr = stderr.decode()
-        return_code = process.returncode
-    except asyncio.TimeoutError:
-        # If we timeout, it means the process is still running
-        stdout = "Process started and running in the background."
-        stderr = ""
-        return_code = "Running"
-    
-    execution_result = f"Process ID: {process_id}\n\nStdout:\n{stdout}\n\nStderr:\n{stderr}\n\nReturn Code: {return_code}"
-    return process_id, execution_result, running_processes
 
-def stop_process(process_id, running_processes = {}):
-    if process_id in running_processes:
-        process = running_processes[process_id]
-        if sys.platform == "win32":
-            process.terminate()
-        else:
-            os.killpg(os.getpgid(process.pid), signal.SIGTERM)
-        del running_processes[process_id]
-        return f"Process {process_id} has been stopped.", running_processes
-    else:
-        return f"No running process found with ID {process_id}.", running_processes
+    use_pool = USE_INTERPRETER_POOL if use_pool is None else use_pool
+    with tracing.tracer.span("subprocess.execute_code", process_id=process_id, pool=use_pool, bytes_in=len(code)) as span:
+        queue_wait = await supervisor.acquire(timeout)
+        if queue_wait is None:
+            span.set(error="queue_timeout")
+            running = ", ".join(supervisor.running) or "none in the background"
+            return process_id, (f"Error: {supervisor.max_concurrent} processes are already running ({running}) and none finished within {timeout}s. "
+                                "Wait for or stop one of them before starting another."), supervisor
+        span.set(queue_wait=queue_wait)
+        started = time.perf_counter()
+        try:
+            if use_pool:
+                # Run on a pre-started interpreter instead of paying for shell + python startup
+                pool = await get_interpreter_pool()
+                run = await pool.run(code, script_path, os.path.abspath(cwd or "."), timeout, supervisor.limits.cpu_seconds)
+                if run.process is None:
+                    record = supervisor.record_exit(process_id, run.return_code, started, run.resources)
+                    span.set(return_code=run.return_code, stdout_bytes=run.stdout.total_written, stderr_bytes=run.stderr.total_written,
+                             **{f"resources_{key}": value for key, value in record["resources"].items()})
+                    execution_result = format_output(process_id, read_buffers(run.stdout, run.stderr), run.return_code, record["resources"])
+                    note = supervisor.exit_note(process_id)
+                    return process_id, execution_result + (f"\n\n{note}" if note else ""), supervisor
+                managed = ManagedProcess(run.process, run.stdout, run.stderr, run.drains, job_marker=True)
+            else:
+                # Prepare the command to run the code; the runner reports the script's resource usage
+                usage_path = supervisor.usage_path(process_id)
+                if sys.platform == "win32":
+                    command = f'"{activate_script}" && python "{PROCESS_RUNNER_SCRIPT}" "{script_path}" "{usage_path}"'
+                else:
+                    command = f'. "{activate_script}" && exec python3 "{PROCESS_RUNNER_SCRIPT}" "{script_path}" "{usage_path}"'
+                
+                # Create a process to run the command in its own session; the runner applies the session's limits to itself
+                process = await asyncio.create_subprocess_shell(
+                    command,
+                    stdout=asyncio.subprocess.PIPE,
+                    stderr=asyncio.subprocess.PIPE,
+                    shell=True,
+                    cwd=cwd,
+                    env={**os.environ, **supervisor.environment()},
+                    start_new_session=True
+                )
+                # Drain the pipes into bounded buffers from the start so the child never blocks on a full pipe
+                managed = ManagedProcess.start(process, OUTPUT_BUFFER_BYTES, usage_path)
+        except BaseException:
+            supervisor.release()
+            raise
+        # From here the supervisor reaps the process and frees its slot when it exits
+        supervisor.track(process_id, managed, started)
+        if not use_pool:
+            # Wait for initial output or timeout
+            await managed.wait(timeout)
+
+        output = managed.read()
+        record = supervisor.reap(process_id)
+        span.set(
+            return_code=managed.return_code if managed.finished else "Running",
+            stdout_bytes=output["stdout_cursor"], stderr_bytes=output["stderr_cursor"],
+            **{f"resources_{key}": value for key, value in (record["resources"] if record else {}).items()}
+        )
+    if record is not None:
+        note = supervisor.exit_note(process_id)
+        return process_id, format_output(process_id, output, record["return_code"], record["resources"]) + (f"\n\n{note}" if note else ""), supervisor
+
+    # Still running: keep it so its output can be read later
+    supervisor.keep(process_id, managed)
+    execution_result = format_output(process_id, output, "Running")
+    return process_id, execution_result, supervisor
+
+def normalize_process_id(process_id) -> str:
+    """
+    モデルが数字だけで指定したプロセスIDをexecute_codeが返す形式にそろえる
+    """
+    process_id = str(process_id)
+    return process_id if process_id.startswith("process_") else f"process_{process_id}"
+
+def describe_missing_process(process_id: str, supervisor: ProcessSupervisor) -> str:
+    record = supervisor.exits.get(process_id)
+    if record is None:
+        return f"No running process found with ID {process_id}."
+    return f"Process {process_id} is no longer tracked; it {record['status']} with return code {record['return_code']}."
+
+def read_process_output(process_id, supervisor: ProcessSupervisor, stdout_cursor=None, stderr_cursor=None) -> str:
+    process_id = normalize_process_id(process_id)
+    managed = supervisor.processes.get(process_id)
+    if managed is None:
+        return describe_missing_process(process_id, supervisor)
+    record = supervisor.reap(process_id)
+    print(f"Tool used: read_process_output - Read output of: {process_id}")
+    output = managed.read(stdout_cursor, stderr_cursor)
+    if record is None:
+        return format_output(process_id, output, "Running")
+    # The exit has now been reported along with the last of the output
+    supervisor.forget_if_drained(process_id)
+    return format_output(process_id, output, record["return_code"], record["resources"])
+
+async def wait_for_process(process_id, supervisor: ProcessSupervisor, timeout=30) -> str:
+    process_id = normalize_process_id(process_id)
+    managed = supervisor.processes.get(process_id)
+    if managed is None:
+        return describe_missing_process(process_id, supervisor)
+    finished = await managed.wait(min(timeout, WAIT_FOR_PROCESS_MAX_TIMEOUT))
+    print(f"Tool used: wait_for_process - Waited for: {process_id}")
+    # Return only what the model hasn't seen yet
+    output = managed.read()
+    if not finished:
+        return format_output(process_id, output, "Running")
+    record = supervisor.reap(process_id)
+    supervisor.forget_if_drained(process_id)
+    result = format_output(process_id, output, record["return_code"], record["resources"])
+    note = supervisor.exit_note(process_id)
+    return result + (f"\n\n{note}" if note else "")
+
+def stop_process(process_id, supervisor: ProcessSupervisor):
+    process_id = normalize_process_id(process_id)
+    managed = supervisor.processes.get(process_id)
+    if managed is None:
+        return describe_missing_process(process_id, supervisor), supervisor
+    if not supervisor.stop(process_id):
+        return_code = managed.return_code if managed.finished else managed.process.returncode
+        return f"Process {process_id} had already exited with return code {return_code}.", supervisor
+    return f"Process {process_id} has been stopped.", supervisor
 
-def update_token_count(usage: dict[str, int], state: dict[str,int]) -> dict[str,int]:
+def stop_all_processes(supervisor: ProcessSupervisor) -> ProcessSupervisor:
+    """
+    タスクの終わりにバックグラウンドで動いているプロセスをすべて止める
+    """
+    supervisor.stop_all()
+    return supervisor
+
+def update_token_count(usage: dict[str, int], state: dict[str,int], ttft: Optional[float] = None, verbose: bool = True) -> dict[str,int]:
     """
     トークン数を合計に加算し、今回の使用量を表示
+    ttftが渡された場合はtime-to-first-tokenも併せて表示
     """
-    console.print("Input tokens: {}, Output tokens: {}".format(state["input"], state["output"]))
+    if verbose:
+        console.print("Input tokens: {}, Output tokens: {}".format(state["input"], state["output"]))
+        if ttft is not None:
+            console.print("Time to first token: {:.2f}s".format(ttft))
     assert type(state["input"]) is int and type(state["output"]) is int
     assert type(usage["prompt_tokens"]) is int and type(usage["completion_tokens"]) is int
     new_state = {
         "input": state["input"] + usage["prompt_tokens"],
         "output": state["output"] + usage["completion_tokens"]
     }
-    console.print("New Token State:{}".format(new_state))
+    if verbose:
+        console.print("New Token State:{}".format(new_state))
     return new_state
-    
 
-# Define available functions for the model
 
-def main():
-    print("Welcome to the SWE Agent")
-    print("You can ask to anything. Type 'quit' to exit.")
+def build_tool_handlers(supervisor: ProcessSupervisor, workdir: Optional[str] = None, tool_cache: Optional[ToolResultCache] = None) -> dict:
+    """
+    ツール名から、引数dictを受け取って結果文字列を返すハンドラへの対応表を作る
+    workdirを指定すると相対パスはそのディレクトリ基準で解決される
+    """
+    if tool_cache is None:
+        tool_cache = ToolResultCache()
 
-    token_sum_state = {"input": 0, "output": 0}
+    def resolve(path: str) -> str:
+        if workdir is None or os.path.isabs(path):
+            return path
+        return os.path.join(workdir, path)
 
-    while True:
-        user_input = console.input("[bold cyan]You:[/bold cyan] ")
-        
-        if user_input.lower() == 'quit':
-            break
+    # One directory index per session; the write tools below keep it up to date
+    index = WorkspaceIndex(workdir or os.getcwd(), ignored_paths=agent_output_paths(workdir))
+    search_index = SearchIndex(index)
+    # Exits already accounted for by a rescan; a background process may have written files right before it ended
+    seen_exits = 0
 
-        iteration_count = 0
-        
+    def _create_file(args: dict) -> str:
+        path = resolve(args["name"])
+        result = create_file(path, args["content"])
+        index.notify_created(path)
+        search_index.notify_updated(path)
+        tool_cache.invalidate(path)
+        return result
+
+    def _create_folder(args: dict) -> str:
+        path = resolve(args["path"])
+        result = create_folder(path)
+        index.notify_created(path)
+        tool_cache.invalidate(path)
+        return result
+
+    def _update_file(args: dict) -> str:
+        path = resolve(args["path"])
+        result = update_file(path, args["content"])
+        index.notify_updated(path)
+        search_index.notify_updated(path)
+        tool_cache.invalidate(path)
+        return result
+
+    def _apply_patch(args: dict) -> str:
+        path = resolve(args["path"])
+        result = apply_patch(path, args.get("patch"), args.get("edits"), args.get("expected_sha256"))
+        index.notify_updated(path)
+        search_index.notify_updated(path)
+        tool_cache.invalidate(path)
+        return result
+
+    def _list_files(args: dict) -> str:
+        path = resolve(args["path"])
+        recursive = args.get("recursive", False)
+        key = (LIST_FILES_FUNC_NAME, os.path.abspath(path), recursive, args.get("max_depth"), args.get("pattern"), args.get("max_entries"))
+        if not recursive:
+            fingerprint = stat_fingerprint(path)
+            cached = tool_cache.lookup(key, fingerprint)
+            tracing.current_span().set(cache_hit=cached is not None)
+            if cached is not None:
+                result, call_id = cached
+            else:
+                result = list_files(path, index=index)
+                call_id = current_tool_call_id.get()
+                if not result.startswith("Error"):
+                    tool_cache.store(key, path, fingerprint, result, call_id)
+        else:
+            # A nested change doesn't show in the top folder's stat, so compare the (index-backed) listing itself
+            result = list_files(path, True, args.get("max_depth"), args.get("pattern"), args.get("max_entries"), index)
+            fingerprint = hashlib.sha256(result.encode()).hexdigest()
+            cached = tool_cache.lookup(key, fingerprint)
+            call_id = cached[1] if cached is not None else current_tool_call_id.get()
+            tracing.current_span().set(cache_hit=cached is not None)
+            if cached is None and not result.startswith("Error"):
+                tool_cache.store(key, path, fingerprint, result, call_id)
+        if cached is not None and args.get("only_if_changed"):
+            return f"Listing of folder '{path}' is unchanged since call {call_id}; see that result."
+        return result
+
+    def _read_file(args: dict) -> str:
+        path = resolve(args["path"])
+        key = (READ_FILE_FUNC_NAME, os.path.abspath(path), args.get("start_line"), args.get("end_line"), args.get("offset"), args.get("length"))
+        fingerprint = stat_fingerprint(path)
+        cached = tool_cache.lookup(key, fingerprint)
+        tracing.current_span().set(cache_hit=cached is not None)
+        if cached is not None:
+            result, call_id = cached
+            if args.get("only_if_changed"):
+                return f"File '{path}' is unchanged since call {call_id}; see that result for its content."
+            return result
+        result = read_file(path, args.get("start_line"), args.get("end_line"), args.get("offset"), args.get("length"))
+        if not result.startswith("Error"):
+            tool_cache.store(key, path, fingerprint, result, current_tool_call_id.get())
+        return result
+
+    def _search_code(args: dict) -> str:
+        nonlocal seen_exits
+        if supervisor.running or len(supervisor.exits) != seen_exits:
+            # Background processes may still be writing files, or did until they ended
+            seen_exits = len(supervisor.exits)
+            search_index.mark_dirty()
+        path = args.get("path")
+        if path:
+            path = os.path.relpath(os.path.abspath(resolve(path)), search_index.root)
+        try:
+            lines, matches, opened = search_index.search(
+                args["query"], path, args.get("path_pattern"), args.get("ignore_case", False),
+                args.get("context_lines", 2), args.get("max_results", 50)
+            )
+        except re.error as e:
+            return f"Error: invalid regular expression: {str(e)}"
+        tracing.current_span().set(files_opened=opened, matches=matches)
+        if not matches:
+            return f"No matches for '{args['query']}'."
+        result = "\n".join(lines)
+        if matches >= args.get("max_results", 50):
+            result += f"\n\n(Stopped after {matches} matches; narrow the query or use path/path_pattern to see more.)"
+        return result
+
+    async def _execute_code(args: dict) -> str:
+        process_id, result, _ = await execute_code(args["code"], supervisor, cwd=workdir)
+        # The code may have changed files behind the index's back
+        search_index.mark_dirty()
+        if process_id in supervisor.processes:
+            result += "\n\nNote: The process is still running in the background. Use read_process_output or wait_for_process to follow its output."
+        return result
+
+    async def _stop_process(args: dict) -> str:
+        result, _ = stop_process(args["process_id"], supervisor)
+        return result
+
+    async def _read_process_output(args: dict) -> str:
+        return read_process_output(args["process_id"], supervisor, args.get("stdout_cursor"), args.get("stderr_cursor"))
+
+    async def _wait_for_process(args: dict) -> str:
+        return await wait_for_process(args["process_id"], supervisor, args.get("timeout", 30))
+
+    return {
+        CREATE_FILE_FUNC_NAME: _create_file,
+        CREATE_FOLDER_FUNC_NAME: _create_folder,
+        LIST_FILES_FUNC_NAME: _list_files,
+        READ_FILE_FUNC_NAME: _read_file,
+        UPDATE_FILE_FUNC_NAME: _update_file,
+        APPLY_PATCH_FUNC_NAME: _apply_patch,
+        EXECUTE_CODE_FUNC_NAME: _execute_code,
+        STOP_PROCESS_FUNC_NAME: _stop_process,
+        READ_PROCESS_OUTPUT_FUNC_NAME: _read_process_output,
+        WAIT_FOR_PROCESS_FUNC_NAME: _wait_for_process,
+        SEARCH_CODE_FUNC_NAME: _search_code,
+    }
+
+
+def build_tool_write_keys(workdir: Optional[str] = None) -> dict:
+    """
+    ファイルやフォルダを書き換えるツールについて、書き込み先の実パスを返す関数の対応表を作る。
+    ToolDispatcherは実パスが同じ呼び出しをtool_callsの順に1つずつ実行する
+    """
+    def target(argument: str):
+        def key(args: dict) -> str:
+            path = args[argument]
+            if workdir is not None and not os.path.isabs(path):
+                path = os.path.join(workdir, path)
+            return os.path.realpath(path)
+        return key
+
+    return {
+        CREATE_FILE_FUNC_NAME: target("name"),
+        CREATE_FOLDER_FUNC_NAME: target("path"),
+        UPDATE_FILE_FUNC_NAME: target("path"),
+        APPLY_PATCH_FUNC_NAME: target("path"),
+    }
+
+
+def estimate_usage(messages: list, accumulator: StreamAccumulator) -> dict[str, int]:
+    """
+    ストリームにusageが含まれなかった場合にlitellmのトークナイザで使用量を見積もる
+    """
+    completion_text = (accumulator.content or "") + "".join(
+        tool_call["function"]["arguments"] for tool_call in accumulator.tool_calls.values()
+    )
+    return {
+        "prompt_tokens": get_litellm().token_counter(model=MODEL, messages=messages),
+        "completion_tokens": get_litellm().token_counter(model=MODEL, text=completion_text) if completion_text else 0
+    }
+
+
+async def stream_assistant_message(response, started_at: float, render: bool = True) -> StreamAccumulator:
+    """
+    ストリームを読みながら本文を逐次Markdownとして描画し、組み立て済みの結果を返す
+    """
+    from rich.live import Live
+    from rich.markdown import Markdown
+
+    accumulator = StreamAccumulator(started_at)
+    live = None
+    last_render = 0.0
+    try:
+        async for chunk in response:
+            text = accumulator.add_chunk(chunk)
+            if not text or not render:
+                continue
+            if live is None:
+                live = Live(console=console, refresh_per_second=10, vertical_overflow="visible")
+                live.start()
+            # Re-parsing the whole Markdown on every delta is quadratic, so throttle it to the refresh rate
+            now = time.perf_counter()
+            if now - last_render >= STREAM_RENDER_INTERVAL:
+                live.update(Markdown(accumulator.content))
+                last_render = now
+    finally:
+        if live is not None:
+            live.update(Markdown(accumulator.content))
+            live.stop()
+        accumulator.finish()
+    return accumulator
+
+
+def get_completion_cache() -> Optional[CompletionCache]:
+    """
+    COMPLETION_CACHE_MODEがoff以外なら、初回呼び出し時にキャッシュを開く
+    """
+    global _completion_cache
+    if _completion_cache is None and COMPLETION_CACHE_MODE != "off":
+        _completion_cache = CompletionCache(COMPLETION_CACHE_PATH, COMPLETION_CACHE_MODE, COMPLETION_CACHE_MAX_BYTES, COMPLETION_CACHE_MAX_AGE)
+    return _completion_cache
+
+
+def get_scheduler() -> RequestScheduler:
+    global _scheduler
+    if _scheduler is None:
+        _scheduler = RequestScheduler(
+            RATE_LIMITS, {MODEL: FALLBACK_MODEL} if FALLBACK_MODEL else None,
+            MAX_RETRIES, RETRY_BASE_DELAY, RETRY_MAX_DELAY, FALLBACK_AFTER_RETRIES
+        )
+    return _scheduler
+
+
+async def request_completion(messages: list, tools: list, render: bool = True, prompt_tokens: Optional[int] = None,
+                             priority: int = 0) -> Tuple[dict, dict[str, int], Optional[float]]:
+    """
+    モデルを呼び出して(assistantメッセージ, トークン使用量, time-to-first-token)を返す。
+    キャッシュにヒットした場合はモデルを呼ばず、使用量は0として扱う
+    呼び出しはスケジューラを通すので、レート制限の待ちと失敗時の再試行・フォールバックはここで吸収される
+    """
+    with tracing.tracer.span("llm.completion", model=MODEL, messages=len(messages)) as span:
+        if span.recording:
+            span.set(bytes_out=len(json.dumps(messages, ensure_ascii=False, default=lambda x: x.__dict__)))
+        cache = get_completion_cache()
+        cache_key = CompletionCache.make_key(MODEL, messages, tools) if cache is not None else None
+        if cache is not None:
+            cached = cache.lookup(cache_key)
+            span.set(cache_hit=cached is not None)
+            if cached is not None:
+                if render:
+                    if cached["message"]["content"] is not None:
+                        from rich.markdown import Markdown
+                        console.print(Markdown(cached["message"]["content"]))
+                    console.print("(completion served from cache)")
+                return cached["message"], {"prompt_tokens": 0, "completion_tokens": 0}, None
+
+        async def call(model: str) -> StreamAccumulator:
+            request_started = time.perf_counter()
+            response = await get_litellm().acompletion(
+                model=model,
+                messages=messages,
+                tools=tools,
+                tool_choice="auto",
+                parallel_tool_calls=True,
+                drop_params=True,
+                # The scheduler does all retrying and falling back; a retry inside litellm or the openai client
+                # would hide the 429 (and its Retry-After) from it and wait without holding back other requests
+                max_retries=0,
+                num_retries=0,
+                stream=True,
+                stream_options={"include_usage": True}
+            )
+            return await stream_assistant_message(response, request_started, render)
+
+        if prompt_tokens is None:
+            prompt_tokens = get_litellm().token_counter(model=MODEL, messages=messages, tools=tools)
+        estimated_tokens = prompt_tokens + COMPLETION_TOKENS_ESTIMATE
+        scheduler = get_scheduler()
+        accumulator, model, schedule_stats = await scheduler.submit(call, MODEL, estimated_tokens, priority)
+        span.set(model=model, **schedule_stats)
+        if render and (schedule_stats["retries"] or schedule_stats["fallback"]):
+            console.print(f"(answered by {model} after {schedule_stats['retries']} retries)")
+        assistant_message = accumulator.message()
+        usage = accumulator.usage or estimate_usage(messages, accumulator)
+        usage = {"prompt_tokens": usage["prompt_tokens"], "completion_tokens": usage["completion_tokens"]}
+        scheduler.record_usage(model, estimated_tokens, usage["prompt_tokens"] + usage["completion_tokens"])
+        if cache is not None:
+            cache.store(cache_key, {"message": assistant_message, "usage": usage})
+        if span.recording:
+            # Generation speed excludes the wait for the first token
+            generation_time = accumulator.elapsed - (accumulator.ttft or 0.0)
+            span.set(
+                prompt_tokens=usage["prompt_tokens"], completion_tokens=usage["completion_tokens"], ttft=accumulator.ttft,
+                tokens_per_sec=usage["completion_tokens"] / generation_time if generation_time > 0 else None,
+                bytes_in=len(json.dumps(assistant_message, ensure_ascii=False))
+            )
+        return assistant_message, usage, accumulator.ttft
+
+
+async def run_agent_task(
+    user_input: str,
+    token_sum_state: dict[str, int],
+    supervisor: ProcessSupervisor,
+    workdir: Optional[str] = None,
+    token_budget: Optional[int] = None,
+    render: bool = True,
+    session_log: Optional[SessionLog] = None,
+    history: Optional[list] = None,
+    priority: int = 0
+) -> Tuple[dict, dict[str, int]]:
+    """
+    1つの依頼についてエージェントループを回し、結果とトークン数の合計を返す
+    token_budgetを指定するとこのタスクで使ったトークンが上限を超えた時点で打ち切る
+    historyに再開するセッションのメッセージを渡すと、その続きから回す(user_inputは使わない)
+    priorityは同じプロセスの他のセッションとモデルの呼び出し枠を取り合うときの優先度(小さいほど先)
+    """
+    iteration_count = 0
+    initial_tokens = token_sum_state["input"] + token_sum_state["output"]
+    status = "max_iterations"
+    content = None
+    
+    # litellm and rich are used from here on; let a background import that is still running finish first
+    await asyncio.to_thread(wait_for_background_imports)
+    if session_log is None:
+        session_log = open_session_log(os.path.join(workdir or ".", SESSION_LOG_DIR))
+    if history is None:
         message_history_state = [{"role": "user", "content": user_input}]
-        running_processes = {}
+        session_log.append(message_history_state[0])
+    else:
+        message_history_state = list(history)
+    tool_cache = ToolResultCache()
+    dispatcher = ToolDispatcher(build_tool_handlers(supervisor, workdir, tool_cache), MAX_TOOL_CONCURRENCY, build_tool_write_keys(workdir))
+    context_manager = ContextManager(
+        lambda messages, tools=None: get_litellm().token_counter(model=MODEL, messages=messages, tools=tools),
+        CONTEXT_TOKEN_BUDGET, CONTEXT_KEEP_RECENT_MESSAGES, CONTEXT_STUB_MIN_TOKENS
+    )
+    context_tokens_saved = 0
+    task_span = tracing.tracer.span("agent.task", workdir=workdir or os.getcwd())
+    try:
+        # Tool calls whose results were logged before the session stopped are not run again
+        pending = pending_tool_calls(message_history_state) if history is not None else []
+        if pending:
+            message_history_state.extend(await dispatcher.dispatch(pending, session_log.append))
+
         while True:
             iteration_count += 1
             # Call GPT-4o-mini
-            system_prompt = BASE_SYSTEM_PROMPT  + "\n\n" + AUTOMODE_SYSTEM_PROMPT + "\n\n" + CHAIN_OF_THOUGHT_PROMPT
-            response = litellm.completion(
-                model="gpt-4o-mini",
-                messages=[
-                    {"role": "system", "content": system_prompt},
-                ] + message_history_state,
-                tools=[{"type": "function", "function": func} for func in functions],
-                tool_choice="auto",
-                parallel_tool_calls=True,
-                drop_params=True
-            )
-            assistant_message = response.choices[0].message
-            if assistant_message.content is not None:
-                console.print(Markdown(assistant_message.content))
+            # Old, large tool results are replaced with stubs once the history outgrows the budget
+            with tracing.tracer.span("context.build", iteration=iteration_count) as span:
+                messages, context_stats = context_manager.build(SYSTEM_PROMPT, TOOLS, message_history_state)
+                span.set(sent_tokens=context_stats["sent_tokens"], saved_tokens=context_stats["saved_tokens"])
+            context_tokens_saved += context_stats["saved_tokens"]
+            if render:
+                console.print("Context tokens: {sent_tokens} sent, {saved_tokens} saved ({stubbed_messages} tool results stubbed)".format(**context_stats))
+            assistant_message, usage, ttft = await request_completion(messages, TOOLS, render, context_stats["sent_tokens"], priority)
+            content = assistant_message["content"]
+            # Counted before the stop checks: the final completion is billed like any other
+            token_sum_state = update_token_count(usage, token_sum_state, ttft, verbose=render)
         
             if iteration_count > AUTO_ITERATION_NUM or \
-                type(assistant_message.content) is str and AUTOMODE_COMPLETE_PHRASE in assistant_message.content:
-                d = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-                with open("conversation_history_{}.json".format(d), "w") as f:
-                   f.write(json.dumps(message_history_state, indent=4, default = lambda x: x.__dict__))
+                type(content) is str and AUTOMODE_COMPLETE_PHRASE in content:
+                if type(content) is str and AUTOMODE_COMPLETE_PHRASE in content:
+                    status = "complete"
                 break
-            token_sum_state = update_token_count(response.usage, token_sum_state)
             
             
             message_history_state.append(assistant_message)
+            session_log.append(assistant_message)
             # Check if the model wants to call a function
-            if assistant_message.tool_calls:
-                for tool_call in assistant_message.tool_calls:
-                    function_name = tool_call.function.name
-                    function_args = json.loads(tool_call.function.arguments)
-                    
-                    # Execute the appropriate function
-                    if function_name == CREATE_FILE_FUNC_NAME:
-                        result = create_file(function_args["name"], function_args["content"])
-                    elif function_name == CREATE_FOLDER_FUNC_NAME:
-                        result = create_folder(function_args["path"])
-                    elif function_name == LIST_FILES_FUNC_NAME:
-                        result = list_files(function_args["path"])
-                    elif function_name == READ_FILE_FUNC_NAME:
-                        result = read_file(function_args["path"])
-                    elif function_name == UPDATE_FILE_FUNC_NAME:
-                        result = update_file(function_args["path"], function_args["content"])
-                    elif function_name == EXECUTE_CODE_FUNC_NAME:
-                        process_id, result, running_processes = asyncio.run(execute_code(function_args["code"], running_processes))
-                        if process_id in running_processes:
-                            result += "\n\nNote: The process is still running in the background."
-                    elif function_name == STOP_PROCESS_FUNC_NAME:
-                        result, running_processes = stop_process(function_args["process_id"], running_processes)
-                    else:
-                        result = "Unknown function called."
-                        console.print(Panel(Markdown(f"## Unknown function called: {function_name}"), title="Error", style="red"))
-
-                    # Send the function result back to the model
-                    message_history_state.append({
-                        "tool_call_id": tool_call.id,
-                        "role": "tool",
-                        "name": function_name,
-                        "content": result
-                    })
+            if assistant_message.get("tool_calls"):
+                for tool_call in assistant_message["tool_calls"]:
+                    if tool_call["function"]["name"] not in dispatcher.handlers:
+                        from rich.markdown import Markdown
+                        from rich.panel import Panel
+                        console.print(Panel(Markdown(f"## Unknown function called: {tool_call['function']['name']}"), title="Error", style="red"))
 
-if __name__ == "__main__":
-    main()
+                # Run every tool call of this turn concurrently and send the results back in order
+                # Each result is logged as soon as it finishes, so a crash mid-turn loses only the unfinished calls
+                tool_messages = await dispatcher.dispatch(assistant_message["tool_calls"], session_log.append)
+                message_history_state.extend(tool_messages)
 
+            if token_budget is not None and \
+                token_sum_state["input"] + token_sum_state["output"] - initial_tokens >= token_budget:
+                status = "token_budget_exceeded"
+                break
+    except BaseException:
+        status = "interrupted"
+        raise
+    finally:
+        dispatcher.shutdown()
+        session_log.end(status, content)
+        session_log.close()
+        task_span.set(status=status, iterations=iteration_count, tokens=token_sum_state["input"] + token_sum_state["output"] - initial_tokens)
+        task_span.end()
+    if render:
+        console.print("Tool result cache: {hits} hits, {misses} misses, {invalidations} invalidations".format(**tool_cache.stats()))
 
+    result = {
+        "status": status,
+        "iterations": iteration_count,
+        "final_message": content,
+        "context_tokens_saved": context_tokens_saved,
+        "tool_cache": tool_cache.stats(),
+        "session_log": session_log.path,
+        "message_history": message_history_state
+    }
+    return result, token_sum_state
+
+
+def open_session_log(directory: str) -> SessionLog:
+    return SessionLog.create(directory, fsync=SESSION_LOG_FSYNC, fsync_interval=SESSION_LOG_FSYNC_INTERVAL, blob_threshold=SESSION_LOG_BLOB_THRESHOLD)
+
+
+def print_trace_summary(top: int = 10) -> None:
+    """
+    合計時間の長いspanから順に表にして表示する。トレースが無効なら何もしない
+    """
+    rows = tracing.tracer.summary(top)
+    if not rows:
+        return
+    from rich.table import Table
+    table = Table(title="Trace hotspots")
+    for column in ("Span", "Count", "Total (s)", "Mean (ms)", "Max (ms)"):
+        table.add_column(column, justify="left" if column == "Span" else "right")
+    for row in rows:
+        table.add_row(row["name"], str(row["count"]), f"{row['total']:.2f}", f"{row['mean'] * 1000:.1f}", f"{row['max'] * 1000:.1f}")
+    console.print(table)
+
+
+# Define available functions for the model
+
+def resume_session_log(session: str) -> Tuple[SessionLog, list, Optional[str]]:
+    """
+    セッションIDかログのパスからメッセージを読み直し、同じログに追記するSessionLogと一緒に返す
+    """
+    path = SessionLog.find(SESSION_LOG_DIR, session)
+    history, status = load_messages(path)
+    session_log = SessionLog(path, fsync=SESSION_LOG_FSYNC, fsync_interval=SESSION_LOG_FSYNC_INTERVAL, blob_threshold=SESSION_LOG_BLOB_THRESHOLD)
+    return session_log, history, status
+
+
+def report_pool_warmup(task: asyncio.Task) -> None:
+    """
+    起動時のワーカープールの準備に失敗したら知らせる。execute_codeは使うときにワーカーの起動をやり直す
+    """
+    if not task.cancelled() and task.exception() is not None:
+        console.print(f"[yellow]Could not warm up the interpreter pool: {task.exception()!r}[/yellow]")
+
+
+async def async_main(resume: Optional[str] = None):
+    print("Welcome to the SWE Agent")
+    print("You can ask to anything. Type 'quit' to exit.")
+
+    token_sum_state = {"input": 0, "output": 0}
+    tracing.configure(TRACE_PATH, TRACE_FORMAT)
+    # Import litellm and the rendering modules while the user is still typing
+    start_background_imports()
+    pool_warmup = None
+    if USE_INTERPRETER_POOL:
+        # Start the workers while the user is still typing
+        pool_warmup = asyncio.create_task(get_interpreter_pool())
+        pool_warmup.add_done_callback(report_pool_warmup)
+    # One supervisor for the whole interactive session, so background processes outlive a single request
+    supervisor = new_process_supervisor()
+
+    if resume is not None:
+        session_log, history, status = resume_session_log(resume)
+        if status == "complete":
+            session_log.close()
+            console.print(f"Session '{session_log.session_id}' already completed.")
+        else:
+            console.print(f"Resuming session '{session_log.session_id}' from {len(history)} messages (last status: {status or 'unfinished'}).")
+            _, token_sum_state = await run_agent_task(
+                history[0]["content"], token_sum_state, supervisor, session_log=session_log, history=history
+            )
+
+    while True:
+        # Read the prompt in a worker thread so the event loop stays alive for background processes
+        user_input = await asyncio.to_thread(console.input, "[bold cyan]You:[/bold cyan] ")
+        
+        if user_input.lower() == 'quit':
+            break
+
+        _, token_sum_state = await run_agent_task(user_input, token_sum_state, supervisor)
+
+    supervisor.close()
+    if pool_warmup is not None:
+        # Let a warm-up that is still spawning workers finish, so close() sees all of them
+        await asyncio.gather(pool_warmup, return_exceptions=True)
+    if _interpreter_pool is not None:
+        await _interpreter_pool.close()
+    print_trace_summary()
+    tracing.tracer.close()
+
+
+def profile_startup(top: int = 15) -> None:
+    """
+    -X importtimeを付けた別プロセスでこのモジュールとBACKGROUND_IMPORTSをimportし、
+    最初のプロンプトまでにかかる時間と裏で読み込む時間、それぞれで時間のかかったimportを表示する
+    """
+    code = "\n".join((
+        "import sys, time",
+        f"sys.path.insert(0, {os.path.dirname(os.path.abspath(__file__))!r})",
+        "started = time.perf_counter()",
+        "import main_gpt",
+        "ready = time.perf_counter()",
+        "sys.stderr.write('-- background --\\n')",
+        "main_gpt.import_background_modules()",
+        "print(ready - started, time.perf_counter() - ready)",
+    ))
+    child = subprocess.run([sys.executable, "-X", "importtime", "-c", code], capture_output=True, text=True)
+    if child.returncode != 0:
+        console.print(child.stderr[-2000:])
+        sys.exit(child.returncode)
+    startup_seconds, background_seconds = map(float, child.stdout.split()[-2:])
+
+    rows = []
+    phase = "startup"
+    for line in child.stderr.splitlines():
+        if line == "-- background --":
+            phase = "background"
+            continue
+        if not line.startswith("import time:") or "imported package" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|")
+        level = (len(name) - len(name.lstrip())) // 2
+        # Direct imports of main_gpt during startup; top-level imports in the background phase
+        if level == (1 if phase == "startup" else 0):
+            rows.append((phase, name.strip(), int(self_us) / 1000, int(cumulative_us) / 1000))
+
+    from rich.table import Table
+    table = Table(title="Startup imports")
+    for column in ("Phase", "Module", "Self (ms)", "Cumulative (ms)"):
+        table.add_column(column, justify="left" if column in ("Phase", "Module") else "right")
+    for phase, name, self_ms, cumulative_ms in sorted(rows, key=lambda row: -row[3])[:top]:
+        table.add_row(phase, name, f"{self_ms:.1f}", f"{cumulative_ms:.1f}")
+    console.print(table)
+    console.print(f"Time to first prompt (import main_gpt): {startup_seconds:.2f}s")
+    console.print(f"Deferred to the background while typing: {background_seconds:.2f}s ({', '.join(BACKGROUND_IMPORTS)})")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="SWE Agent")
+    parser.add_argument("--resume", metavar="SESSION", default=None, help=f"continue a session logged under {SESSION_LOG_DIR}/ (session id or log path)")
+    parser.add_argument("--profile-startup", action="store_true", help="report where startup import time goes and exit")
+    args = parser.parse_args()
+    if args.profile_startup:
+        profile_startup()
+        return
+    asyncio.run(async_main(args.resume))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,228 @@
+import asyncio
+import json
+from typing import Callable, Optional, Tuple, Union
+
+DEFAULT_BUFFER_BYTES = 256 * 1024
+READ_CHUNK_SIZE = 64 * 1024
+
+
+class OutputBuffer:
+    """
+    容量固定のリングバッファ。書き込んだ総バイト数を絶対位置(cursor)として扱い、
+    あふれて捨てた分のバイト数も記録する。
+    """
+
+    def __init__(self, capacity: int = DEFAULT_BUFFER_BYTES):
+        if capacity < 1:
+            raise ValueError("capacity must be at least 1")
+        self.capacity = capacity
+        self._ring = bytearray(capacity)
+        self.total_written = 0
+
+    @property
+    def dropped(self) -> int:
+        """
+        容量を超えて上書きされたバイト数
+        """
+        return max(0, self.total_written - self.capacity)
+
+    def _copy_in(self, offset: int, data: bytes) -> None:
+        position = offset % self.capacity
+        first = min(len(data), self.capacity - position)
+        self._ring[position:position + first] = data[:first]
+        self._ring[:len(data) - first] = data[first:]
+
+    def write(self, data: bytes) -> None:
+        size = len(data)
+        offset = self.total_written
+        if size > self.capacity:
+            # Only the tail can survive anyway
+            offset += size - self.capacity
+            data = data[size - self.capacity:]
+        self._copy_in(offset, data)
+        self.total_written += size
+
+    def read(self, cursor: int = 0, limit: Optional[int] = None) -> Tuple[bytes, int, int]:
+        """
+        cursor以降のデータを返す。戻り値は(データ, 次のcursor, 読めずに失われたバイト数)
+        """
+        skipped = 0
+        if cursor < self.dropped:
+            skipped = self.dropped - cursor
+            cursor = self.dropped
+        end = self.total_written if limit is None else min(self.total_written, cursor + limit)
+        if end <= cursor:
+            return b"", max(cursor, end), skipped
+        position = cursor % self.capacity
+        size = end - cursor
+        first = min(size, self.capacity - position)
+        data = bytes(self._ring[position:position + first]) + bytes(self._ring[:size - first])
+        return data, end, skipped
+
+
+async def drain(stream: asyncio.StreamReader, buffer: OutputBuffer, marker: Optional[bytes] = None) -> Optional[bytes]:
+    """
+    streamを読み続けてbufferに書き込む。
+    markerが指定されていればそこで読むのをやめてmarkerより後ろのバイト列を返し、EOFに達したらNoneを返す
+    """
+    pending = b""
+    while True:
+        chunk = await stream.read(READ_CHUNK_SIZE)
+        if not chunk:
+            if pending:
+                buffer.write(pending)
+            return None
+        if marker is None:
+            buffer.write(chunk)
+            continue
+
+        data = pending + chunk
+        index = data.find(marker)
+        if index != -1:
+            buffer.write(data[:index])
+            return data[index + len(marker):]
+        # Hold back a tail that could be the first half of a marker split across reads
+        hold = data.rfind(marker[:1], max(0, len(data) - len(marker) + 1))
+        if hold == -1:
+            buffer.write(data)
+            pending = b""
+        else:
+            buffer.write(data[:hold])
+            pending = data[hold:]
+
+
+def parse_job_marker(rest: bytes) -> Tuple[int, Optional[dict], bool]:
+    """
+    ワーカーの区切り(\\0{token}:の後ろ)から(終了コード, リソース使用量, ワーカーを作り直すべきか)を取り出す
+    """
+    return_code, _, rest = rest.strip(b"\0").partition(b":")
+    recycle, _, resources = rest.partition(b":")
+    return int(return_code or 0), json.loads(resources) if resources else None, recycle == b"1"
+
+
+class ManagedProcess:
+    """
+    バックグラウンドのプロセスと、その出力を絶えず吸い出しているリングバッファの組。
+    job_markerがTrueのときはInterpreterPoolのワーカーで、終了コードとリソース使用量は区切りの中から読む。
+    それ以外はprocess_runner.pyがusage_pathに書き出したリソース使用量を読む。
+    """
+
+    def __init__(self, process: asyncio.subprocess.Process, stdout: OutputBuffer, stderr: OutputBuffer,
+                 drains: Tuple[asyncio.Task, asyncio.Task], job_marker: bool = False, usage_path: Optional[str] = None):
+        self.process = process
+        self.stdout = stdout
+        self.stderr = stderr
+        self._drains = drains
+        self._job_marker = job_marker
+        self._usage_path = usage_path
+        self._finished = asyncio.gather(*drains, process.wait())
+        # Where the model last stopped reading
+        self.stdout_cursor = 0
+        self.stderr_cursor = 0
+
+    @classmethod
+    def start(cls, process: asyncio.subprocess.Process, capacity: int = DEFAULT_BUFFER_BYTES,
+              usage_path: Optional[str] = None) -> "ManagedProcess":
+        stdout, stderr = OutputBuffer(capacity), OutputBuffer(capacity)
+        drains = (
+            asyncio.create_task(drain(process.stdout, stdout)),
+            asyncio.create_task(drain(process.stderr, stderr))
+        )
+        return cls(process, stdout, stderr, drains, usage_path=usage_path)
+
+    @property
+    def finished(self) -> bool:
+        return self._finished.done()
+
+    @property
+    def return_code(self) -> Optional[int]:
+        if not self.finished:
+            return None
+        if self._job_marker:
+            rest = self._drains[0].result()
+            if rest is not None:
+                return parse_job_marker(rest)[0]
+        return self.process.returncode
+
+    @property
+    def resources(self) -> Optional[dict]:
+        """
+        終了したプロセスのCPU時間(user/system秒)とピークメモリ(max_rss, バイト)。分からなければNone
+        """
+        if not self.finished:
+            return None
+        if self._job_marker:
+            rest = self._drains[0].result()
+            return parse_job_marker(rest)[1] if rest is not None else None
+        if self._usage_path is None:
+            return None
+        try:
+            with open(self._usage_path, "r") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            # Killed before the runner could write it (signal, CPU limit, ...)
+            return None
+
+    def add_done_callback(self, callback: Callable[["ManagedProcess"], None]) -> None:
+        """
+        終了してすべての出力を吸い出したときにcallback(self)を呼ぶ。イベントループの終了で打ち切られたときは呼ばない
+        """
+        self._finished.add_done_callback(lambda future: None if future.cancelled() or future.exception() else callback(self))
+
+    async def wait(self, timeout: Optional[float]) -> bool:
+        """
+        終了してすべての出力を吸い出すまで最大timeout秒待ち、終了したかどうかを返す
+        """
+        done, _ = await asyncio.wait({self._finished}, timeout=timeout)
+        return bool(done)
+
+    def read(self, stdout_cursor: Optional[int] = None, stderr_cursor: Optional[int] = None) -> dict:
+        """
+        cursor以降の出力を返す。cursorを省略すると前回読んだところから続きを読む
+        """
+        output = read_buffers(
+            self.stdout, self.stderr,
+            self.stdout_cursor if stdout_cursor is None else stdout_cursor,
+            self.stderr_cursor if stderr_cursor is None else stderr_cursor
+        )
+        self.stdout_cursor, self.stderr_cursor = output["stdout_cursor"], output["stderr_cursor"]
+        return output
+
+
+def read_buffers(stdout: OutputBuffer, stderr: OutputBuffer, stdout_cursor: int = 0, stderr_cursor: int = 0) -> dict:
+    """
+    stdout/stderrのバッファをcursorから読み、format_outputに渡せるdictにする
+    """
+    output = {}
+    for name, buffer, cursor in (("stdout", stdout, stdout_cursor), ("stderr", stderr, stderr_cursor)):
+        data, output[f"{name}_cursor"], output[f"{name}_skipped"] = buffer.read(cursor)
+        output[name] = data.decode(errors="replace")
+    return output
+
+
+def format_resources(resources: dict) -> str:
+    parts = []
+    if "user" in resources:
+        parts.append(f"CPU {resources['user']:.2f}s user + {resources['system']:.2f}s system")
+    if resources.get("max_rss"):
+        parts.append(f"peak memory {resources['max_rss'] / (1024 * 1024):.1f} MB")
+    if "wall_time" in resources:
+        parts.append(f"wall time {resources['wall_time']:.2f}s")
+    return ", ".join(parts)
+
+
+def format_output(process_id: str, output: dict, status: Union[int, str, None], resources: Optional[dict] = None) -> str:
+    """
+    ManagedProcess.readの結果をツールの戻り値の文字列にする。resourcesがあれば使用量も添える
+    """
+    notes = []
+    for stream in ("stdout", "stderr"):
+        if output[f"{stream}_skipped"]:
+            notes.append(f"{output[stream + '_skipped']} bytes of {stream} were dropped because the output buffer is full.")
+    result = f"Process ID: {process_id}\n\nStdout:\n{output['stdout']}\n\nStderr:\n{output['stderr']}\n\nReturn Code: {status}"
+    result += f"\n\nCursor: stdout={output['stdout_cursor']}, stderr={output['stderr_cursor']}"
+    if resources:
+        result += f"\n\nResources: {format_resources(resources)}"
+    if notes:
+        result += "\n\n" + "\n".join(notes)
+    return result
@@ -0,0 +1,33 @@
+"""
+execute_codeをシェル経由で実行するときにcode_execution_envのpythonで起動されるスクリプト。
+起動直後にProcessLimitsの制限を自分に掛け、InterpreterPoolのワーカーと同じやり方でスクリプトを__main__として実行し、
+終わったらCPU時間とピークメモリをJSONでusage_pathに書き出す。
+
+    python process_runner.py script.py usage.json
+"""
+import json
+import os
+import sys
+
+from interpreter_worker import _cpu_times, _peak_rss, apply_limits, run_job
+
+
+def main() -> None:
+    apply_limits()
+    script, usage_path = sys.argv[1], sys.argv[2]
+    with open(script, "r") as f:
+        code = f.read()
+    return_code = 1
+    try:
+        return_code = run_job({"code": code, "filename": script, "cwd": os.getcwd()})
+    finally:
+        user, system = _cpu_times()
+        with open(usage_path, "w") as f:
+            json.dump({"user": user, "system": system, "max_rss": _peak_rss()}, f)
+    sys.stdout.flush()
+    sys.stderr.flush()
+    sys.exit(return_code)
+
+
+if __name__ == "__main__":
+    main()
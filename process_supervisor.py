@@ -0,0 +1,330 @@
+import asyncio
+import atexit
+import itertools
+import json
+import os
+import shutil
+import signal
+import sys
+import tempfile
+import time
+from dataclasses import dataclass
+from typing import Optional
+
+from interpreter_worker import LIMITS_ENV
+from process_output import ManagedProcess
+
+# Seconds between SIGTERM and SIGKILL when stopping a process
+STOP_GRACE_SECONDS = 2.0
+CGROUP_ROOT = "/sys/fs/cgroup"
+
+# Shared by every supervisor so IDs never repeat within the agent process
+_process_ids = itertools.count()
+# Strong references: a session dropped without close() must still be cleaned up at exit
+_supervisors: set["ProcessSupervisor"] = set()
+
+
+@dataclass(frozen=True)
+class ProcessLimits:
+    """
+    execute_codeの子プロセスに掛けるrlimit。Noneの項目は制限しない。
+    メモリはRLIMIT_ASではなくRLIMIT_DATAで制限する(nodeなどは使わないアドレス空間を大きく予約するため)
+    """
+    cpu_seconds: Optional[int] = None
+    memory_bytes: Optional[int] = None
+    open_files: Optional[int] = None
+
+    def environment(self, cpu: bool = True, cgroup_procs: Optional[str] = None) -> dict[str, str]:
+        """
+        子プロセスの環境変数に足すもの。制限はfork後exec前(preexec_fn)ではなく、
+        子(process_runner.py / interpreter_worker.py)が起動直後に自分に掛け、cgroup_procsがあればそこへ移る。
+        エージェント側ではスレッドが動いているので、fork直後にPythonのコードを動かすとデッドロックしうるため
+        """
+        limits = {
+            "cpu_seconds": self.cpu_seconds if cpu else None,
+            "memory_bytes": self.memory_bytes,
+            "open_files": self.open_files,
+            "cgroup_procs": cgroup_procs
+        }
+        return {LIMITS_ENV: json.dumps(limits)}
+
+
+class CgroupV2:
+    """
+    自分のいるcgroup v2の下に作る子cgroup。memoryコントローラが委譲されていなければ作らない(Noneを返す)
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+
+    @classmethod
+    def create(cls, name: str, memory_bytes: Optional[int]) -> Optional["CgroupV2"]:
+        try:
+            with open("/proc/self/cgroup", "r") as f:
+                lines = [line.strip() for line in f]
+            # Only the unified hierarchy ("0::/path") is supported
+            relative = next((line[3:] for line in lines if line.startswith("0::")), None)
+            if relative is None or len(lines) != 1:
+                return None
+            path = os.path.join(CGROUP_ROOT, relative.lstrip("/"), name)
+            os.mkdir(path)
+        except OSError:
+            return None
+        cgroup = cls(path)
+        try:
+            if memory_bytes is not None:
+                cgroup._write("memory.max", str(memory_bytes))
+        except OSError:
+            # Controllers not delegated to us: rlimits are all we get
+            cgroup.remove()
+            return None
+        return cgroup
+
+    def _write(self, name: str, value: str) -> None:
+        with open(os.path.join(self.path, name), "w") as f:
+            f.write(value)
+
+    @property
+    def procs_path(self) -> str:
+        return os.path.join(self.path, "cgroup.procs")
+
+    def kill(self) -> None:
+        try:
+            self._write("cgroup.kill", "1")
+        except OSError:
+            pass
+
+    def remove(self) -> None:
+        try:
+            os.rmdir(self.path)
+        except OSError:
+            pass
+
+
+def _kill_group(pgid: int, sig: int) -> bool:
+    try:
+        os.killpg(pgid, sig)
+        return True
+    except (ProcessLookupError, PermissionError):
+        return False
+
+
+class ProcessSupervisor:
+    """
+    1つのセッションのexecute_codeのプロセスを管理する。
+    スクリプトはセッション専用のスクラッチディレクトリに書き、同時に動くプロセスはmax_concurrent個までで、
+    それを超えた分は空きが出るまで待たせる。プロセスはそれぞれ新しいプロセスグループで動かしてlimitsの制限を掛け、
+    cgroup v2が使えればセッションの子cgroupにも入れる。終わったプロセスは終了状態とリソース使用量をexitsに記録し、
+    close(かエージェントの終了)でまだ残っているプロセスグループをすべてkillする。
+    processesに残したバックグラウンドプロセスは、終了を報告して出力も読み切ったらforget_if_drainedで外す。
+    読まれないまま終わったものもmax_finished個を超えたら古い順に外し、以後はexitsの記録だけが残る。
+    """
+
+    def __init__(self, scratch_root: Optional[str] = None, max_concurrent: int = 4, limits: Optional[ProcessLimits] = None,
+                 use_cgroup: bool = True, max_finished: int = 16):
+        if max_concurrent < 1:
+            raise ValueError("max_concurrent must be at least 1")
+        if scratch_root is not None:
+            os.makedirs(scratch_root, exist_ok=True)
+        self.scratch_dir = tempfile.mkdtemp(prefix="session_", dir=scratch_root)
+        self.max_concurrent = max_concurrent
+        self.max_finished = max_finished
+        self.limits = limits or ProcessLimits()
+        self.cgroup = None
+        if use_cgroup and sys.platform == "linux":
+            self.cgroup = CgroupV2.create(os.path.basename(self.scratch_dir), self.limits.memory_bytes)
+        # Background processes the model can still read, keyed by process ID
+        self.processes: dict[str, ManagedProcess] = {}
+        self.exits: dict[str, dict] = {}
+        self._live: dict[str, ManagedProcess] = {}
+        self._started: dict[str, float] = {}
+        self._stopped: set[str] = set()
+        # Process groups we created; killed on close in case the leader left children behind
+        self._groups: set[int] = set()
+        self._slots: Optional[asyncio.Semaphore] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._closed = False
+        _supervisors.add(self)
+
+    def new_process_id(self) -> str:
+        return f"process_{next(_process_ids)}"
+
+    def script_path(self, process_id: str) -> str:
+        return os.path.join(self.scratch_dir, f"{process_id}.py")
+
+    def usage_path(self, process_id: str) -> str:
+        return os.path.join(self.scratch_dir, f"{process_id}.usage.json")
+
+    def environment(self, cpu: bool = True) -> dict[str, str]:
+        return self.limits.environment(cpu, self.cgroup.procs_path if self.cgroup is not None else None)
+
+    @property
+    def running(self) -> list[str]:
+        return sorted(self._live, key=lambda process_id: self._started[process_id])
+
+    async def acquire(self, timeout: Optional[float]) -> Optional[float]:
+        """
+        実行枠が空くまで最大timeout秒待ち、待った秒数を返す。空かなければNone
+        """
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop:
+            # A semaphore is bound to the loop that first waits on it
+            self._loop = loop
+            self._slots = asyncio.Semaphore(max(0, self.max_concurrent - len(self._live)))
+        started = time.perf_counter()
+        try:
+            await asyncio.wait_for(self._slots.acquire(), timeout)
+        except asyncio.TimeoutError:
+            return None
+        return time.perf_counter() - started
+
+    def release(self) -> None:
+        if self._slots is not None:
+            self._slots.release()
+
+    def track(self, process_id: str, managed: ManagedProcess, started: float, owns_group: bool = True) -> None:
+        """
+        acquireで枠を取ったプロセスを登録する。終了したら自動でreapされ、枠が空く
+        """
+        self._live[process_id] = managed
+        self._started[process_id] = started
+        if owns_group and sys.platform != "win32":
+            self._groups.add(managed.process.pid)
+        managed.add_done_callback(lambda _: self.reap(process_id))
+
+    def keep(self, process_id: str, managed: ManagedProcess) -> None:
+        """
+        まだ動いているプロセスを、後から出力を読めるように残しておく
+        """
+        self.processes[process_id] = managed
+        # Each entry holds two output buffers; don't let finished ones nobody reads pile up over a long session
+        finished = [kept_id for kept_id, kept in self.processes.items() if kept.finished]
+        for kept_id in finished[:max(0, len(finished) - self.max_finished)]:
+            self.reap(kept_id)
+            del self.processes[kept_id]
+
+    def forget_if_drained(self, process_id: str) -> bool:
+        """
+        終了を記録済みで出力も最後まで読まれたプロセスを一覧から外し、出力バッファを手放す。外したらTrue
+        """
+        managed = self.processes.get(process_id)
+        if managed is None or process_id not in self.exits:
+            return False
+        if managed.stdout_cursor < managed.stdout.total_written or managed.stderr_cursor < managed.stderr.total_written:
+            return False
+        del self.processes[process_id]
+        return True
+
+    def record_exit(self, process_id: str, return_code: Optional[int], started: float, resources: Optional[dict],
+                    status: Optional[str] = None) -> dict:
+        """
+        終了状態を記録して返す。trackしていないプロセス(プールで時間内に終わったもの)はここで枠を返す
+        """
+        record = {
+            "status": status or ("exited" if return_code is None or return_code >= 0 else "killed"),
+            "return_code": return_code,
+            "resources": dict(resources or {}, wall_time=time.perf_counter() - started)
+        }
+        if return_code is not None and return_code < 0:
+            record["signal"] = signal.Signals(-return_code).name if -return_code in signal.valid_signals() else str(-return_code)
+        self.exits[process_id] = record
+        if process_id not in self._live:
+            self.release()
+        return record
+
+    def reap(self, process_id: str) -> Optional[dict]:
+        """
+        終わったプロセスの終了状態を記録して枠を返す。何度呼んでもよく、記録済みならそれを返す
+        """
+        managed = self._live.get(process_id)
+        if managed is None or not managed.finished:
+            return self.exits.get(process_id)
+        status = "stopped" if process_id in self._stopped else None
+        record = self.record_exit(process_id, managed.return_code, self._started.pop(process_id), managed.resources, status)
+        del self._live[process_id]
+        self.release()
+        pgid = managed.process.pid
+        if pgid in self._groups and not _kill_group(pgid, 0):
+            # Nothing left in the group: forget it before its number can be reused
+            self._groups.discard(pgid)
+        return record
+
+    def exit_note(self, process_id: str) -> Optional[str]:
+        """
+        シグナルで終わったプロセスについて、制限に引っかかった可能性をモデル向けに説明する
+        """
+        record = self.exits.get(process_id)
+        if record is None or record["status"] != "killed":
+            return None
+        if record["signal"] == "SIGXCPU":
+            return f"The process was killed because it used up its CPU time limit of {self.limits.cpu_seconds}s."
+        return (f"The process was killed by {record['signal']}. It may have hit a resource limit "
+                f"(CPU {self.limits.cpu_seconds}s, memory {self.limits.memory_bytes} bytes, {self.limits.open_files} open files).")
+
+    def stop(self, process_id: str) -> bool:
+        """
+        プロセスグループごと止めて一覧から外す。まだ動いていたらTrue。
+        SIGTERMで終わらなければSTOP_GRACE_SECONDS秒後にSIGKILLする
+        """
+        managed = self.processes.pop(process_id, None)
+        if managed is None or managed.process.returncode is not None:
+            if managed is not None and managed.process.pid in self._groups:
+                # The leader is gone; take whatever it left behind with it
+                _kill_group(managed.process.pid, signal.SIGKILL)
+            return False
+        self._stopped.add(process_id)
+        if sys.platform == "win32":
+            managed.process.terminate()
+            return True
+        _kill_group(managed.process.pid, signal.SIGTERM)
+        asyncio.get_running_loop().call_later(STOP_GRACE_SECONDS, self._force_kill, managed)
+        return True
+
+    def _force_kill(self, managed: ManagedProcess) -> None:
+        if managed.process.returncode is None:
+            _kill_group(managed.process.pid, signal.SIGKILL)
+
+    def stop_all(self) -> None:
+        for process_id in list(self.processes):
+            self.stop(process_id)
+
+    def kill_all(self) -> None:
+        """
+        残っているプロセスグループをすべてSIGKILLする。イベントループがなくても呼べる
+        """
+        for managed in self._live.values():
+            if sys.platform == "win32" and managed.process.returncode is None:
+                managed.process.kill()
+        for pgid in list(self._groups):
+            _kill_group(pgid, signal.SIGKILL)
+        self._groups.clear()
+        if self.cgroup is not None:
+            self.cgroup.kill()
+
+    def close(self) -> None:
+        """
+        セッションの終わりに、プロセスをすべて止めてスクラッチディレクトリとcgroupを消す
+        """
+        if self._closed:
+            return
+        self._closed = True
+        self.kill_all()
+        self.processes.clear()
+        shutil.rmtree(self.scratch_dir, ignore_errors=True)
+        if self.cgroup is not None:
+            # Fails while killed processes are still exiting; an empty leftover cgroup holds no resources
+            self.cgroup.remove()
+        _supervisors.discard(self)
+
+    def stats(self) -> dict:
+        statuses: dict[str, int] = {}
+        for record in self.exits.values():
+            statuses[record["status"]] = statuses.get(record["status"], 0) + 1
+        return {"processes": len(self.exits) + len(self._live), "running": len(self._live), "exits": statuses}
+
+
+@atexit.register
+def _close_all() -> None:
+    # Don't leave children running (or scratch files behind) when the agent exits without closing its sessions
+    for supervisor in list(_supervisors):
+        supervisor.close()
@@ -0,0 +1,243 @@
+import asyncio
+import heapq
+import itertools
+import random
+import time
+from typing import Any, Awaitable, Callable, Optional, Tuple
+
+# Status codes worth retrying: timeouts, conflicts, rate limits and server-side failures
+RETRYABLE_STATUS_CODES = frozenset({408, 409, 429, 500, 502, 503, 504})
+
+
+class TokenBucket:
+    """
+    1分あたりrate_per_minuteずつ補充されるトークンバケツ。容量は1分ぶん。
+    実際の使用量が見積もりより多かった場合はadjustで残量がマイナスになり、その分だけ後の要求が待たされる
+    """
+
+    def __init__(self, rate_per_minute: float):
+        self.rate = rate_per_minute / 60.0
+        self.capacity = float(rate_per_minute)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+
+    def _refill(self, now: float) -> None:
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, amount: float, now: float) -> float:
+        self._refill(now)
+        # A request larger than the whole bucket only has to wait for a full bucket
+        needed = min(amount, self.capacity) - self.tokens
+        return max(0.0, needed / self.rate)
+
+    def consume(self, amount: float, now: float) -> None:
+        self._refill(now)
+        self.tokens -= amount
+
+    def adjust(self, amount: float) -> None:
+        self.tokens = min(self.capacity, self.tokens - amount)
+
+
+class ModelLimiter:
+    """
+    1つのモデルのrequests/minとtokens/minの制限。Retry-Afterを受けたらblocked_untilまで誰にも許可しない
+    """
+
+    def __init__(self, requests_per_minute: Optional[float], tokens_per_minute: Optional[float]):
+        self.requests = TokenBucket(requests_per_minute) if requests_per_minute else None
+        self.tokens = TokenBucket(tokens_per_minute) if tokens_per_minute else None
+        self.blocked_until = 0.0
+
+    def wait_time(self, tokens: int, now: float) -> float:
+        wait = max(0.0, self.blocked_until - now)
+        if self.requests is not None:
+            wait = max(wait, self.requests.wait_time(1, now))
+        if self.tokens is not None:
+            wait = max(wait, self.tokens.wait_time(tokens, now))
+        return wait
+
+    def consume(self, tokens: int, now: float) -> None:
+        if self.requests is not None:
+            self.requests.consume(1, now)
+        if self.tokens is not None:
+            self.tokens.consume(tokens, now)
+
+
+def retry_after_seconds(error: BaseException) -> Optional[float]:
+    """
+    例外に付いているHTTPレスポンスのRetry-After(秒数かHTTP日付)を秒数にして返す
+    """
+    response = getattr(error, "response", None)
+    headers = getattr(response, "headers", None) or getattr(error, "headers", None) or {}
+    try:
+        value = headers.get("retry-after") or headers.get("Retry-After")
+    except AttributeError:
+        return None
+    if value is None:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    # HTTP dates are rare, so the email package is only imported when one shows up
+    import email.utils
+    try:
+        return max(0.0, email.utils.parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+def is_retryable(error: BaseException) -> bool:
+    status = getattr(error, "status_code", None)
+    if status is not None:
+        return status in RETRYABLE_STATUS_CODES
+    # litellm's Timeout / APIConnectionError and plain network errors carry no status code
+    return isinstance(error, (asyncio.TimeoutError, ConnectionError)) or \
+        type(error).__name__ in ("Timeout", "APIConnectionError", "APITimeoutError", "ServiceUnavailableError")
+
+
+class RequestScheduler:
+    """
+    プロセス内の全セッションで共有するLLMリクエストのスケジューラ。
+    リクエストは優先度(小さいほど先)の順に並び、モデルごとのrequests/min・tokens/minのバケツに空きができたものから送られる。
+    失敗したら(再試行できるものなら)Retry-Afterかジッター付き指数バックオフで待って再送し、
+    fallback_after回失敗したモデルはfallback_modelsで指定したモデルに切り替える。
+    """
+
+    def __init__(self, limits: dict[str, Tuple[Optional[float], Optional[float]]], fallback_models: Optional[dict[str, str]] = None,
+                 max_retries: int = 5, base_delay: float = 1.0, max_delay: float = 60.0, fallback_after: int = 2):
+        self.limits = limits
+        self.fallback_models = fallback_models or {}
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.fallback_after = fallback_after
+        self._limiters: dict[str, ModelLimiter] = {}
+        self._queue: list = []
+        self._sequence = itertools.count()
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._wakeup: Optional[asyncio.Event] = None
+        self._pump_task: Optional[asyncio.Task] = None
+        self.queue_waits: list[float] = []
+        self.retries = 0
+        self.fallbacks = 0
+        self.backoff_time = 0.0
+
+    def _limiter(self, model: str) -> ModelLimiter:
+        limiter = self._limiters.get(model)
+        if limiter is None:
+            limiter = self._limiters[model] = ModelLimiter(*self.limits.get(model, (None, None)))
+        return limiter
+
+    async def _pump(self) -> None:
+        """
+        待ち行列を優先度順に見て、制限に空きのあるリクエストを通す。
+        あるモデルの先頭が待たされている間は同じモデルの後続も待たせ、優先度の順番を守る
+        """
+        while self._queue:
+            now = time.monotonic()
+            next_wait = None
+            blocked_models = set()
+            for entry in sorted(self._queue):
+                _, _, model, tokens, future = entry
+                if future.done() or model in blocked_models:
+                    continue
+                wait = self._limiter(model).wait_time(tokens, now)
+                if wait > 0:
+                    blocked_models.add(model)
+                    next_wait = wait if next_wait is None else min(next_wait, wait)
+                    continue
+                self._limiter(model).consume(tokens, now)
+                future.set_result(None)
+            self._queue = [entry for entry in self._queue if not entry[4].done()]
+            heapq.heapify(self._queue)
+            if not self._queue:
+                break
+            self._wakeup.clear()
+            try:
+                # Wake up when a bucket refills or a new request arrives
+                await asyncio.wait_for(self._wakeup.wait(), next_wait)
+            except asyncio.TimeoutError:
+                pass
+
+    async def _acquire(self, model: str, tokens: int, priority: int) -> float:
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop:
+            # A new event loop (e.g. a later asyncio.run) can't reuse the old loop's event and task
+            self._loop = loop
+            self._wakeup = asyncio.Event()
+            self._queue = []
+            self._pump_task = None
+        future = loop.create_future()
+        heapq.heappush(self._queue, (priority, next(self._sequence), model, tokens, future))
+        self._wakeup.set()
+        if self._pump_task is None or self._pump_task.done():
+            self._pump_task = asyncio.create_task(self._pump())
+        started = time.perf_counter()
+        try:
+            await future
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        waited = time.perf_counter() - started
+        self.queue_waits.append(waited)
+        return waited
+
+    def _backoff(self, attempt: int, error: BaseException, model: str) -> float:
+        retry_after = retry_after_seconds(error)
+        if retry_after is not None:
+            # The provider's quota is shared, so hold back every session using this model
+            self._limiter(model).blocked_until = max(self._limiter(model).blocked_until, time.monotonic() + retry_after)
+            return retry_after
+        # Full jitter keeps sessions that failed together from retrying together
+        return random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+
+    async def submit(self, call: Callable[[str], Awaitable[Any]], model: str, estimated_tokens: int,
+                     priority: int = 0) -> Tuple[Any, str, dict]:
+        """
+        call(model)を制限の範囲内で実行し、(結果, 実際に使ったモデル, このリクエストの統計)を返す
+        """
+        stats = {"queue_wait": 0.0, "retries": 0, "fallback": False}
+        failures = 0
+        for attempt in range(self.max_retries + 1):
+            stats["queue_wait"] += await self._acquire(model, estimated_tokens, priority)
+            try:
+                return await call(model), model, stats
+            except Exception as e:
+                if not is_retryable(e) or attempt == self.max_retries:
+                    raise
+                delay = self._backoff(attempt, e, model)
+            failures += 1
+            self.retries += 1
+            stats["retries"] += 1
+            fallback = self.fallback_models.get(model)
+            if fallback is not None and failures >= self.fallback_after:
+                model = fallback
+                failures = 0
+                self.fallbacks += 1
+                stats["fallback"] = True
+                # The fallback has its own quota, so there's no need to wait out the old model's backoff
+                delay = 0.0
+            self.backoff_time += delay
+            await asyncio.sleep(delay)
+
+    def record_usage(self, model: str, estimated_tokens: int, actual_tokens: int) -> None:
+        """
+        実際に使ったトークン数で、見積もりとの差をtokens/minのバケツに反映する
+        """
+        limiter = self._limiter(model)
+        if limiter.tokens is not None:
+            limiter.tokens.adjust(actual_tokens - estimated_tokens)
+
+    def stats(self) -> dict:
+        waits = sorted(self.queue_waits)
+        return {
+            "requests": len(waits),
+            "retries": self.retries,
+            "fallbacks": self.fallbacks,
+            "backoff_time": self.backoff_time,
+            "queue_wait_p50": waits[len(waits) // 2] if waits else 0.0,
+            "queue_wait_p95": waits[max(0, -(-len(waits) * 95 // 100) - 1)] if waits else 0.0,
+            "queue_wait_max": waits[-1] if waits else 0.0
+        }
@@ -0,0 +1,200 @@
+import fnmatch
+import os
+import re
+import threading
+from typing import Optional, Tuple
+
+try:
+    from re import _parser as sre_parse
+except ImportError:  # Python < 3.11
+    import sre_parse
+
+from workspace_index import WorkspaceIndex
+
+MAX_INDEXED_FILE_BYTES = 1024 * 1024
+BINARY_SNIFF_BYTES = 8192
+
+
+def _trigrams(text: str) -> set[str]:
+    return {text[i:i + 3] for i in range(len(text) - 2)}
+
+
+def required_literals(pattern: str, flags: int = 0) -> list[str]:
+    """
+    正規表現にマッチする文字列が必ず含む文字列(トップレベルで連続するリテラル)を返す。
+    分岐や繰り返しの中身は見ないので取りこぼしはあるが、返したものは必ず含まれる
+    """
+    literals = []
+    current = []
+    for op, argument in sre_parse.parse(pattern, flags):
+        if str(op) == "LITERAL":
+            current.append(chr(argument))
+        else:
+            literals.append("".join(current))
+            current = []
+    literals.append("".join(current))
+    return [literal for literal in literals if len(literal) >= 3]
+
+
+class SearchIndex:
+    """
+    search_code用のトライグラム索引。ファイルごとに小文字にした本文のトライグラムを持ち、
+    正規表現が必ず含むリテラルのトライグラムを全部含むファイルだけを実際に検索する。
+    ファイル一覧はWorkspaceIndexから取るので.gitignoreなどで無視されたものは対象外。
+    エージェント自身の書き込みはnotify_updatedで即座に反映し、execute_codeなど外からの変更に備えて
+    mark_dirtyされたら次の検索の前にstatを取り直して変わったファイルだけ索引し直す。
+    """
+
+    def __init__(self, workspace: WorkspaceIndex):
+        self.workspace = workspace
+        self.root = workspace.root
+        self._files: dict[str, Tuple[int, int, frozenset]] = {}
+        self._postings: dict[str, set[str]] = {}
+        self._lock = threading.Lock()
+        self._refresh_lock = threading.Lock()
+        self._dirty = True
+        self.files_indexed = 0
+
+    def mark_dirty(self) -> None:
+        self._dirty = True
+
+    def _read_text(self, path: str) -> Optional[str]:
+        try:
+            with open(path, "rb") as f:
+                data = f.read(MAX_INDEXED_FILE_BYTES + 1)
+        except OSError:
+            return None
+        if len(data) > MAX_INDEXED_FILE_BYTES or b"\0" in data[:BINARY_SNIFF_BYTES]:
+            return None
+        return data.decode("utf-8", errors="replace")
+
+    def _remove(self, relative: str) -> None:
+        entry = self._files.pop(relative, None)
+        if entry is None:
+            return
+        for trigram in entry[2]:
+            paths = self._postings.get(trigram)
+            if paths is not None:
+                paths.discard(relative)
+                if not paths:
+                    del self._postings[trigram]
+
+    def _index_file(self, relative: str, st: os.stat_result) -> None:
+        text = self._read_text(os.path.join(self.root, relative))
+        trigrams = frozenset(_trigrams(text.lower())) if text is not None else frozenset()
+        with self._lock:
+            self._remove(relative)
+            self._files[relative] = (st.st_mtime_ns, st.st_size, trigrams)
+            for trigram in trigrams:
+                self._postings.setdefault(trigram, set()).add(relative)
+            self.files_indexed += 1
+
+    def notify_updated(self, path: str) -> None:
+        """
+        エージェントが作成・更新したファイルを索引し直す。作業ディレクトリの外や無視されたファイルはそのまま
+        """
+        path = os.path.abspath(path)
+        if os.path.commonpath([self.root, path]) != self.root or self._dirty:
+            return
+        relative = os.path.relpath(path, self.root).replace(os.sep, "/")
+        try:
+            st = os.stat(path)
+        except OSError:
+            with self._lock:
+                self._remove(relative)
+            return
+        if os.path.isfile(path) and not self.workspace.is_ignored(path):
+            self._index_file(relative, st)
+
+    def refresh(self) -> None:
+        """
+        ファイル一覧を取り直し、mtimeかサイズが変わったファイルだけを索引し直す
+        """
+        with self._refresh_lock:
+            self._refresh()
+
+    def _refresh(self) -> None:
+        """
+        _refresh_lockを持って呼ぶ。_dirtyは走査の前に下ろすので、走査中のmark_dirtyは消えずに次の検索で拾われる。
+        走査中の索引は途中までしかできていないが、読む側はcandidatesで_refresh_lockを待つので見えない
+        """
+        self._dirty = False
+        try:
+            self._rescan()
+        except BaseException:
+            self._dirty = True
+            raise
+
+    def _rescan(self) -> None:
+        entries, _ = self.workspace.walk(self.root)
+        current = {entry for entry in entries if not entry.endswith("/") and not entry.endswith(" (ignored)")}
+        with self._lock:
+            removed = [relative for relative in self._files if relative not in current]
+            for relative in removed:
+                self._remove(relative)
+        for relative in current:
+            try:
+                st = os.stat(os.path.join(self.root, relative))
+            except OSError:
+                continue
+            known = self._files.get(relative)
+            if known is None or known[0] != st.st_mtime_ns or known[1] != st.st_size:
+                self._index_file(relative, st)
+
+    def candidates(self, regex: re.Pattern) -> list[str]:
+        with self._refresh_lock:
+            if self._dirty:
+                self._refresh()
+        trigrams = set()
+        for literal in required_literals(regex.pattern, regex.flags):
+            trigrams |= _trigrams(literal.lower())
+        with self._lock:
+            if not trigrams:
+                return sorted(self._files)
+            # Start from the rarest trigram so the intersection stays small
+            postings = sorted((self._postings.get(trigram, set()) for trigram in trigrams), key=len)
+            result = set(postings[0])
+            for paths in postings[1:]:
+                result &= paths
+                if not result:
+                    break
+            return sorted(result)
+
+    def search(self, query: str, path: Optional[str] = None, path_pattern: Optional[str] = None,
+               ignore_case: bool = False, context_lines: int = 2, max_results: int = 50) -> Tuple[list[str], int, int]:
+        """
+        queryの正規表現に一致する行を探し、(grep風の出力行, 一致した行数, 実際に開いたファイル数)を返す。
+        pathは検索するディレクトリ(rootからの相対)、path_patternはrootからの相対パスに対するglob
+        """
+        regex = re.compile(query, re.IGNORECASE if ignore_case else 0)
+        prefix = path.strip("/").replace(os.sep, "/") + "/" if path and path.strip("/.") else ""
+        output: list[str] = []
+        matches = 0
+        opened = 0
+        for relative in self.candidates(regex):
+            if prefix and not relative.startswith(prefix):
+                continue
+            if path_pattern and not (fnmatch.fnmatch(relative, path_pattern) or fnmatch.fnmatch(os.path.basename(relative), path_pattern)):
+                continue
+            text = self._read_text(os.path.join(self.root, relative))
+            opened += 1
+            if text is None:
+                continue
+            lines = text.splitlines()
+            hits = [number for number, line in enumerate(lines) if regex.search(line)]
+            if not hits:
+                continue
+            hit_set = set(hits)
+            shown_until = -1
+            for number in hits:
+                if matches >= max_results:
+                    return output, matches, opened
+                matches += 1
+                start = max(number - context_lines, shown_until + 1)
+                if output and (shown_until == -1 or start > shown_until + 1):
+                    output.append("--")
+                for context in range(start, min(number + context_lines, len(lines) - 1) + 1):
+                    separator = ":" if context in hit_set else "-"
+                    output.append(f"{relative}{separator}{context + 1}{separator} {lines[context]}")
+                shown_until = max(shown_until, min(number + context_lines, len(lines) - 1))
+        return output, matches, opened
@@ -0,0 +1,169 @@
+import datetime
+import hashlib
+import json
+import os
+import secrets
+import time
+from typing import Any, Optional, Tuple
+
+from file_ops import atomic_write
+
+FSYNC_POLICIES = ("always", "interval", "never")
+BLOB_REF_KEY = "$blob"
+
+
+class SessionLog:
+    """
+    セッションのメッセージを発生した順に1行ずつ追記するJSONLログ。
+    大きな本文やツール引数はblobsディレクトリにsha256の名前で1回だけ保存し、ログには参照だけを書く。
+    fsync: always ... 1行ごと / interval ... 前回からfsync_interval秒以上たったとき / never ... OS任せ
+    クラッシュで最後の行が書きかけになっても、load_messagesはそれを読み飛ばす。
+    """
+
+    def __init__(self, path: str, fsync: str = "interval", fsync_interval: float = 1.0, blob_threshold: int = 4096):
+        if fsync not in FSYNC_POLICIES:
+            raise ValueError(f"unknown fsync policy {fsync!r}, expected one of {', '.join(FSYNC_POLICIES)}")
+        self.path = path
+        self.session_id = os.path.splitext(os.path.basename(path))[0]
+        self.blob_dir = os.path.join(os.path.dirname(os.path.abspath(path)), "blobs")
+        self.fsync = fsync
+        self.fsync_interval = fsync_interval
+        self.blob_threshold = blob_threshold
+        os.makedirs(self.blob_dir, exist_ok=True)
+        self._file = open(path, "a", encoding="utf-8")
+        # When resuming after a crash, terminate a half-written last line so it doesn't swallow the next record
+        if self._file.tell() > 0:
+            with open(path, "rb") as f:
+                f.seek(-1, os.SEEK_END)
+                if f.read(1) != b"\n":
+                    self._file.write("\n")
+        self._last_fsync = time.monotonic()
+        self.blobs_written = 0
+
+    @classmethod
+    def create(cls, directory: str, **kwargs) -> "SessionLog":
+        session_id = datetime.datetime.now().strftime("%Y%m%d-%H%M%S") + "-" + secrets.token_hex(3)
+        os.makedirs(directory, exist_ok=True)
+        return cls(os.path.join(directory, f"{session_id}.jsonl"), **kwargs)
+
+    @staticmethod
+    def find(directory: str, session: str) -> str:
+        """
+        セッションIDかログファイルのパスからログファイルのパスを返す
+        """
+        for candidate in (session, os.path.join(directory, session), os.path.join(directory, f"{session}.jsonl")):
+            if os.path.isfile(candidate):
+                return candidate
+        raise FileNotFoundError(f"session '{session}' not found in '{directory}'")
+
+    def _store_blob(self, text: str) -> dict:
+        data = text.encode("utf-8")
+        digest = hashlib.sha256(data).hexdigest()
+        path = os.path.join(self.blob_dir, digest)
+        # Content-addressed, so a blob that is already there is the same one
+        if not os.path.exists(path):
+            # atomic_write fsyncs, so the blob is durable before the line that refers to it
+            atomic_write(path, text)
+            self.blobs_written += 1
+        return {BLOB_REF_KEY: digest, "size": len(data)}
+
+    def _outline(self, message: dict) -> dict:
+        message = dict(message)
+        content = message.get("content")
+        if isinstance(content, str) and len(content) > self.blob_threshold:
+            message["content"] = self._store_blob(content)
+        if message.get("tool_calls"):
+            tool_calls = []
+            for tool_call in message["tool_calls"]:
+                arguments = tool_call["function"]["arguments"]
+                if isinstance(arguments, str) and len(arguments) > self.blob_threshold:
+                    tool_call = {**tool_call, "function": {**tool_call["function"], "arguments": self._store_blob(arguments)}}
+                tool_calls.append(tool_call)
+            message["tool_calls"] = tool_calls
+        return message
+
+    def _write(self, record: dict) -> None:
+        self._file.write(json.dumps(record, ensure_ascii=False, default=lambda x: x.__dict__) + "\n")
+        self._file.flush()
+        now = time.monotonic()
+        if self.fsync == "always" or (self.fsync == "interval" and now - self._last_fsync >= self.fsync_interval):
+            os.fsync(self._file.fileno())
+            self._last_fsync = now
+
+    def append(self, message: dict) -> None:
+        self._write({"type": "message", "time": time.time(), "message": self._outline(message)})
+
+    def end(self, status: str, final_message: Any = None) -> None:
+        """
+        タスクの終了を記録する。最後のassistantメッセージは履歴に入らないのでここに残す
+        """
+        if isinstance(final_message, str) and len(final_message) > self.blob_threshold:
+            final_message = self._store_blob(final_message)
+        self._write({"type": "end", "time": time.time(), "status": status, "final_message": final_message})
+
+    def close(self) -> None:
+        if self._file is None:
+            return
+        if self.fsync != "never":
+            os.fsync(self._file.fileno())
+        self._file.close()
+        self._file = None
+
+
+def _inline(value: Any, blob_dir: str) -> Any:
+    if isinstance(value, dict) and BLOB_REF_KEY in value:
+        with open(os.path.join(blob_dir, value[BLOB_REF_KEY]), "r", encoding="utf-8", newline="") as f:
+            return f.read()
+    return value
+
+
+def load_messages(path: str) -> Tuple[list[dict], Optional[str]]:
+    """
+    ログからmessage_history_stateを組み立て直し、(メッセージ, 最後に記録された終了状態)を返す。
+    ツールの結果は終わった順に記録されているので、呼び出したassistantメッセージのtool_callsの順に並べ直す
+    """
+    blob_dir = os.path.join(os.path.dirname(os.path.abspath(path)), "blobs")
+    messages: list[dict] = []
+    status = None
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                # A line cut short by a crash; everything before it is intact
+                continue
+            if record["type"] == "end":
+                status = record["status"]
+                continue
+            message = record["message"]
+            message["content"] = _inline(message.get("content"), blob_dir)
+            for tool_call in message.get("tool_calls") or []:
+                tool_call["function"]["arguments"] = _inline(tool_call["function"]["arguments"], blob_dir)
+            messages.append(message)
+            status = None
+
+    ordered: list[dict] = []
+    call_order: dict[str, int] = {}
+    pending: list[dict] = []
+    for message in messages:
+        if message["role"] == "tool":
+            pending.append(message)
+            continue
+        ordered.extend(sorted(pending, key=lambda m: call_order.get(m["tool_call_id"], len(call_order))))
+        pending = []
+        ordered.append(message)
+        call_order = {tool_call["id"]: index for index, tool_call in enumerate(message.get("tool_calls") or [])}
+    ordered.extend(sorted(pending, key=lambda m: call_order.get(m["tool_call_id"], len(call_order))))
+    return ordered, status
+
+
+def pending_tool_calls(messages: list[dict]) -> list[dict]:
+    """
+    最後のassistantメッセージのtool_callsのうち、結果がまだ記録されていないものを返す
+    """
+    for index in range(len(messages) - 1, -1, -1):
+        message = messages[index]
+        if message["role"] == "assistant":
+            finished = {m["tool_call_id"] for m in messages[index + 1:] if m["role"] == "tool"}
+            return [tool_call for tool_call in message.get("tool_calls") or [] if tool_call["id"] not in finished]
+    return []
@@ -0,0 +1,90 @@
+import time
+from typing import Any, Optional
+
+
+class StreamAccumulator:
+    """
+    acompletion(stream=True)のチャンクを受け取り、本文とtool_callsの引数の断片を組み立てる。
+    最初のトークンが届いた時刻も記録し、time-to-first-tokenを計算できるようにする。
+    """
+
+    def __init__(self, started_at: Optional[float] = None):
+        # Pass the time the request was sent so the TTFT includes the wait for the response headers
+        self.started_at = started_at if started_at is not None else time.perf_counter()
+        self.first_token_at: Optional[float] = None
+        self.finished_at: Optional[float] = None
+        self.content_parts: list[str] = []
+        self.tool_calls: dict[int, dict] = {}
+        self.usage: Any = None
+        self.finish_reason: Optional[str] = None
+
+    def _mark_first_token(self) -> None:
+        if self.first_token_at is None:
+            self.first_token_at = time.perf_counter()
+
+    def add_chunk(self, chunk: Any) -> str:
+        """
+        チャンクを1つ取り込み、表示すべき本文の差分を返す
+        """
+        usage = getattr(chunk, "usage", None)
+        if usage:
+            self.usage = usage
+        if not chunk.choices:
+            return ""
+
+        choice = chunk.choices[0]
+        if choice.finish_reason:
+            self.finish_reason = choice.finish_reason
+        delta = choice.delta
+        if delta is None:
+            return ""
+
+        text = getattr(delta, "content", None) or ""
+        if text:
+            self._mark_first_token()
+            self.content_parts.append(text)
+
+        for fragment in getattr(delta, "tool_calls", None) or []:
+            self._mark_first_token()
+            index = fragment.index if fragment.index is not None else len(self.tool_calls)
+            tool_call = self.tool_calls.setdefault(index, {
+                "id": None,
+                "type": "function",
+                "function": {"name": "", "arguments": ""}
+            })
+            if fragment.id:
+                tool_call["id"] = fragment.id
+            function = fragment.function
+            if function is not None:
+                # The name arrives whole in the first fragment, the arguments arrive in pieces
+                if function.name and not tool_call["function"]["name"]:
+                    tool_call["function"]["name"] = function.name
+                if function.arguments:
+                    tool_call["function"]["arguments"] += function.arguments
+        return text
+
+    def finish(self) -> None:
+        self.finished_at = time.perf_counter()
+
+    @property
+    def content(self) -> Optional[str]:
+        return "".join(self.content_parts) if self.content_parts else None
+
+    @property
+    def ttft(self) -> Optional[float]:
+        if self.first_token_at is None:
+            return None
+        return self.first_token_at - self.started_at
+
+    @property
+    def elapsed(self) -> float:
+        return (self.finished_at or time.perf_counter()) - self.started_at
+
+    def message(self) -> dict:
+        """
+        message_history_stateに追加するassistantメッセージを返す
+        """
+        message = {"role": "assistant", "content": self.content}
+        if self.tool_calls:
+            message["tool_calls"] = [self.tool_calls[index] for index in sorted(self.tool_calls)]
+        return message
@@ -0,0 +1,21 @@
+from completion_cache import CompletionCache
+
+
+def tool_result(stderr: str, resources: str) -> dict:
+    content = f"Process ID: process_0\n\nStdout:\n\n\nStderr:\n{stderr}\n\nReturn Code: 1\n\nResources: {resources}"
+    return {"role": "tool", "tool_call_id": "call_0", "name": "execute_code", "content": content}
+
+
+def test_key_ignores_measured_resources_and_scratch_directory():
+    first = [{"role": "user", "content": "run it"},
+             tool_result('  File "/tmp/session_k2j4x9/process_0.py", line 1', "CPU 0.01s user + 0.00s system, wall time 0.05s")]
+    second = [{"role": "user", "content": "run it"},
+              tool_result('  File "/tmp/session_8qz_1a/process_0.py", line 1', "CPU 0.03s user + 0.01s system, wall time 0.42s")]
+    assert CompletionCache.make_key("model", first, None) == CompletionCache.make_key("model", second, None)
+    assert "wall time 0.05s" in first[1]["content"]
+
+
+def test_key_still_depends_on_tool_output():
+    first = [tool_result("", "wall time 0.05s")]
+    second = [tool_result("NameError: name 'x' is not defined", "wall time 0.05s")]
+    assert CompletionCache.make_key("model", first, None) != CompletionCache.make_key("model", second, None)
@@ -0,0 +1,63 @@
+import pytest
+
+from file_ops import _parse_unified_diff, apply_unified_diff
+
+SOURCE = "".join(f"line {number}\n" for number in range(1, 8))
+
+
+def test_parse_hunk_with_file_headers():
+    patch = "--- a/x.py\n+++ b/x.py\n@@ -2,2 +2,2 @@\n line 2\n-line 3\n+line three\n"
+    assert _parse_unified_diff(patch) == [(2, 2, [(" ", "line 2"), ("-", "line 3"), ("+", "line three")])]
+
+
+def test_parse_defaults_missing_counts_to_one():
+    assert _parse_unified_diff("@@ -3 +3 @@\n-line 3\n+x\n") == [(3, 1, [("-", "line 3"), ("+", "x")])]
+
+
+def test_parse_header_like_lines_inside_hunk_are_content():
+    patch = "@@ -1,2 +1,2 @@\n--- old comment\n+++ counter\n keep\n"
+    assert _parse_unified_diff(patch)[0][2] == [("-", "-- old comment"), ("+", "++ counter"), (" ", "keep")]
+
+
+def test_parse_headers_between_files_after_counts_are_used_up():
+    patch = "@@ -1 +1 @@\n-a\n+b\ndiff --git a/y b/y\nindex 123..456\n--- a/y\n+++ b/y\n@@ -4,1 +4,1 @@\n-c\n+d\n"
+    hunks = _parse_unified_diff(patch)
+    assert [hunk[0] for hunk in hunks] == [1, 4]
+    assert hunks[1][2] == [("-", "c"), ("+", "d")]
+
+
+def test_parse_rejects_patch_without_hunks():
+    with pytest.raises(ValueError):
+        _parse_unified_diff("--- a/x\n+++ b/x\n")
+
+
+def test_remove_line_that_starts_with_two_dashes():
+    text = "SELECT 1;\n-- old comment\nSELECT 2;\n"
+    new_text, count = apply_unified_diff(text, "@@ -1,3 +1,2 @@\n SELECT 1;\n--- old comment\n SELECT 2;\n")
+    assert (new_text, count) == ("SELECT 1;\nSELECT 2;\n", 1)
+
+
+def test_add_line_that_starts_with_two_pluses():
+    text = "int counter = 0;\n}\n"
+    new_text, _ = apply_unified_diff(text, "@@ -1,2 +1,3 @@\n int counter = 0;\n+++ counter\n }\n")
+    assert new_text == "int counter = 0;\n++ counter\n}\n"
+
+
+def test_pure_insertion_goes_after_old_start():
+    new_text, _ = apply_unified_diff(SOURCE, "@@ -5,0 +6,1 @@\n+# end\n")
+    assert new_text.splitlines()[4:6] == ["line 5", "# end"]
+
+
+def test_pure_insertion_at_start_of_file():
+    new_text, _ = apply_unified_diff(SOURCE, "@@ -0,0 +1,1 @@\n+# start\n")
+    assert new_text.splitlines()[:2] == ["# start", "line 1"]
+
+
+def test_hunk_with_shifted_line_numbers_still_applies():
+    new_text, _ = apply_unified_diff(SOURCE, "@@ -10,3 +10,3 @@\n line 3\n-line 4\n+line four\n line 5\n")
+    assert "line four\n" in new_text and "line 4\n" not in new_text
+
+
+def test_mismatched_hunk_is_rejected():
+    with pytest.raises(ValueError, match="does not match"):
+        apply_unified_diff(SOURCE, "@@ -1,1 +1,1 @@\n-not there\n+x\n")
@@ -0,0 +1,24 @@
+import asyncio
+import signal
+import sys
+import time
+
+from interpreter_pool import InterpreterPool
+from process_output import read_buffers
+
+
+def test_job_sent_to_a_dead_idle_worker_runs_on_a_fresh_one(tmp_path):
+    async def run():
+        pool = InterpreterPool(sys.executable, size=1)
+        await pool.start()
+        try:
+            pool._idle._queue[0].process.send_signal(signal.SIGKILL)
+            # Block the loop so the exit is not noticed before the job is sent to the dead worker
+            time.sleep(0.5)
+            return await pool.run("print('ran')", str(tmp_path / "job.py"), str(tmp_path), timeout=30)
+        finally:
+            await pool.close()
+
+    result = asyncio.run(run())
+    assert result.return_code == 0
+    assert read_buffers(result.stdout, result.stderr)["stdout"] == "ran\n"
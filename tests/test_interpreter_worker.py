@@ -0,0 +1,53 @@
+import json
+import os
+import subprocess
+import sys
+import textwrap
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+SCRIPT = textwrap.dedent("""
+    from __future__ import annotations
+
+    import dataclasses
+    import multiprocessing
+    import pickle
+    import typing
+
+
+    @dataclasses.dataclass
+    class Point:
+        x: int
+        y: Point | None = None
+
+
+    def square(value: int) -> int:
+        return value * value
+
+
+    if __name__ == "__main__":
+        print(pickle.loads(pickle.dumps(Point(1))) == Point(1))
+        print(typing.get_type_hints(Point)["x"] is int)
+        with multiprocessing.get_context("spawn").Pool(1) as pool:
+            print(pool.map(square, [2, 3]))
+""")
+
+
+def run_jobs(tmp_path, count: int) -> subprocess.CompletedProcess:
+    script = tmp_path / "job.py"
+    script.write_text(SCRIPT)
+    jobs = "".join(
+        json.dumps({"code": SCRIPT, "filename": str(script), "cwd": str(tmp_path), "token": f"t{i}"}) + "\n"
+        for i in range(count)
+    )
+    return subprocess.run([sys.executable, os.path.join(ROOT, "interpreter_worker.py")], input=jobs,
+                          capture_output=True, text=True, timeout=60)
+
+
+def test_job_runs_as_a_real_main_module(tmp_path):
+    result = run_jobs(tmp_path, 2)
+    # Each job is framed by an acknowledgement ("t0+") and an end marker ("t0:<return code>:...")
+    parts = [part for part in result.stdout.split("\0") if part]
+    assert parts[0::3] == ["t0+", "t1+"]
+    assert parts[1::3] == ["True\nTrue\n[4, 9]\n"] * 2, result.stderr
+    assert [marker.split(":")[:2] for marker in parts[2::3]] == [["t0", "0"], ["t1", "0"]]
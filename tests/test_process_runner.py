@@ -0,0 +1,30 @@
+import json
+import os
+import subprocess
+import sys
+
+from process_supervisor import LIMITS_ENV, ProcessLimits
+from test_interpreter_worker import ROOT, SCRIPT
+
+
+def test_script_runs_as_a_real_main_module(tmp_path):
+    script, usage = tmp_path / "job.py", tmp_path / "job.usage.json"
+    script.write_text(SCRIPT)
+    result = subprocess.run([sys.executable, os.path.join(ROOT, "process_runner.py"), str(script), str(usage)],
+                            cwd=tmp_path, capture_output=True, text=True, timeout=60)
+    assert result.returncode == 0, result.stderr
+    assert result.stdout == "True\nTrue\n[4, 9]\n"
+    assert set(json.loads(usage.read_text())) == {"user", "system", "max_rss"}
+
+
+def test_runner_applies_limits_to_itself(tmp_path):
+    script, usage = tmp_path / "job.py", tmp_path / "job.usage.json"
+    script.write_text(
+        "import os, resource\n"
+        "print(resource.getrlimit(resource.RLIMIT_CPU)[0], resource.getrlimit(resource.RLIMIT_NOFILE)[0])\n"
+        f"print({LIMITS_ENV!r} in os.environ)\n"
+    )
+    env = dict(os.environ, **ProcessLimits(cpu_seconds=30, open_files=64).environment())
+    result = subprocess.run([sys.executable, os.path.join(ROOT, "process_runner.py"), str(script), str(usage)],
+                            cwd=tmp_path, env=env, capture_output=True, text=True, timeout=60)
+    assert result.stdout == "30 64\nFalse\n", result.stderr
@@ -0,0 +1,54 @@
+import asyncio
+import sys
+
+from process_output import ManagedProcess
+from process_supervisor import ProcessSupervisor
+
+
+async def start(supervisor: ProcessSupervisor, code: str) -> str:
+    process_id = supervisor.new_process_id()
+    await supervisor.acquire(None)
+    process = await asyncio.create_subprocess_exec(sys.executable, "-c", code, stdout=asyncio.subprocess.PIPE,
+                                                   stderr=asyncio.subprocess.PIPE, start_new_session=True)
+    managed = ManagedProcess.start(process, 1024)
+    supervisor.track(process_id, managed, 0.0)
+    supervisor.keep(process_id, managed)
+    return process_id
+
+
+def test_finished_process_is_forgotten_once_its_output_is_read(tmp_path):
+    async def run():
+        supervisor = ProcessSupervisor(str(tmp_path), use_cgroup=False)
+        try:
+            process_id = await start(supervisor, "print('done')")
+            managed = supervisor.processes[process_id]
+            await managed.wait(30)
+            assert not supervisor.forget_if_drained(process_id)
+            assert managed.read()["stdout"] == "done\n"
+            assert supervisor.forget_if_drained(process_id)
+            assert process_id not in supervisor.processes
+            assert supervisor.exits[process_id]["return_code"] == 0
+        finally:
+            supervisor.close()
+
+    asyncio.run(run())
+
+
+def test_unread_finished_processes_are_capped(tmp_path):
+    async def run():
+        supervisor = ProcessSupervisor(str(tmp_path), use_cgroup=False, max_finished=2)
+        try:
+            process_ids = []
+            for _ in range(4):
+                process_ids.append(await start(supervisor, "print('unread')"))
+                await supervisor.processes[process_ids[-1]].wait(30)
+            # The newest one is kept while the cap applies to those that had already finished
+            assert list(supervisor.processes) == process_ids[1:]
+            running = await start(supervisor, "import time; time.sleep(0.5)")
+            assert list(supervisor.processes) == process_ids[2:] + [running]
+            assert set(supervisor.exits) >= set(process_ids)
+            await supervisor.processes[running].wait(30)
+        finally:
+            supervisor.close()
+
+    asyncio.run(run())
@@ -0,0 +1,79 @@
+import asyncio
+import json
+import os
+import time
+
+from file_ops import apply_search_replace, atomic_write
+from tool_dispatcher import ToolDispatcher
+
+
+def make_tool_call(call_id: str, name: str, arguments: dict) -> dict:
+    return {"id": call_id, "type": "function", "function": {"name": name, "arguments": json.dumps(arguments)}}
+
+
+def test_wall_time_is_close_to_the_slowest_call():
+    def blocking_read(args: dict) -> str:
+        time.sleep(args["delay"])
+        return "read"
+
+    async def async_execute(args: dict) -> str:
+        await asyncio.sleep(args["delay"])
+        return "executed"
+
+    delays = [("read_file", 0.2)] * 5 + [("execute_code", 0.4), ("execute_code", 0.3)]
+    tool_calls = [make_tool_call(f"call_{i}", name, {"delay": delay}) for i, (name, delay) in enumerate(delays)]
+    dispatcher = ToolDispatcher({"read_file": blocking_read, "execute_code": async_execute}, max_concurrency=8)
+    try:
+        started = time.perf_counter()
+        messages = asyncio.run(dispatcher.dispatch(tool_calls))
+        elapsed = time.perf_counter() - started
+    finally:
+        dispatcher.shutdown()
+
+    assert [message["tool_call_id"] for message in messages] == [tool_call["id"] for tool_call in tool_calls]
+    assert elapsed < 0.4 * 1.5 < sum(delay for _, delay in delays)
+
+
+def test_edits_to_the_same_path_run_in_call_order(tmp_path):
+    path = tmp_path / "module.py"
+    path.write_text("a = 0\n")
+
+    def apply_patch(args: dict) -> str:
+        with open(args["path"]) as f:
+            text = f.read()
+        # Widen the read-modify-write window so concurrent edits would overwrite each other
+        time.sleep(0.05)
+        text, _ = apply_search_replace(text, [{"search": args["search"], "replace": args["replace"]}])
+        atomic_write(args["path"], text)
+        return "Applied"
+
+    edits = [{"path": str(path), "search": f"a = {i}\n", "replace": f"a = {i + 1}\n"} for i in range(4)]
+    # A second spelling of the same file must still be serialized
+    edits[2]["path"] = os.path.join(str(tmp_path), ".", "module.py")
+    tool_calls = [make_tool_call(f"call_{i}", "apply_patch", edit) for i, edit in enumerate(edits)]
+    dispatcher = ToolDispatcher({"apply_patch": apply_patch}, max_concurrency=8,
+                                serialize_keys={"apply_patch": lambda args: os.path.realpath(args["path"])})
+    try:
+        messages = asyncio.run(dispatcher.dispatch(tool_calls))
+    finally:
+        dispatcher.shutdown()
+
+    assert [message["content"] for message in messages] == ["Applied"] * 4
+    assert path.read_text() == "a = 4\n"
+
+
+def test_edits_to_different_paths_still_run_concurrently(tmp_path):
+    def slow_write(args: dict) -> str:
+        time.sleep(0.2)
+        return args["path"]
+
+    tool_calls = [make_tool_call(f"call_{i}", "update_file", {"path": str(tmp_path / f"{i}.py")}) for i in range(4)]
+    dispatcher = ToolDispatcher({"update_file": slow_write}, serialize_keys={"update_file": lambda args: args["path"]})
+    try:
+        started = time.perf_counter()
+        asyncio.run(dispatcher.dispatch(tool_calls))
+        elapsed = time.perf_counter() - started
+    finally:
+        dispatcher.shutdown()
+
+    assert elapsed < 0.2 * 2
@@ -0,0 +1,85 @@
+import os
+import threading
+import time
+
+from search_index import SearchIndex
+from workspace_index import WorkspaceIndex, _translate
+
+
+def make_tree(root) -> None:
+    (root / "sessions").mkdir()
+    (root / "sessions" / "abc.jsonl").write_text('{"content": "needle"}\n')
+    (root / "trace.jsonl").write_text('{"name": "needle"}\n')
+    (root / "app.py").write_text("needle = 1\n")
+
+
+def test_walk_does_not_expand_ignored_paths(tmp_path):
+    make_tree(tmp_path)
+    index = WorkspaceIndex(str(tmp_path), ignored_paths={str(tmp_path / "sessions"), str(tmp_path / "trace.jsonl")})
+    entries, _ = index.walk(str(tmp_path))
+    assert entries == ["app.py", "sessions/ (ignored)"]
+    assert index.is_ignored(str(tmp_path / "sessions" / "abc.jsonl"))
+
+
+def test_ignored_paths_match_by_location_not_name(tmp_path):
+    make_tree(tmp_path)
+    (tmp_path / "src").mkdir()
+    (tmp_path / "src" / "sessions").mkdir()
+    index = WorkspaceIndex(str(tmp_path), ignored_paths={str(tmp_path / "sessions")})
+    assert not index.is_ignored(str(tmp_path / "src" / "sessions"))
+
+
+def test_search_skips_ignored_paths(tmp_path):
+    make_tree(tmp_path)
+    relative = os.path.relpath(tmp_path / "sessions")
+    index = WorkspaceIndex(str(tmp_path), ignored_paths={relative, str(tmp_path / "trace.jsonl")})
+    output, matches, _ = SearchIndex(index).search("needle")
+    assert output == ["app.py:1: needle = 1"]
+    assert matches == 1
+
+
+def test_mark_dirty_during_refresh_is_not_lost(tmp_path):
+    make_tree(tmp_path)
+    search_index = SearchIndex(WorkspaceIndex(str(tmp_path)))
+    walk = search_index.workspace.walk
+
+    def walk_then_mark_dirty(*args, **kwargs):
+        result = walk(*args, **kwargs)
+        search_index.mark_dirty()
+        return result
+
+    search_index.workspace.walk = walk_then_mark_dirty
+    search_index.refresh()
+    assert search_index._dirty
+
+
+def test_search_during_refresh_waits_for_the_full_index(tmp_path):
+    for i in range(200):
+        (tmp_path / f"module_{i}.py").write_text(f"value_{i} = {i}\n")
+    (tmp_path / "target.py").write_text("def find_me():\n    pass\n")
+    search_index = SearchIndex(WorkspaceIndex(str(tmp_path)))
+    walk = search_index.workspace.walk
+    walking = threading.Event()
+
+    def slow_walk(*args, **kwargs):
+        walking.set()
+        time.sleep(0.2)
+        return walk(*args, **kwargs)
+
+    search_index.workspace.walk = slow_walk
+    results = {}
+    first = threading.Thread(target=lambda: results.setdefault("first", search_index.search("find_me")))
+    first.start()
+    assert walking.wait(5)
+    results["second"] = search_index.search("find_me")
+    first.join()
+    assert results["first"][1] == results["second"][1] == 1
+
+
+def test_gitignore_bracket_negation():
+    assert _translate("[!abc].py").match("d.py")
+    assert not _translate("[!abc].py").match("a.py")
+    assert _translate("[!abc].py").match("!.py")
+    assert not _translate("log[!0-9]").match("log/")
+    assert _translate("[]a]").match("]")
+    assert _translate("[abc].py").match("b.py")
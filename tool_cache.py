@@ -0,0 +1,71 @@
+import os
+import threading
+import time
+from typing import Hashable, Optional, Tuple
+
+# Same "racy" rule as WorkspaceIndex: a file modified this recently may change again without its stat changing
+RACY_WINDOW_NS = 2_000_000_000
+
+
+def stat_fingerprint(path: str) -> Optional[Tuple[int, int, int]]:
+    """
+    (mtime, size, inode)を返す。ファイルが無いか、変更されたばかりで信用できない場合はNone
+    """
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    if st.st_mtime_ns > time.time_ns() - RACY_WINDOW_NS:
+        return None
+    return st.st_mtime_ns, st.st_size, st.st_ino
+
+
+class ToolResultCache:
+    """
+    read_file/list_filesの結果をセッション内で覚えておくキャッシュ。
+    エントリはパスとfingerprint(stat情報など)の組で有効性を判定するので、execute_codeのような外部からの変更も検出できる。
+    エージェント自身の書き込みはinvalidateで即座に反映する。
+    """
+
+    def __init__(self):
+        self._entries: dict[Hashable, Tuple[str, Hashable, str, str]] = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+
+    def lookup(self, key: Hashable, fingerprint: Optional[Hashable]) -> Optional[Tuple[str, str]]:
+        """
+        fingerprintが保存時と同じなら(結果, その結果を返した呼び出しのID)を返す
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if fingerprint is not None and entry is not None and entry[1] == fingerprint:
+                self.hits += 1
+                return entry[2], entry[3]
+            self.misses += 1
+            return None
+
+    def store(self, key: Hashable, path: str, fingerprint: Optional[Hashable], result: str, call_id: str) -> None:
+        if fingerprint is None:
+            return
+        with self._lock:
+            self._entries[key] = (os.path.abspath(path), fingerprint, result, call_id)
+
+    def invalidate(self, path: str) -> None:
+        """
+        pathそのものと、pathを含むディレクトリの一覧のエントリを捨てる
+        """
+        path = os.path.abspath(path)
+        with self._lock:
+            stale = [
+                key for key, (entry_path, _, _, _) in self._entries.items()
+                if entry_path == path or path.startswith(entry_path.rstrip(os.sep) + os.sep)
+            ]
+            for key in stale:
+                del self._entries[key]
+            self.invalidations += len(stale)
+
+    def stats(self) -> dict[str, int]:
+        with self._lock:
+            return {"hits": self.hits, "misses": self.misses, "invalidations": self.invalidations, "entries": len(self._entries)}
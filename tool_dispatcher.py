@@ -0,0 +1,113 @@
+import asyncio
+import contextvars
+import functools
+import inspect
+import json
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Awaitable, Callable, Optional, Union
+
+import tracing
+
+ToolHandler = Callable[[dict], Union[str, Awaitable[str]]]
+# Returns what a call writes to (e.g. a resolved file path), or None if it can run alongside anything
+ToolKey = Callable[[dict], Optional[str]]
+
+UNKNOWN_FUNCTION_RESULT = "Unknown function called."
+
+# The tool_call_id being handled, so handlers can refer back to earlier calls
+current_tool_call_id: contextvars.ContextVar[str] = contextvars.ContextVar("current_tool_call_id", default="")
+
+
+class ToolDispatcher:
+    """
+    1ターン分のtool_callsを並行に実行する。
+    asyncハンドラ(サブプロセス系)はイベントループ上で、同期ハンドラ(ファイルI/O)はスレッドプールで実行し、
+    同時実行数はmax_concurrencyで制限する。結果はtool_callsと同じ順番で返す。
+    serialize_keysにツール名から書き込み先を返す関数を渡すと、同じ書き込み先を持つ呼び出しは
+    並行にせずtool_callsの順に1つずつ実行する(同じファイルへの編集が互いを上書きしないように)。
+    """
+
+    def __init__(self, handlers: dict[str, ToolHandler], max_concurrency: int = 8,
+                 serialize_keys: Optional[dict[str, ToolKey]] = None):
+        if max_concurrency < 1:
+            raise ValueError("max_concurrency must be at least 1")
+        self.handlers = handlers
+        self.max_concurrency = max_concurrency
+        self.serialize_keys = serialize_keys or {}
+        self._executor = ThreadPoolExecutor(max_workers=max_concurrency, thread_name_prefix="tool")
+
+    async def _run_one(self, tool_call: dict, semaphore: asyncio.Semaphore) -> str:
+        function_name = tool_call["function"]["name"]
+        handler = self.handlers.get(function_name)
+        if handler is None:
+            return UNKNOWN_FUNCTION_RESULT
+        try:
+            function_args = json.loads(tool_call["function"]["arguments"] or "{}")
+        except json.JSONDecodeError as e:
+            return f"Error parsing arguments for {function_name}: {str(e)}"
+
+        queued_at = time.perf_counter()
+        async with semaphore:
+            current_tool_call_id.set(tool_call["id"])
+            with tracing.tracer.span(f"tool.{function_name}", tool_call_id=tool_call["id"]) as span:
+                if span.recording:
+                    span.set(queue_wait=time.perf_counter() - queued_at, bytes_in=len(tool_call["function"]["arguments"] or ""))
+                try:
+                    if inspect.iscoroutinefunction(handler):
+                        result = await handler(function_args)
+                    else:
+                        loop = asyncio.get_running_loop()
+                        # run_in_executor does not carry context variables over to the thread by itself
+                        context = contextvars.copy_context()
+                        result = await loop.run_in_executor(self._executor, functools.partial(context.run, handler, function_args))
+                except Exception as e:
+                    span.set(error=str(e))
+                    return f"Error executing {function_name}: {str(e)}"
+                span.set(bytes_out=len(result))
+                return result
+
+    def _serialize_key(self, tool_call: dict) -> Optional[str]:
+        key_function = self.serialize_keys.get(tool_call["function"]["name"])
+        if key_function is None:
+            return None
+        try:
+            return key_function(json.loads(tool_call["function"]["arguments"] or "{}"))
+        except (json.JSONDecodeError, KeyError, TypeError, AttributeError):
+            # _run_one reports the bad arguments
+            return None
+
+    async def dispatch(self, tool_calls: list[dict], on_result: Optional[Callable[[dict], None]] = None) -> list[dict]:
+        """
+        tool_callsをまとめて実行し、message_history_stateに追加するtoolメッセージを返す
+        on_resultを渡すと、各toolメッセージを終わった順にすぐ受け取れる
+        """
+        semaphore = asyncio.Semaphore(self.max_concurrency)
+
+        async def run(tool_call: dict, after: Optional[asyncio.Future]) -> dict:
+            if after is not None:
+                # Wait for the previous call with the same key, whether it succeeded or not
+                await asyncio.wait([after])
+            result = await self._run_one(tool_call, semaphore)
+            message = {
+                "tool_call_id": tool_call["id"],
+                "role": "tool",
+                "name": tool_call["function"]["name"],
+                "content": result
+            }
+            if on_result is not None:
+                on_result(message)
+            return message
+
+        last_by_key: dict[str, asyncio.Future] = {}
+        tasks = []
+        for tool_call in tool_calls:
+            key = self._serialize_key(tool_call)
+            task = asyncio.ensure_future(run(tool_call, last_by_key.get(key) if key is not None else None))
+            if key is not None:
+                last_by_key[key] = task
+            tasks.append(task)
+        return list(await asyncio.gather(*tasks))
+
+    def shutdown(self) -> None:
+        self._executor.shutdown(wait=False)
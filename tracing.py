@@ -0,0 +1,181 @@
+import contextvars
+import json
+import secrets
+import threading
+import time
+from typing import Any, Optional
+
+TRACE_FORMATS = ("jsonl", "otlp")
+
+
+class _NoopSpan:
+    """
+    トレースが無効なときに返す何もしないspan。呼び出し側の負担がほぼゼロになるよう1つを使い回す
+    """
+    recording = False
+
+    def set(self, **attributes: Any) -> "_NoopSpan":
+        return self
+
+    def end(self) -> None:
+        pass
+
+    def __enter__(self) -> "_NoopSpan":
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> None:
+        pass
+
+
+NOOP_SPAN = _NoopSpan()
+_current_span: contextvars.ContextVar[Optional["Span"]] = contextvars.ContextVar("current_span", default=None)
+
+
+class Span:
+    recording = True
+
+    def __init__(self, tracer: "Tracer", name: str, attributes: dict):
+        parent = _current_span.get()
+        self.tracer = tracer
+        self.name = name
+        self.attributes = attributes
+        self.trace_id = parent.trace_id if parent is not None else secrets.token_hex(16)
+        self.span_id = secrets.token_hex(8)
+        self.parent_id = parent.span_id if parent is not None else None
+        self.start_ns = time.time_ns()
+        self._start = time.perf_counter()
+        self.duration: Optional[float] = None
+        self._token = _current_span.set(self)
+
+    def set(self, **attributes: Any) -> "Span":
+        self.attributes.update(attributes)
+        return self
+
+    def end(self) -> None:
+        if self.duration is not None:
+            return
+        self.duration = time.perf_counter() - self._start
+        try:
+            _current_span.reset(self._token)
+        except ValueError:
+            # Ended from a different context than it was started in
+            pass
+        self.tracer._finish(self)
+
+    def __enter__(self) -> "Span":
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> None:
+        if exc_type is not None:
+            self.attributes["error"] = f"{exc_type.__name__}: {exc}"
+        self.end()
+
+
+def _otlp_value(value: Any) -> dict:
+    if isinstance(value, bool):
+        return {"boolValue": value}
+    if isinstance(value, int):
+        return {"intValue": str(value)}
+    if isinstance(value, float):
+        return {"doubleValue": value}
+    return {"stringValue": str(value)}
+
+
+class Tracer:
+    """
+    LLM呼び出し・ツール実行・サブプロセスの区間(span)を記録し、終わったものから順にファイルへ書き出す。
+    formatがjsonlなら1行1span、otlpならOpenTelemetryのOTLP/JSON(ExportTraceServiceRequest)を1行1span。
+    名前ごとの回数と時間も集計しておき、summaryでホットスポットを返す。
+    """
+
+    def __init__(self, path: Optional[str] = None, format: str = "jsonl", service_name: str = "swe-agent"):
+        if format not in TRACE_FORMATS:
+            raise ValueError(f"unknown trace format {format!r}, expected one of {', '.join(TRACE_FORMATS)}")
+        self.enabled = path is not None
+        self.format = format
+        self.service_name = service_name
+        self._file = open(path, "a") if path is not None else None
+        self._lock = threading.Lock()
+        self._totals: dict[str, list] = {}
+
+    def span(self, name: str, **attributes: Any):
+        """
+        with文でもstart/endでも使えるspanを返す。無効ならNOOP_SPAN
+        """
+        if not self.enabled:
+            return NOOP_SPAN
+        return Span(self, name, attributes)
+
+    def _finish(self, span: Span) -> None:
+        record = self._otlp_record(span) if self.format == "otlp" else {
+            "trace_id": span.trace_id,
+            "span_id": span.span_id,
+            "parent_id": span.parent_id,
+            "name": span.name,
+            "start": span.start_ns / 1e9,
+            "duration": span.duration,
+            "attributes": span.attributes
+        }
+        line = json.dumps(record, ensure_ascii=False, default=str)
+        with self._lock:
+            totals = self._totals.setdefault(span.name, [0, 0.0, 0.0])
+            totals[0] += 1
+            totals[1] += span.duration
+            totals[2] = max(totals[2], span.duration)
+            # A span still open when the tracer was closed is counted but not written
+            if self._file is not None:
+                self._file.write(line + "\n")
+                self._file.flush()
+
+    def _otlp_record(self, span: Span) -> dict:
+        return {"resourceSpans": [{
+            "resource": {"attributes": [{"key": "service.name", "value": {"stringValue": self.service_name}}]},
+            "scopeSpans": [{
+                "scope": {"name": "swe-agent"},
+                "spans": [{
+                    "traceId": span.trace_id,
+                    "spanId": span.span_id,
+                    "parentSpanId": span.parent_id or "",
+                    "name": span.name,
+                    "kind": 1,
+                    "startTimeUnixNano": str(span.start_ns),
+                    "endTimeUnixNano": str(span.start_ns + int(span.duration * 1e9)),
+                    "attributes": [{"key": key, "value": _otlp_value(value)} for key, value in span.attributes.items() if value is not None]
+                }]
+            }]
+        }]}
+
+    def summary(self, top: int = 10) -> list[dict]:
+        """
+        合計時間の長い順に、span名ごとの回数・合計・平均・最大を返す
+        """
+        with self._lock:
+            rows = [
+                {"name": name, "count": count, "total": total, "mean": total / count, "max": longest}
+                for name, (count, total, longest) in self._totals.items()
+            ]
+        return sorted(rows, key=lambda row: row["total"], reverse=True)[:top]
+
+    def close(self) -> None:
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+            self.enabled = False
+
+
+tracer = Tracer()
+
+
+def configure(path: Optional[str], format: str = "jsonl") -> Tracer:
+    """
+    モジュール全体で使うtracerを差し替える。pathがNoneならトレースは無効
+    """
+    global tracer
+    tracer.close()
+    tracer = Tracer(path, format)
+    return tracer
+
+
+def current_span():
+    span = _current_span.get()
+    return span if span is not None else NOOP_SPAN
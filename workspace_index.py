@@ -0,0 +1,244 @@
+import fnmatch
+import os
+import re
+import threading
+import time
+from typing import Optional, Tuple
+
+DEFAULT_IGNORED_NAMES = frozenset({".git", "node_modules", "code_execution_env", "__pycache__", ".venv", "venv"})
+# A directory modified this close to when it was scanned may change again within the same mtime tick
+# (the same "racy" problem git has), so such a scan is not trusted
+RACY_WINDOW_NS = 2_000_000_000
+
+
+def _translate(pattern: str) -> re.Pattern:
+    """
+    .gitignoreのglob(*, ?, [...], **)を/をまたがない正規表現に変換する
+    """
+    regex = ""
+    i = 0
+    while i < len(pattern):
+        if pattern.startswith("**/", i):
+            regex += "(?:.*/)?"
+            i += 3
+        elif pattern.startswith("**", i):
+            regex += ".*"
+            i += 2
+        elif pattern[i] == "*":
+            regex += "[^/]*"
+            i += 1
+        elif pattern[i] == "?":
+            regex += "[^/]"
+            i += 1
+        elif pattern[i] == "[":
+            negate = pattern.startswith(("!", "^"), i + 1)
+            start = i + 2 if negate else i + 1
+            # A "]" right after the opening (or after the negation) is a member, not the end of the class
+            end = pattern.find("]", start + 1)
+            if end == -1:
+                regex += re.escape(pattern[i])
+                i += 1
+            else:
+                body = pattern[start:end].replace("]", "\\]")
+                # gitignore negates with "!" as well as "^"; a negated class still never matches "/"
+                regex += ("[^/" if negate else "[") + body + "]"
+                i = end + 1
+        else:
+            regex += re.escape(pattern[i])
+            i += 1
+    return re.compile(regex + r"\Z")
+
+
+class _IgnoreRule:
+    def __init__(self, line: str):
+        self.negate = line.startswith("!")
+        if self.negate:
+            line = line[1:]
+        self.dir_only = line.endswith("/")
+        line = line.rstrip("/")
+        # A pattern with a slash is relative to the .gitignore's directory, otherwise it matches any basename
+        self.anchored = "/" in line
+        self.regex = _translate(line.lstrip("/"))
+
+    def matches(self, relative_path: str, is_dir: bool) -> bool:
+        if self.dir_only and not is_dir:
+            return False
+        target = relative_path if self.anchored else relative_path.rsplit("/", 1)[-1]
+        return self.regex.match(target) is not None
+
+
+def _parse_gitignore(path: str) -> list[_IgnoreRule]:
+    rules = []
+    try:
+        with open(path, "r", errors="replace") as f:
+            for line in f:
+                line = line.rstrip("\n").rstrip()
+                if line and not line.startswith("#"):
+                    rules.append(_IgnoreRule(line))
+    except OSError:
+        pass
+    return rules
+
+
+class WorkspaceIndex:
+    """
+    list_files用のディレクトリ索引。ディレクトリごとのエントリ一覧をmtimeと一緒に覚えておき、
+    mtimeが変わったディレクトリだけを読み直す。エージェント自身の書き込みはnotify_*で直接反映する。
+    ignored_pathsには名前ではなく場所で外したいもの(セッションログやトレースの出力先など)を渡す。
+    """
+
+    def __init__(self, root: str, ignored_names: frozenset = DEFAULT_IGNORED_NAMES, ignored_paths: frozenset = frozenset()):
+        self.root = os.path.abspath(root)
+        self.ignored_names = ignored_names
+        self.ignored_paths = frozenset(os.path.abspath(path) for path in ignored_paths)
+        self._dirs: dict[str, Tuple[int, int, list[Tuple[str, bool]]]] = {}
+        self._gitignores: dict[str, Tuple[int, list[_IgnoreRule]]] = {}
+        self._lock = threading.Lock()
+        self.scans = 0
+
+    def _entries(self, directory: str) -> list[Tuple[str, bool]]:
+        mtime_ns = os.stat(directory).st_mtime_ns
+        with self._lock:
+            cached = self._dirs.get(directory)
+            if cached is not None and cached[0] == mtime_ns and mtime_ns < cached[1] - RACY_WINDOW_NS:
+                return cached[2]
+        scanned_at = time.time_ns()
+        with os.scandir(directory) as it:
+            entries = sorted((entry.name, entry.is_dir(follow_symlinks=False)) for entry in it)
+        with self._lock:
+            self._dirs[directory] = (mtime_ns, scanned_at, entries)
+            self.scans += 1
+        return entries
+
+    def _rules(self, directory: str) -> list[_IgnoreRule]:
+        path = os.path.join(directory, ".gitignore")
+        try:
+            mtime_ns = os.stat(path).st_mtime_ns
+        except OSError:
+            return []
+        cached = self._gitignores.get(directory)
+        if cached is None or cached[0] != mtime_ns:
+            cached = (mtime_ns, _parse_gitignore(path))
+            self._gitignores[directory] = cached
+        return cached[1]
+
+    def _inherited_rules(self, directory: str) -> list[Tuple[str, list[_IgnoreRule]]]:
+        """
+        rootからdirectoryの親までの.gitignoreを上から順に集める
+        """
+        if os.path.commonpath([self.root, directory]) != self.root:
+            return []
+        chain = []
+        current = directory
+        while current != self.root:
+            current = os.path.dirname(current)
+            chain.append(current)
+        return [(d, self._rules(d)) for d in reversed(chain)]
+
+    def _is_ignored(self, name: str, path: str, is_dir: bool, rule_stack: list[Tuple[str, list[_IgnoreRule]]]) -> bool:
+        if name in self.ignored_names or path in self.ignored_paths:
+            return True
+        ignored = False
+        # Later (deeper, later-listed) rules win, like git
+        for base, rules in rule_stack:
+            relative = os.path.relpath(path, base).replace(os.sep, "/")
+            for rule in rules:
+                if rule.matches(relative, is_dir):
+                    ignored = not rule.negate
+        return ignored
+
+    def is_ignored(self, path: str) -> bool:
+        """
+        root以下のpathが、それ自身か途中のディレクトリのせいでwalkから外れるかを返す
+        """
+        path = os.path.abspath(path)
+        if path == self.root or os.path.commonpath([self.root, path]) != self.root:
+            return False
+        parts = os.path.relpath(path, self.root).split(os.sep)
+        current = self.root
+        stack = [(current, self._rules(current))]
+        for depth, name in enumerate(parts, start=1):
+            current = os.path.join(current, name)
+            is_dir = depth < len(parts) or os.path.isdir(current)
+            if self._is_ignored(name, current, is_dir, stack):
+                return True
+            if is_dir:
+                stack = stack + [(current, self._rules(current))]
+        return False
+
+    def listdir(self, directory: str) -> list[str]:
+        return [name for name, _ in self._entries(os.path.abspath(directory))]
+
+    def walk(self, directory: str, max_depth: Optional[int] = None, pattern: Optional[str] = None,
+             max_entries: Optional[int] = None) -> Tuple[list[str], int]:
+        """
+        directory以下を再帰的にたどり、(directoryからの相対パスの一覧, 上限で省いた件数)を返す。
+        無視されたファイルは載せず、無視されたディレクトリは"(ignored)"を付けて載せるが中には入らない
+        """
+        directory = os.path.abspath(directory)
+        results: list[str] = []
+        omitted = 0
+        rule_stack = self._inherited_rules(directory)
+
+        def visit(current: str, prefix: str, depth: int, stack: list) -> None:
+            nonlocal omitted
+            stack = stack + [(current, self._rules(current))]
+            for name, is_dir in self._entries(current):
+                path = os.path.join(current, name)
+                relative = prefix + name
+                ignored = self._is_ignored(name, path, is_dir, stack)
+                if ignored and not is_dir:
+                    continue
+                if pattern is None or (not is_dir and (fnmatch.fnmatch(relative, pattern) or fnmatch.fnmatch(name, pattern))):
+                    if max_entries is not None and len(results) >= max_entries:
+                        omitted += 1
+                    else:
+                        label = relative + ("/" if is_dir else "")
+                        results.append(label + (" (ignored)" if ignored else ""))
+                if is_dir and not ignored and (max_depth is None or depth < max_depth):
+                    visit(path, relative + "/", depth + 1, stack)
+
+        visit(directory, "", 1, rule_stack)
+        return results, omitted
+
+    def notify_created(self, path: str) -> None:
+        """
+        エージェントが作ったファイル/フォルダを親ディレクトリのキャッシュに直接加える。
+        makedirsで途中のディレクトリもできた場合に備えて、既に載っている親に着くまでさかのぼる
+        """
+        path = os.path.abspath(path)
+        with self._lock:
+            while True:
+                parent, name = os.path.split(path)
+                cached = self._dirs.get(parent)
+                if cached is None or not name:
+                    return
+                is_dir = os.path.isdir(path)
+                entries = cached[2]
+                known = any(entry_name == name for entry_name, _ in entries)
+                if not known:
+                    entries = sorted(entries + [(name, is_dir)])
+                self._refresh(parent, entries)
+                if known or parent == path:
+                    return
+                path = parent
+
+    def notify_updated(self, path: str) -> None:
+        """
+        中身だけ書き換えたファイルについて、一時ファイル+renameで変わった親のmtimeを覚え直す
+        """
+        path = os.path.abspath(path)
+        with self._lock:
+            parent, name = os.path.split(path)
+            cached = self._dirs.get(parent)
+            if cached is not None and any(entry_name == name for entry_name, _ in cached[2]):
+                self._refresh(parent, cached[2])
+
+    def _refresh(self, directory: str, entries: list[Tuple[str, bool]]) -> None:
+        try:
+            mtime_ns = os.stat(directory).st_mtime_ns
+        except OSError:
+            self._dirs.pop(directory, None)
+            return
+        # We know exactly what changed, so the entry is trusted without waiting out the racy window
+        self._dirs[directory] = (mtime_ns, mtime_ns + RACY_WINDOW_NS + 1, entries)